@@ -4,63 +4,94 @@ import asyncio
 import logging
 import pandas as pd
 from securedFiles import config
-import talib
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+from src.exchange_client import SingleFlightExchange
+from src.resilience import ResilientExchange
+from src.indicator_backend import indicators
+from src.indicator_cache import bar_indicators, indicator_cache
+from src.klines import RawKlineExchange, fetch_klines
+from src.log_pipeline import TRADE_EVENT, lazy, setup_logging
+from src.portfolio import plan_orders, submit_orders
+from src.signal_audit import SignalAudit
+from src.triggers import SignalGate
+
+setup_logging(logging.INFO, '%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
 # Initialize Binance exchange connection
-exchange = ccxt.binance({
+exchange = SingleFlightExchange(ResilientExchange(RawKlineExchange(ccxt.binance({
     'apiKey': config.API_KEY,
     'secret': config.SECRET,
     'enableRateLimit': True,
     'options': {'adjustForTimeDifference': True}
-})
+}))))
 
 # Define commission rate
 commission_rate = 0.001  # 0.1%
+ticker_interval = 5  # Seconds between bulk ticker refreshes
+signal_batch_window = 5  # Longest a signal waits in the scan's batch before the batch is sent
+
+# Per-bar trigger prices: skip the full evaluation of pairs whose price cannot produce a signal
+signal_gate = SignalGate(timeframe_ms=180_000)
+
+# Every evaluation's buy/sell conditions, bit-packed (see src.signal_audit)
+signal_audit = SignalAudit('audit/autobest', '3m')
 
 async def get_tradeable_pairs(quote_currency):
     try:
         await exchange.load_markets()
         return [symbol for symbol in exchange.symbols if quote_currency in symbol.split('/')]
     except Exception as e:
-        logger.error(f"Error loading markets: {e}")
+        logger.error("Error loading markets: %s", e)
         return []
 
+async def get_tickers(pairs):
+    try:
+        return await exchange.fetch_tickers(pairs)
+    except Exception as e:
+        logger.error("Error fetching tickers: %s", e)
+        return {}
+
 async def get_current_price(pair):
     try:
         ticker = await exchange.fetch_ticker(pair)
         current_price = ticker['last']
-        logger.info(f"Current market price for {pair}: {current_price}")
+        logger.info("Current market price for %s: %s", pair, current_price)
         return current_price
     except Exception as e:
-        logger.error(f"Error fetching current price for {pair}: {e}")
+        logger.error("Error fetching current price for %s: %s", pair, e)
         return None
 
 async def get_balance(currency):
     try:
         balance = await exchange.fetch_balance()
         available_balance = balance['free'][currency]
-        logger.info(f"Available balance for {currency}: {available_balance}")
+        logger.info("Available balance for %s: %s", currency, available_balance)
         return available_balance
     except Exception as e:
-        logger.error(f"Error fetching balance for {currency}: {e}")
+        logger.error("Error fetching balance for %s: %s", currency, e)
         return 0
 
+async def get_free_balances():
+    try:
+        balance = await exchange.fetch_balance()
+        return balance['free']
+    except Exception as e:
+        logger.error("Error fetching balances: %s", e)
+        return {}
+
 async def place_market_order(pair, side, amount):
     if amount <= 0:
-        logger.error(f"Invalid amount for {side} order: {amount}")
+        logger.error("Invalid amount for %s order: %s", side, amount)
         return None
     try:
         if side == 'buy':
             order = await exchange.create_market_buy_order(pair, amount)
         elif side == 'sell':
             order = await exchange.create_market_sell_order(pair, amount)
-        logger.info(f"Market {side} order placed for {pair}: {amount} units at market price.")
+        logger.info("Market %s order placed for %s: %s units at market price.", side, pair, amount, extra=TRADE_EVENT)
         return order
     except Exception as e:
-        logger.error(f"An error occurred placing a {side} order for {pair}: {e}")
+        logger.error("An error occurred placing a %s order for %s: %s", side, pair, e)
         return None
 
 async def convert_to_usdt(pair):
@@ -70,42 +101,42 @@ async def convert_to_usdt(pair):
         if asset_balance > 0:
             order_result = await place_market_order(pair, 'sell', asset_balance)
             if order_result:
-                logger.info(f"Converted {asset_balance} of {asset} to USDT")
+                logger.info("Converted %s of %s to USDT", asset_balance, asset, extra=TRADE_EVENT)
                 return order_result
         else:
-            logger.info(f"No {asset} balance to convert to USDT")
+            logger.info("No %s balance to convert to USDT", asset)
     except Exception as e:
-        logger.error(f"An error occurred converting {pair} to USDT: {e}")
+        logger.error("An error occurred converting %s to USDT: %s", pair, e)
     return None
 
 async def fetch_historical_prices(pair, limit=100):
     try:
-        ohlcv = await exchange.fetch_ohlcv(pair, timeframe='3m', limit=limit)
-        if ohlcv is None or len(ohlcv) == 0:
-            logger.info(f"No data returned for {pair}.")
+        # Raw klines straight into typed arrays, without ccxt's per-candle parsing
+        klines = await fetch_klines(exchange, pair, '3m', limit)
+        if len(klines) == 0:
+            logger.info("No data returned for %s.", pair)
             return pd.DataFrame()
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
+        df = klines.frame()
 
         df = preprocess_data(df)
 
         # Calculate technical indicators
-        df['ema'] = talib.EMA(df['close'], timeperiod=14)
-        df['wma'] = talib.WMA(df['close'], timeperiod=14)
-        df['upper_band'], df['middle_band'], df['lower_band'] = talib.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
-        df['trix'] = talib.TRIX(df['close'], timeperiod=15)
-        df['rsi'] = talib.RSI(df['close'], timeperiod=14)
-        df['macd'], df['macd_signal'], df['macd_hist'] = talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
-        df['atr'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=14)
-        df['slowk'], df['slowd'] = talib.STOCH(df['high'], df['low'], df['close'], fastk_period=14, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
-        df['cci'] = talib.CCI(df['high'], df['low'], df['close'], timeperiod=14)
-        df['obv'] = talib.OBV(df['close'], df['volume'])
+        bars = bar_indicators(pair, '3m', klines.timestamp)
+        df['ema'] = bars.EMA(df['close'], timeperiod=14)
+        df['wma'] = bars.WMA(df['close'], timeperiod=14)
+        df['upper_band'], df['middle_band'], df['lower_band'] = bars.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
+        df['trix'] = bars.TRIX(df['close'], timeperiod=15)
+        df['rsi'] = bars.RSI(df['close'], timeperiod=14)
+        df['macd'], df['macd_signal'], df['macd_hist'] = bars.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+        df['atr'] = bars.ATR(df['high'], df['low'], df['close'], timeperiod=14)
+        df['slowk'], df['slowd'] = bars.STOCH(df['high'], df['low'], df['close'], fastk_period=14, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
+        df['cci'] = bars.CCI(df['high'], df['low'], df['close'], timeperiod=14)
+        df['obv'] = bars.OBV(df['close'], df['volume'])
 
         return df
     except Exception as e:
-        logger.error(f"Error fetching historical prices for {pair}: {e}")
+        logger.error("Error fetching historical prices for %s: %s", pair, e)
         return pd.DataFrame()
 
 def preprocess_data(df):
@@ -113,10 +144,11 @@ def preprocess_data(df):
     if not all(col in df.columns for col in required_columns):
         raise ValueError("DataFrame must contain open, high, low, close, and volume columns")
 
-    df = df.ffill().bfill()
+    if df.isna().values.any():
+        df = df.ffill().bfill()
     return df
 
-def evaluate_trading_signals(df):
+def evaluate_trading_signals(df, pair=None):
     if df.empty:
         logger.info("DataFrame is empty.")
         return False, None
@@ -144,43 +176,77 @@ def evaluate_trading_signals(df):
         latest['cci'] > 100,
         latest['slowk'] > 80 and latest['slowd'] > 80
     ]
+    if pair is not None:
+        signal_audit.record(pair, df.index[-1], buy_conditions, sell_conditions)
 
     if all(buy_conditions):
-        logger.info(f"Buy signal conditions met: {dict(zip(['ema', 'wma', 'trix', 'close < Lower Band', 'rsi', 'macd', 'cci', 'stoch'], buy_conditions))}")
+        logger.info("Buy signal conditions met: %s", lazy(lambda: dict(zip(['ema', 'wma', 'trix', 'close < Lower Band', 'rsi', 'macd', 'cci', 'stoch'], buy_conditions))))
         return True, 'buy'
     elif all(sell_conditions):
-        logger.info(f"Sell signal conditions met: {dict(zip(['ema', 'wma', 'trix', 'close > Upper Band', 'rsi', 'macd', 'cci', 'stoch'], sell_conditions))}")
+        logger.info("Sell signal conditions met: %s", lazy(lambda: dict(zip(['ema', 'wma', 'trix', 'close > Upper Band', 'rsi', 'macd', 'cci', 'stoch'], sell_conditions))))
         return True, 'sell'
     return False, None
 
+# Size every signal of a scan against one balance snapshot and submit them together
+async def execute_signals(signals):
+    # Size at fresh prices: a signal's close can be a batch window old
+    tickers = await get_tickers([pair for pair, _, _ in signals])
+    signals = [(pair, action, (tickers.get(pair) or {}).get('last') or price) for pair, action, price in signals]
+    balances = await get_free_balances()
+    orders = plan_orders(signals, balances, 'USDT', min_order=10, fee_rate=commission_rate)
+    results = await submit_orders(orders, place_market_order)
+    for order, result in zip(orders, results):
+        if result:
+            logger.info("%s order placed for %s of %s at ~%s", order.side.capitalize(), order.amount, order.pair, order.price, extra=TRADE_EVENT)
+    return results
+
 async def trade():
     pairs = await get_tradeable_pairs('USDT')
+    next_stats = 0.0
     while True:
         try:
+            signals = []
+            batch_started = None
+            tickers = await get_tickers(pairs)
             for pair in pairs:
-                logger.info(f"Processing pair: {pair}")
+                ticker = tickers.get(pair) or {}
+                if ticker.get('last') and not signal_gate.needs_evaluation(pair, ticker['last'], ticker.get('timestamp')):
+                    continue
+                logger.info("Processing pair: %s", pair)
                 # Fetch historical data and evaluate trading signals
                 historical_data = await fetch_historical_prices(pair)
-                signal, action = evaluate_trading_signals(historical_data)
+                if not historical_data.empty:
+                    signal_gate.on_frame(pair, historical_data)
+                signal, action = evaluate_trading_signals(historical_data, pair)
                 if signal:
-                    usdt_balance = await get_balance('USDT')
-                    if action == 'buy' and usdt_balance > 10:  # Ensure there's enough USDT to make a purchase
-                        amount_to_buy = usdt_balance / historical_data['close'].iloc[-1]
-                        await place_market_order(pair, 'buy', amount_to_buy)
-                    elif action == 'sell':
-                        asset = pair.split('/')[0]
-                        asset_balance = await get_balance(asset)
-                        if asset_balance > 0:
-                            await place_market_order(pair, 'sell', asset_balance)
-                            await convert_to_usdt(pair)
-                
+                    signals.append((pair, action, historical_data['close'].iloc[-1]))
+                    if batch_started is None:
+                        batch_started = asyncio.get_running_loop().time()
+                # Send the batch once its oldest signal has waited a window, not at the end of the scan
+                if signals and asyncio.get_running_loop().time() - batch_started >= signal_batch_window:
+                    await execute_signals(signals)
+                    signals, batch_started = [], None
+
                 await asyncio.sleep(1)  # Short delay to prevent hitting rate limits
+            if signals:
+                await execute_signals(signals)
+            # Once per bar rather than on every ticker pass
+            if asyncio.get_running_loop().time() >= next_stats:
+                next_stats = asyncio.get_running_loop().time() + signal_gate.timeframe_ms / 1000
+                logger.info("Signal gate: %s", signal_gate.stats())
+                logger.info("Indicator cache: %s", indicator_cache.stats())
+            await asyncio.sleep(ticker_interval)
         except Exception as e:
-            logger.error(f"An error occurred during trading: {e}")
+            logger.error("An error occurred during trading: %s", e)
             await asyncio.sleep(60)  # Wait for 1 minute before retrying
 
 async def main():
-    await trade()
+    try:
+        await trade()
+    finally:
+        signal_audit.close()
 
 if __name__ == "__main__":
+    # Pick the indicator backends before the loop starts rather than inside the first scan
+    indicators.warm_up(100)
     asyncio.run(main())
@@ -1,42 +1,92 @@
 import datetime
+import time
 import ccxt.async_support as ccxt
 import asyncio
 import logging
 import pandas as pd
 from securedFiles import config
-import talib
+from src.backfill import timeframe_ms
+from src.bar_builder import BarBuilder, BarFeedExchange
+from src.exchange_client import SingleFlightExchange
+from src.resilience import ResilientExchange
+from src.indicator_backend import indicators
+from src.indicator_cache import bar_indicators, indicator_cache
+from src.log_pipeline import TRADE_EVENT, lazy, setup_logging
+from src.order_book import LocalBooks, cap_to_liquidity, stream_depth
+from src.pipeline import Pipeline, PositionTasks, Stage
+from src.signal_audit import SignalAudit
+from src.state_journal import StateJournal
+from src.tick_capture import capture
 
 # Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+setup_logging(logging.INFO, '%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+# Sub-minute bars built from the live trade stream of newly listed pairs
+bar_builder = BarBuilder(('1s', '5s', '15s'))
+
 # Initialize Binance exchange connection
-exchange = ccxt.binance({
+exchange = BarFeedExchange(SingleFlightExchange(ResilientExchange(ccxt.binance({
     'apiKey': config.API_KEY,
     'secret': config.SECRET,
     'enableRateLimit': True,
     'options': {'adjustForTimeDifference': True}
-})
+}))), bar_builder)
 
 # Parameters
 quote_currency = 'USDT'
 initial_investment = 10.0  # USD
 rsi_period = 14  # User's RSI period
 commission_rate = 0.001  # 0.1%
+max_slippage = 0.02  # Largest accepted average fill distance from the best price
+signal_timeframe = '5s'  # Used once a pair has enough streamed bars; '1m' REST candles until then
+listing_interval = 60  # Seconds between market reloads looking for new listings
+watch_hours = 24  # Hours a new listing keeps being evaluated (and streamed) after it is detected
+signal_audit = SignalAudit('audit/automain', '5s')  # Every evaluation's buy/sell conditions, bit-packed
 
 # New coins monitoring
 initial_pairs = set()
 initial_prices = {}
+listing_times = {}  # pair -> time the listing was detected
+in_flight = set()  # pairs in the pipeline; a pair is not queued again (or bought twice) until it leaves
+watched_pairs = set()
+trade_stream = None
+trade_subscriptions = None  # pairs added to the running trade stream
+initial_usdt_balance = 0.0
+
+# Open positions' hold/exit lifecycles, one task per pair
+positions = PositionTasks()
+
+# Live order books of the followed listings; orders are capped to their depth
+books = LocalBooks(exchange)
+
+# Listing snapshots, listing prices and open orders survive restarts here
+journal = StateJournal('state/automain')
 
 async def fetch_initial_pairs(quote_currency):
     global initial_pairs
+    global initial_prices
+    global listing_times
     try:
+        saved_pairs = journal.get('listings', 'pairs')
+        if saved_pairs is not None:
+            # Resume from the last snapshot so listings made while we were down are still detected
+            initial_pairs = set(saved_pairs)
+            initial_prices = dict(journal.items('listing_prices'))
+            listing_times = dict(journal.items('listing_times'))
+            for pair in initial_prices.keys() - listing_times.keys():
+                # Listings journaled before their detection time was kept start their watch now
+                listing_times[pair] = time.time()
+                journal.set('listing_times', pair, listing_times[pair])
+            logger.info("Restored trading pairs and listing prices from the state journal.")
+            return [symbol for symbol in initial_pairs if quote_currency in symbol.split('/')]
         await exchange.load_markets()
         initial_pairs = set(exchange.symbols)
+        journal.set('listings', 'pairs', sorted(initial_pairs))
         logger.info("Fetched initial trading pairs.")
         return [symbol for symbol in exchange.symbols if quote_currency in symbol.split('/')]
     except Exception as e:
-        logger.error(f"Error fetching initial trading pairs: {e}")
+        logger.error("Error fetching initial trading pairs: %s", e)
         return []
 
 async def detect_newly_listed_coins():
@@ -47,51 +97,105 @@ async def detect_newly_listed_coins():
         current_pairs = set(exchange.symbols)
         newly_listed_coins = current_pairs - initial_pairs
         if newly_listed_coins:
-            logger.info(f"Newly listed coins detected: {newly_listed_coins}")
+            logger.info("Newly listed coins detected: %s", newly_listed_coins)
             for pair in newly_listed_coins:
                 initial_price = await get_current_price(pair)
                 if initial_price:
                     initial_prices[pair] = initial_price
-                    logger.info(f"Initial price for {pair}: {initial_price}")
+                    listing_times[pair] = time.time()
+                    journal.set('listing_prices', pair, initial_price)
+                    journal.set('listing_times', pair, listing_times[pair])
+                    logger.info("Initial price for %s: %s", pair, initial_price)
             initial_pairs = current_pairs  # Update initial pairs
+            journal.set('listings', 'pairs', sorted(current_pairs))
         return newly_listed_coins
     except Exception as e:
-        logger.error(f"Error detecting newly listed coins: {e}")
+        logger.error("Error detecting newly listed coins: %s", e)
         return set()
 
+def prune_listings(held):
+    """Stop following listings detected more than watch_hours ago that are neither held nor busy."""
+    cutoff = time.time() - watch_hours * 3600
+    stale = [pair for pair in initial_prices
+             if listing_times.get(pair, 0) < cutoff and pair not in in_flight
+             and not positions.running(pair) and pair.split('/')[0] not in held]
+    for pair in stale:
+        del initial_prices[pair]
+        listing_times.pop(pair, None)
+        journal.delete('listing_prices', pair)
+        journal.delete('listing_times', pair)
+        bar_builder.discard(pair)
+        indicator_cache.invalidate(pair)
+    if stale:
+        logger.info("Stopped following %s listings older than %s hours", len(stale), watch_hours)
+
+def follow_trades(pairs):
+    """
+    Keep the trade stream feeding bar_builder on `pairs`: new pairs are added to
+    the running stream, and dropping pairs restarts it without them.
+    """
+    global trade_stream
+    global trade_subscriptions
+    global watched_pairs
+    pairs = set(pairs)
+    if trade_stream is not None and not trade_stream.done() and watched_pairs - pairs:
+        # A cancelled task is not done() until the loop runs it again: start the new stream now
+        trade_stream.cancel()
+        trade_stream = None
+    if trade_stream is not None and not trade_stream.done():
+        for pair in sorted(pairs - watched_pairs):
+            trade_subscriptions.put_nowait(pair)
+    elif pairs:
+        trade_subscriptions = asyncio.Queue()
+        trade_stream = asyncio.create_task(capture(sorted(pairs), None, ('trade',), on_trade=bar_builder.on_trade,
+                                                   subscriptions=trade_subscriptions))
+    watched_pairs = pairs
+
 async def get_current_price(pair):
+    bars = bar_builder.arrays(pair, '1s', limit=1)
+    if len(bars) and time.time() * 1000 - bars[-1, 0] < 5000:
+        return float(bars[-1, 4])
     try:
         ticker = await exchange.fetch_ticker(pair)
         current_price = ticker['last']
-        logger.info(f"Current market price for {pair}: {current_price}")
+        logger.info("Current market price for %s: %s", pair, current_price)
         return current_price
     except Exception as e:
-        logger.error(f"Error fetching current price for {pair}: {e}")
+        logger.error("Error fetching current price for %s: %s", pair, e)
         return None
 
+async def held_assets():
+    """Assets with a free balance, from one balance call (None if it fails)."""
+    try:
+        balance = await exchange.fetch_balance()
+    except Exception as e:
+        logger.error("Error fetching balances: %s", e)
+        return None
+    return {asset for asset, amount in balance['free'].items() if amount}
+
 async def get_balance(currency):
     try:
         balance = await exchange.fetch_balance()
         available_balance = balance['free'][currency]
-        logger.info(f"Available balance for {currency}: {available_balance}")
+        logger.info("Available balance for %s: %s", currency, available_balance)
         return available_balance
     except Exception as e:
-        logger.error(f"Error fetching balance for {currency}: {e}")
+        logger.error("Error fetching balance for %s: %s", currency, e)
         return 0
 
 async def place_market_order(pair, side, amount):
     if amount <= 0:
-        logger.error(f"Invalid amount for {side} order: {amount}")
+        logger.error("Invalid amount for %s order: %s", side, amount)
         return None
     try:
         if side == 'buy':
             order = await exchange.create_market_buy_order(pair, amount)
         elif side == 'sell':
             order = await exchange.create_market_sell_order(pair, amount)
-        logger.info(f"Market {side} order placed for {pair}: {amount} units at market price.")
+        logger.info("Market %s order placed for %s: %s units at market price.", side, pair, amount, extra=TRADE_EVENT)
         return order
     except Exception as e:
-        logger.error(f"An error occurred placing a {side} order for {pair}: {e}")
+        logger.error("An error occurred placing a %s order for %s: %s", side, pair, e)
         return None
 
 def calculate_net_profit(buy_price, sell_price):
@@ -106,43 +210,44 @@ async def convert_to_usdt(pair):
         if asset_balance > 0:
             order_result = await place_market_order(pair, 'sell', asset_balance)
             if order_result:
-                logger.info(f"Converted {asset_balance} of {asset} to USDT")
+                logger.info("Converted %s of %s to USDT", asset_balance, asset, extra=TRADE_EVENT)
                 return order_result
         else:
-            logger.info(f"No {asset} balance to convert to USDT")
+            logger.info("No %s balance to convert to USDT", asset)
     except Exception as e:
-        logger.error(f"An error occurred converting {pair} to USDT: {e}")
+        logger.error("An error occurred converting %s to USDT: %s", pair, e)
     return None
 
-async def fetch_historical_prices(pair, limit=100):
-    try:
-        ohlcv = await exchange.fetch_ohlcv(pair, timeframe='1m', limit=limit)
-        if ohlcv is None or len(ohlcv) == 0:
-            logger.info(f"No data returned for {pair}.")
-            return pd.DataFrame()
-
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
-
-        df = preprocess_data(df)
-
-        df['ema'] = talib.EMA(df['close'], timeperiod=14)
-        df['wma'] = talib.WMA(df['close'], timeperiod=14)
-        df['upper_band'], df['middle_band'], df['lower_band'] = talib.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
-        df['trix'] = talib.TRIX(df['close'], timeperiod=15)
-        df['rsi'] = talib.RSI(df['close'], timeperiod=14)
-        df['macd'], df['macd_signal'], df['macd_hist'] = talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
-        df['atr'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=14)
-        df['slowk'], df['slowd'] = talib.STOCH(df['high'], df['low'], df['close'], fastk_period=14, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
-        df['cci'] = talib.CCI(df['high'], df['low'], df['close'], timeperiod=14)
-        df['obv'] = talib.OBV(df['close'], df['volume'])
-
-        return df
-    except Exception as e:
-        logger.error(f"Error fetching historical prices for {pair}: {e}")
+async def fetch_candles(pair, limit=100):
+    """(timeframe, ohlcv) for a pair: streamed sub-minute bars once there are enough, 1m candles until then."""
+    timeframe = signal_timeframe if bar_builder.bar_count(pair, signal_timeframe) >= limit else '1m'
+    return timeframe, await exchange.fetch_ohlcv(pair, timeframe=timeframe, limit=limit)
+
+def compute_indicators(pair, timeframe, ohlcv):
+    if ohlcv is None or len(ohlcv) == 0:
+        logger.info("No data returned for %s.", pair)
         return pd.DataFrame()
 
+    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('timestamp', inplace=True)
+
+    df = preprocess_data(df)
+
+    bars = bar_indicators(pair, timeframe, [row[0] for row in ohlcv[-2:]])
+    df['ema'] = bars.EMA(df['close'], timeperiod=14)
+    df['wma'] = bars.WMA(df['close'], timeperiod=14)
+    df['upper_band'], df['middle_band'], df['lower_band'] = bars.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
+    df['trix'] = bars.TRIX(df['close'], timeperiod=15)
+    df['rsi'] = bars.RSI(df['close'], timeperiod=14)
+    df['macd'], df['macd_signal'], df['macd_hist'] = bars.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+    df['atr'] = bars.ATR(df['high'], df['low'], df['close'], timeperiod=14)
+    df['slowk'], df['slowd'] = bars.STOCH(df['high'], df['low'], df['close'], fastk_period=14, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
+    df['cci'] = bars.CCI(df['high'], df['low'], df['close'], timeperiod=14)
+    df['obv'] = bars.OBV(df['close'], df['volume'])
+
+    return df
+
 def preprocess_data(df):
     required_columns = ['open', 'high', 'low', 'close', 'volume']
     if not all(col in df.columns for col in required_columns):
@@ -151,7 +256,7 @@ def preprocess_data(df):
     df = df.ffill().bfill()
     return df
 
-def evaluate_trading_signals(df):
+def evaluate_trading_signals(df, pair=None):
     if df.empty:
         logger.info("DataFrame is empty.")
         return False, None
@@ -179,55 +284,157 @@ def evaluate_trading_signals(df):
         latest['cci'] > 100,
         latest['slowk'] > 80 and latest['slowd'] > 80
     ]
+    if pair is not None:
+        signal_audit.record(pair, df.index[-1], buy_conditions, sell_conditions)
 
     if all(buy_conditions):
-        logger.info(f"Buy signal conditions met: {dict(zip(['ema', 'wma', 'trix', 'close < Lower Band', 'rsi', 'macd', 'cci', 'stoch'], buy_conditions))}")
+        logger.info("Buy signal conditions met: %s", lazy(lambda: dict(zip(['ema', 'wma', 'trix', 'close < Lower Band', 'rsi', 'macd', 'cci', 'stoch'], buy_conditions))))
         return True, 'buy'
     elif all(sell_conditions):
-        logger.info(f"Sell signal conditions met: {dict(zip(['ema', 'wma', 'trix', 'close > Upper Band', 'rsi', 'macd', 'cci', 'stoch'], sell_conditions))}")
+        logger.info("Sell signal conditions met: %s", lazy(lambda: dict(zip(['ema', 'wma', 'trix', 'close > Upper Band', 'rsi', 'macd', 'cci', 'stoch'], sell_conditions))))
         return True, 'sell'
     return False, None
 
+# Pipeline stages: fetch -> indicators -> signal -> execute. Items are dicts keyed by 'pair',
+# with 'held' telling whether the pair's base asset has a balance to sell.
+async def fetch_stage(item):
+    pair = item['pair']
+    current_price = await get_current_price(pair)
+    if not current_price:
+        return None
+    item['price'] = current_price
+    initial_price = initial_prices.get(pair)
+    if initial_price:
+        price_increase = (current_price / initial_price - 1) * 100
+        if price_increase >= 1000:
+            if not item['held']:
+                # Nothing to take profit on, and no buying into the pump
+                return None
+            logger.info("Price increase detected for %s: %.2f%% since initial price.", pair, price_increase)
+            item['action'] = 'take_profit'
+            return item
+    item['timeframe'], item['ohlcv'] = await fetch_candles(pair)
+    return item
+
+def indicator_stage(item):
+    if 'ohlcv' in item:
+        item['data'] = compute_indicators(item['pair'], item.pop('timeframe'), item.pop('ohlcv'))
+    return item
+
+def signal_stage(item):
+    if 'data' in item:
+        signal, action = evaluate_trading_signals(item.pop('data'), item['pair'])
+        if not signal or (action == 'sell' and not item['held']):
+            return None
+        item['action'] = action
+    return item
+
+async def execute_stage(item):
+    pair, action = item['pair'], item['action']
+    if positions.running(pair):
+        return None
+    if action == 'take_profit':
+        positions.start(pair, take_profit(pair))
+        return None
+    amount_to_invest = initial_usdt_balance * (1 - commission_rate)
+    # Orders and book depth are in base units
+    amount = await cap_to_liquidity(exchange, pair, action, amount_to_invest / item['price'], max_slippage, books)
+    if amount <= 0:
+        return None
+    order_result = await place_market_order(pair, action, amount)
+    if order_result:
+        logger.info("Order result: %s", order_result, extra=TRADE_EVENT)
+        journal.set('orders', pair, {'order_id': order_result.get('id'), 'side': action,
+                                     'amount': amount, 'price': item['price']})
+        positions.start(pair, hold_position(pair))
+    return None
+
+def release(item):
+    in_flight.discard(item['pair'])
+
+# Position lifecycles run as their own tasks so the scan keeps going
+async def hold_position(pair, hold_seconds=60):
+    await asyncio.sleep(hold_seconds)
+    if await convert_to_usdt(pair):
+        journal.delete('orders', pair)
+
+async def take_profit(pair, max_slices=20, slice_interval=5):
+    # Sell in slices that each stay within max_slippage, letting the book refill in between;
+    # whatever is left after max_slices (or a failed order) waits for the next pass
+    asset = pair.split('/')[0]
+    for _ in range(max_slices):
+        asset_balance = await get_balance(asset)
+        amount = await cap_to_liquidity(exchange, pair, 'sell', asset_balance, max_slippage, books)
+        if amount <= 0 or not await place_market_order(pair, 'sell', amount):
+            return
+        if amount >= asset_balance:
+            journal.delete('orders', pair)
+            return
+        await asyncio.sleep(slice_interval)
+
 async def trade():
+    global initial_usdt_balance
     pairs = await fetch_initial_pairs(quote_currency)
     initial_usdt_balance = await get_balance('USDT')
-    logger.info(f"Initial USDT balance: {initial_usdt_balance}")
+    logger.info("Initial USDT balance: %s", initial_usdt_balance)
 
-    while True:
-        try:
-            newly_listed_coins = await detect_newly_listed_coins()
-            for pair in newly_listed_coins:
-                current_price = await get_current_price(pair)
-                if current_price:
-                    initial_price = initial_prices.get(pair)
-                    if initial_price:
-                        price_increase = (current_price / initial_price - 1) * 100
-                        if price_increase >= 1000:
-                            logger.info(f"Price increase detected for {pair}: {price_increase:.2f}% since initial price.")
-                            asset_balance = await get_balance(pair.split('/')[0])
-                            await place_market_order(pair, 'sell', asset_balance)
-                            await convert_to_usdt(pair)
-                            continue
-
-                    historical_data = await fetch_historical_prices(pair)
-                    signal, action = evaluate_trading_signals(historical_data)
-                    if signal:
-                        amount_to_invest = initial_usdt_balance * (1 - commission_rate)
-                        order_result = await place_market_order(pair, action, amount_to_invest)
-                        if order_result:
-                            logger.info(f"Order result: {order_result}")
-                            await asyncio.sleep(60)
-                            await convert_to_usdt(pair)
-        except Exception as e:
-            logger.error(f"Error in main trading loop: {e}")
-        await asyncio.sleep(60)
+    pipeline = await Pipeline([
+        Stage('fetch', fetch_stage, workers=4, maxsize=64),
+        Stage('indicators', indicator_stage, maxsize=16),
+        Stage('signal', signal_stage, maxsize=16),
+        Stage('execute', execute_stage, maxsize=4),
+    ], on_done=release).start()
+    depth_stream = asyncio.create_task(stream_depth(books))
+    step = timeframe_ms(signal_timeframe) / 1000
+    next_listing_check = 0.0
+    try:
+        while True:
+            try:
+                # One balance call per bar tells which followed pairs have anything to sell
+                held = await held_assets() if initial_prices else set()
+                if held is None:
+                    raise RuntimeError("balances unavailable, skipping this bar")
+                if time.monotonic() >= next_listing_check:
+                    next_listing_check = time.monotonic() + listing_interval
+                    newly_listed_coins = await detect_newly_listed_coins()
+                    prune_listings(held)
+                    follow_trades(initial_prices)
+                    books.follow(initial_prices)
+                    if newly_listed_coins:
+                        logger.info("Pipeline stats: %s; indicator cache: %s; open positions: %s",
+                                    lazy(pipeline.stats), lazy(indicator_cache.stats), len(positions))
+                # Every listed pair is evaluated once per signal bar, so the streamed bars and the
+                # pump exit are acted on as they form; pairs with a running lifecycle, or still in
+                # the pipeline from an earlier bar, are left alone
+                for pair in sorted(initial_prices):
+                    if pair in in_flight or positions.running(pair):
+                        continue
+                    in_flight.add(pair)
+                    # Waits here, not mid-scan, when the stages are backed up
+                    await pipeline.put({'pair': pair, 'held': pair.split('/')[0] in held})
+            except Exception as e:
+                logger.error("Error in main trading loop: %s", e)
+            # Wake just after the next signal bar closes
+            await asyncio.sleep(step - time.time() % step)
+    finally:
+        depth_stream.cancel()
+        await asyncio.gather(depth_stream, return_exceptions=True)
+        await pipeline.close()
 
 if __name__ == "__main__":
+    # Pick the indicator backends before the loop starts rather than inside the first scan
+    indicators.warm_up(100)
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(trade())
     except KeyboardInterrupt:
         pass
     finally:
+        loop.run_until_complete(positions.close())
+        if trade_stream is not None:
+            trade_stream.cancel()
+            loop.run_until_complete(asyncio.gather(trade_stream, return_exceptions=True))
+        journal.close()
+        signal_audit.close()
         loop.run_until_complete(exchange.close())
         loop.close()
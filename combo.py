@@ -3,43 +3,60 @@ import asyncio
 import logging
 import pandas as pd
 from securedFiles import config
-import talib
+from src.exchange_client import SingleFlightExchange
+from src.resilience import ResilientExchange
+from src.indicator_backend import indicators
+from src.klines import RawKlineExchange, fetch_klines
+from src.log_pipeline import TRADE_EVENT, lazy, setup_logging
+from src.order_book import LocalBooks, cap_to_liquidity, stream_depth
+from src.pipeline import PositionTasks
+from src.state_journal import StateJournal
 
 # Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+setup_logging(logging.INFO, '%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
 # Initialize Binance exchange connection
-exchange = ccxt.binance({
+exchange = SingleFlightExchange(ResilientExchange(RawKlineExchange(ccxt.binance({
     'apiKey': config.API_KEY,
     'secret': config.SECRET,
     'enableRateLimit': True,
     'options': {'adjustForTimeDifference': True}
-})
+}))))
 
 # Parameters
 combo_pair = 'COMBO/USDT'  # Focus on COMBO coin
 commission_rate = 0.001  # 0.1% commission
+max_slippage = 0.02  # Largest accepted average fill distance from the best price
+
+# The COMBO entry price and order id survive restarts here
+journal = StateJournal('state/combo')
+
+# The open COMBO position's monitor task
+positions = PositionTasks()
+
+# Live COMBO order book; orders are capped to its depth
+books = LocalBooks(exchange)
+books.follow([combo_pair])
 
 # Fetch historical data and calculate technical indicators
 async def fetch_historical_prices(pair, limit=100):
     try:
-        ohlcv = await exchange.fetch_ohlcv(pair, timeframe='1m', limit=limit)
-        if ohlcv is None or len(ohlcv) == 0:
-            logger.info(f"No data returned for {pair}.")
+        # Raw klines straight into typed arrays, without ccxt's per-candle parsing
+        klines = await fetch_klines(exchange, pair, '1m', limit)
+        if len(klines) == 0:
+            logger.info("No data returned for %s.", pair)
             return pd.DataFrame()
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
+        df = klines.frame()
 
-        df['rsi'] = talib.RSI(df['close'], timeperiod=14)
-        df['macd'], df['macd_signal'], _ = talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
-        df['upper_band'], df['middle_band'], df['lower_band'] = talib.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
+        df['rsi'] = indicators.RSI(df['close'], timeperiod=14)
+        df['macd'], df['macd_signal'], _ = indicators.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+        df['upper_band'], df['middle_band'], df['lower_band'] = indicators.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
 
         return df
     except Exception as e:
-        logger.error(f"Error fetching historical prices for {pair}: {e}")
+        logger.error("Error fetching historical prices for %s: %s", pair, e)
         return pd.DataFrame()
 
 # Calculate net profit after commission
@@ -55,50 +72,50 @@ async def convert_to_usdt(pair):
         if asset_balance > 0:
             order_result = await place_market_order(pair, 'sell', asset_balance)
             if order_result:
-                logger.info(f"Converted {asset_balance} of {asset} to USDT")
+                logger.info("Converted %s of %s to USDT", asset_balance, asset, extra=TRADE_EVENT)
                 return order_result
         else:
-            logger.info(f"No {asset} balance to convert to USDT")
+            logger.info("No %s balance to convert to USDT", asset)
     except Exception as e:
-        logger.error(f"An error occurred converting {pair} to USDT: {e}")
+        logger.error("An error occurred converting %s to USDT: %s", pair, e)
     return None
 
 async def get_balance(currency):
     try:
         balance = await exchange.fetch_balance()
         available_balance = balance['free'][currency]
-        logger.info(f"Available balance for {currency}: {available_balance}")
+        logger.info("Available balance for %s: %s", currency, available_balance)
         return available_balance
     except Exception as e:
-        logger.error(f"Error fetching balance for {currency}: {e}")
+        logger.error("Error fetching balance for %s: %s", currency, e)
         return 0
 
 async def get_current_price(pair):
     try:
         ticker = await exchange.fetch_ticker(pair)
         current_price = ticker['last']
-        logger.info(f"Current market price for {pair}: {current_price}")
+        logger.info("Current market price for %s: %s", pair, current_price)
         return current_price
     except Exception as e:
-        logger.error(f"Error fetching current price for {pair}: {e}")
+        logger.error("Error fetching current price for %s: %s", pair, e)
         return None
 
 async def place_market_order(pair, side, amount):
     if amount <= 0:
-        logger.error(f"Invalid amount for {side} order: {amount}")
+        logger.error("Invalid amount for %s order: %s", side, amount)
         return None
     try:
         if side == 'buy':
             order = await exchange.create_market_buy_order(pair, amount)
         elif side == 'sell':
             order = await exchange.create_market_sell_order(pair, amount)
-        logger.info(f"Market {side} order placed for {pair}: {amount} units at market price.")
+        logger.info("Market %s order placed for %s: %s units at market price.", side, pair, amount, extra=TRADE_EVENT)
         return order
     except Exception as e:
-        logger.error(f"An error occurred placing a {side} order for {pair}: {e}")
+        logger.error("An error occurred placing a %s order for %s: %s", side, pair, e)
         return None
 
-# Evaluate trading signals based on TA-Lib indicators
+# Evaluate trading signals based on the technical indicators
 def evaluate_trading_signals(df):
     if df.empty:
         logger.info("DataFrame is empty.")
@@ -119,57 +136,86 @@ def evaluate_trading_signals(df):
     ]
 
     if all(buy_conditions):
-        logger.info(f"Buy signal conditions met: {dict(zip(['rsi', 'macd', 'close < lower_band'], buy_conditions))}")
+        logger.info("Buy signal conditions met: %s", lazy(lambda: dict(zip(['rsi', 'macd', 'close < lower_band'], buy_conditions))))
         return True, 'buy'
     elif all(sell_conditions):
-        logger.info(f"Sell signal conditions met: {dict(zip(['rsi', 'macd', 'close > upper_band'], sell_conditions))}")
+        logger.info("Sell signal conditions met: %s", lazy(lambda: dict(zip(['rsi', 'macd', 'close > upper_band'], sell_conditions))))
         return True, 'sell'
     return False, None
 
+# Monitor an open COMBO position until the profit target is reached, then convert back to USDT.
+# Runs as its own task so the trading loop is never stuck inside it.
+async def monitor_position(pair, buy_price, require_sell_signal=False):
+    while True:
+        await asyncio.sleep(60)  # Check every minute
+        if require_sell_signal:
+            data = await fetch_historical_prices(pair)
+            signal, action = evaluate_trading_signals(data)
+            if action != 'sell':
+                continue
+        current_price = await get_current_price(pair)
+        if current_price:
+            net_profit = calculate_net_profit(buy_price, current_price)
+            if net_profit > 1:  # Profit condition (greater than initial investment)
+                logger.info("Profit opportunity detected for %s. Converting to USDT.", pair)
+                if await convert_to_usdt(pair):
+                    journal.delete('positions', pair)
+                return
+
 async def trade_combo():
+    if positions.running(combo_pair):
+        return
     usdt_balance = await get_balance('USDT')
     combo_balance = await get_balance('COMBO')
 
+    # A position journaled by an earlier run is resumed before any buy: every buy leaves
+    # USDT dust behind, so usdt_balance > 0 does not mean there is nothing to monitor.
+    # As for any COMBO balance held at start, it is sold on a sell signal once in profit.
+    position = journal.get('positions', combo_pair)
+    if position is not None:
+        if combo_balance > 0:
+            logger.info("Resuming the journaled %s position bought at %s", combo_pair, position['entry_price'])
+            positions.start(combo_pair, monitor_position(combo_pair, position['entry_price'], require_sell_signal=True))
+            return
+        logger.warning("The journaled %s position is no longer held; forgetting it.", combo_pair)
+        journal.delete('positions', combo_pair)
+
     if usdt_balance > 0:
         # Buy COMBO with all available USDT
         current_price = await get_current_price(combo_pair)
-        amount = usdt_balance / current_price
+        if current_price is None:
+            return
+        # Leave room for the commission and the spread above the last price
+        amount = usdt_balance * (1 - 2 * commission_rate) / current_price
+        amount = await cap_to_liquidity(exchange, combo_pair, 'buy', amount, max_slippage, books)
+        if amount <= 0:
+            return
         order_result = await place_market_order(combo_pair, 'buy', amount)
         if order_result:
-            logger.info(f"Buy order placed for {amount} of {combo_pair} at {current_price}")
+            logger.info("Buy order placed for %s of %s at %s", amount, combo_pair, current_price, extra=TRADE_EVENT)
             buy_price = current_price
-
-            # Monitor for profit opportunities
-            while True:
-                await asyncio.sleep(60)  # Check every minute
-                current_price = await get_current_price(combo_pair)
-                if current_price:
-                    net_profit = calculate_net_profit(buy_price, current_price)
-                    if net_profit > 1:  # Profit condition (greater than initial investment)
-                        logger.info(f"Profit opportunity detected for {combo_pair}. Converting to USDT.")
-                        await convert_to_usdt(combo_pair)
-                        break
+            journal.set('positions', combo_pair, {'entry_price': buy_price, 'amount': amount,
+                                                  'order_id': order_result.get('id')})
+            positions.start(combo_pair, monitor_position(combo_pair, buy_price))
 
     elif combo_balance > 0:
-        data = await fetch_historical_prices(combo_pair)
-        while True:
-            await asyncio.sleep(60)  # Check every minute
-            signal, action = evaluate_trading_signals(data)
-            if action == 'sell':
-                current_price = await get_current_price(combo_pair)
-                net_profit = calculate_net_profit(buy_price, current_price)
-                if net_profit > 1:  # Profit condition (greater than initial investment)
-                    logger.info(f"Profit opportunity detected for {combo_pair}. Converting to USDT.")
-                    await convert_to_usdt(combo_pair)
-                    break
+        logger.warning("No recorded entry price for the %s balance; skipping the profit check.", combo_pair)
 
 async def main():
-    while True:
-        try:
-            await trade_combo()
-        except Exception as e:
-            logger.error(f"An error occurred during trading: {e}")
-        await asyncio.sleep(60)  # Wait for 1 minute before the next trading cycle
+    depth_stream = asyncio.create_task(stream_depth(books))
+    try:
+        while True:
+            try:
+                await trade_combo()
+            except Exception as e:
+                logger.error("An error occurred during trading: %s", e)
+            await asyncio.sleep(60)  # Wait for 1 minute before the next trading cycle
+    finally:
+        depth_stream.cancel()
+        await asyncio.gather(depth_stream, return_exceptions=True)
+        await positions.close()
 
 if __name__ == "__main__":
+    # Pick the indicator backends before the loop starts rather than inside the first scan
+    indicators.warm_up(100, [('RSI', {}), ('MACD', {}), ('BBANDS', {})])
     asyncio.run(main())
@@ -4,6 +4,9 @@ import ccxt.async_support as ccxt
 
 import asyncio
 import logging
+import os
+import re
+import socket
 import pandas as pd
 from securedFiles import config
 # ------
@@ -14,21 +17,32 @@ from securedFiles import config
 # from src.avl import avl
 # from src.trix import trix
 # from src.sar import sar
+from src.exchange_client import SingleFlightExchange
+from src.resilience import ResilientExchange
+from src.sharding import ShardClient
+from src.state_journal import StateJournal
+from src.trailing_stop import TrailingStopEngine
 
-import talib
+from src.indicator_backend import indicators
+from src.indicator_cache import bar_indicators, indicator_cache
+from src.klines import RawKlineExchange, fetch_klines
+from src.log_pipeline import TRADE_EVENT, lazy, setup_logging
+from src.portfolio import net_filled
+from src.risk import EwmCovariance, PortfolioRisk
+from src.signal_audit import SignalAudit
 
 
 # Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+setup_logging(logging.INFO, '%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
 # Initialize Binance exchange connection
-exchange = ccxt.binance({
+exchange = SingleFlightExchange(ResilientExchange(RawKlineExchange(ccxt.binance({
     'apiKey': config.API_KEY,
     'secret': config.SECRET,
     'enableRateLimit': True,
     'options': {'adjustForTimeDifference': True}
-})
+}))))
 
 # Parameters
 quote_currency = 'USDT'
@@ -37,6 +51,14 @@ trailing_stop_loss_percentage = 10  # 10% trailing stop loss
 short_ma_length = 5
 long_ma_length = 20
 rsi_period = 14  # User's RSI period
+state_journal_path = 'state/main'  # Open positions survive restarts here
+shard_coordinator = None  # ('host', port) of a src.sharding coordinator to scan only this worker's shard
+# Index of this worker on its host, stable across restarts: with the hostname it names the worker's shard,
+# journal and audit, so a restarted worker gets its shard back and restores its own positions
+shard_worker_index = os.environ.get('SHARD_WORKER_INDEX')
+max_portfolio_volatility = 0.02  # largest hourly volatility of the open positions, as a fraction of capital
+max_position_correlation = 0.8  # largest correlation of a new buy with the open positions
+signal_audit_path = 'audit/main'  # Every evaluation's buy/sell conditions, bit-packed
 
 # Fetch all tradeable pairs using the correct asynchronous call
 async def get_tradeable_pairs(quote_currency):
@@ -47,7 +69,7 @@ async def get_tradeable_pairs(quote_currency):
             exchange.load_markets()  # Call without await if it's not awaitable
         return [symbol for symbol in exchange.symbols if quote_currency in symbol.split('/')]
     except Exception as e:
-        logger.error(f"Error loading markets: {e}")
+        logger.error("Error loading markets: %s", e)
         return []
 
 
@@ -68,7 +90,8 @@ def preprocess_data(df):
     if not all(col in df.columns for col in required_columns):
         raise ValueError("DataFrame must contain open, high, low, close, and volume columns")
 
-    df = df.ffill().bfill()
+    if df.isna().values.any():
+        df = df.ffill().bfill()
 
     return df
 
@@ -77,31 +100,30 @@ def preprocess_data(df):
 
 async def fetch_historical_prices(pair, limit=100):
     try:
-        ohlcv = await exchange.fetch_ohlcv(pair, timeframe='1m', limit=limit)
-        if ohlcv is None or len(ohlcv) == 0:
-            logger.info(f"No data returned for {pair}.")
+        # Raw klines straight into typed arrays, without ccxt's per-candle parsing
+        klines = await fetch_klines(exchange, pair, '1m', limit)
+        if len(klines) == 0:
+            logger.info("No data returned for %s.", pair)
             return pd.DataFrame()
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
-
-        df = preprocess_data(df)
-
-        df['ema'] = talib.EMA(df['close'], timeperiod=14)
-        df['wma'] = talib.WMA(df['close'], timeperiod=14)
-        df['upper_band'], df['middle_band'], df['lower_band'] = talib.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
-        df['trix'] = talib.TRIX(df['close'], timeperiod=15)
-        df['rsi'] = talib.RSI(df['close'], timeperiod=14)
-        df['macd'], df['macd_signal'], df['macd_hist'] = talib.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
-        df['atr'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=14)
-        df['slowk'], df['slowd'] = talib.STOCH(df['high'], df['low'], df['close'], fastk_period=14, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
-        df['cci'] = talib.CCI(df['high'], df['low'], df['close'], timeperiod=14)
-        df['obv'] = talib.OBV(df['close'], df['volume'])
+        df = preprocess_data(klines.frame())
+        risk.covariance.observe(pair, klines.timestamp[:-1], klines.close[:-1])
+
+        bars = bar_indicators(pair, '1m', klines.timestamp)
+        df['ema'] = bars.EMA(df['close'], timeperiod=14)
+        df['wma'] = bars.WMA(df['close'], timeperiod=14)
+        df['upper_band'], df['middle_band'], df['lower_band'] = bars.BBANDS(df['close'], timeperiod=20, nbdevup=2, nbdevdn=2)
+        df['trix'] = bars.TRIX(df['close'], timeperiod=15)
+        df['rsi'] = bars.RSI(df['close'], timeperiod=14)
+        df['macd'], df['macd_signal'], df['macd_hist'] = bars.MACD(df['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+        df['atr'] = bars.ATR(df['high'], df['low'], df['close'], timeperiod=14)
+        df['slowk'], df['slowd'] = bars.STOCH(df['high'], df['low'], df['close'], fastk_period=14, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
+        df['cci'] = bars.CCI(df['high'], df['low'], df['close'], timeperiod=14)
+        df['obv'] = bars.OBV(df['close'], df['volume'])
 
         return df
     except Exception as e:
-        logger.error(f"Error fetching historical prices for {pair}: {e}")
+        logger.error("Error fetching historical prices for %s: %s", pair, e)
         return pd.DataFrame()
 
 def preprocess_data(df):
@@ -109,12 +131,13 @@ def preprocess_data(df):
     if not all(col in df.columns for col in required_columns):
         raise ValueError("DataFrame must contain open, high, low, close, and volume columns")
 
-    df = df.ffill().bfill()
+    if df.isna().values.any():
+        df = df.ffill().bfill()
     return df
 
 
 
-def evaluate_trading_signals(df):
+def evaluate_trading_signals(df, pair=None):
     if df.empty:
         logger.info("DataFrame is empty.")
         return False, None
@@ -142,12 +165,14 @@ def evaluate_trading_signals(df):
         latest['cci'] > 100,
         latest['slowk'] > 80 and latest['slowd'] > 80
     ]
+    if pair is not None:
+        signal_audit.record(pair, df.index[-1], buy_conditions, sell_conditions)
 
     if all(buy_conditions):
-        logger.info(f"Buy signal conditions met: {dict(zip(['ema', 'wma', 'trix', 'close < Lower Band', 'rsi', 'macd', 'cci', 'stoch'], buy_conditions))}")
+        logger.info("Buy signal conditions met: %s", lazy(lambda: dict(zip(['ema', 'wma', 'trix', 'close < Lower Band', 'rsi', 'macd', 'cci', 'stoch'], buy_conditions))))
         return True, 'buy'
     elif all(sell_conditions):
-        logger.info(f"Sell signal conditions met: {dict(zip(['ema', 'wma', 'trix', 'close > Upper Band', 'rsi', 'macd', 'cci', 'stoch'], sell_conditions))}")
+        logger.info("Sell signal conditions met: %s", lazy(lambda: dict(zip(['ema', 'wma', 'trix', 'close > Upper Band', 'rsi', 'macd', 'cci', 'stoch'], sell_conditions))))
         return True, 'sell'
     return False, None
 
@@ -156,10 +181,10 @@ async def get_balance(currency):
     try:
         balance = await exchange.fetch_balance()
         available_balance = balance['free'][currency]
-        logger.info(f"Available balance for {currency}: {available_balance}")
+        logger.info("Available balance for %s: %s", currency, available_balance)
         return available_balance
     except Exception as e:
-        logger.error(f"Error fetching balance for {currency}: {e}")
+        logger.error("Error fetching balance for %s: %s", currency, e)
         return 0
 
 # Get current price
@@ -167,43 +192,116 @@ async def get_current_price(pair):
     try:
         ticker = await exchange.fetch_ticker(pair)
         current_price = ticker['last']
-        logger.info(f"Current market price for {pair}: {current_price}")
+        logger.info("Current market price for %s: %s", pair, current_price)
         return current_price
     except Exception as e:
-        logger.error(f"Error fetching current price for {pair}: {e}")
+        logger.error("Error fetching current price for %s: %s", pair, e)
         return None
 
 # Place Market Ordder
 async def place_market_order(pair, side, amount):
     if amount <= 0:
-        logger.error(f"Invalid amount for {side} order: {amount}")
+        logger.error("Invalid amount for %s order: %s", side, amount)
         return None
     try:
         if side == 'buy':
             order = await exchange.create_market_buy_order(pair, amount)
         elif side == 'sell':
             order = await exchange.create_market_sell_order(pair, amount)
-        logger.info(f"Market {side} order placed for {pair}: {amount} units at market price.")
+        logger.info("Market %s order placed for %s: %s units at market price.", side, pair, amount, extra=TRADE_EVENT)
         return order
     except Exception as e:
-        logger.error(f"An error occurred placing a {side} order for {pair}: {e}")
+        logger.error("An error occurred placing a %s order for %s: %s", side, pair, e)
         return None
 
+async def place_stop_order(pair, side, amount):
+    # Unlike place_market_order, errors propagate so the trailing stops can drop positions the exchange rejects
+    order = await exchange.create_market_sell_order(pair, amount)
+    logger.info("Market %s order placed for %s: %s units at market price.", side, pair, amount, extra=TRADE_EVENT)
+    return order
+
+def worker_path(path):
+    # Co-hosted shard workers each get their own journal and audit: neither file is safe to share between processes
+    if shard_coordinator is None:
+        return path
+    return f"{path}-{re.sub(r'[^A-Za-z0-9_.-]', '_', shard_worker_id)}"
+
+
+if shard_coordinator is not None and not shard_worker_index:
+    # A per-process id would open an empty journal on every restart and lose the open positions
+    raise RuntimeError("Shard mode needs a stable worker index: set SHARD_WORKER_INDEX")
+shard_worker_id = f"{socket.gethostname()}:{shard_worker_index}"
+
+# Trailing stops for the positions opened by trade(); hits are sold via place_stop_order
+trailing_stops = TrailingStopEngine(trailing_stop_loss_percentage, place_stop_order)
+journal = StateJournal(worker_path(state_journal_path))
+position_keys = {}  # trailing stop position_id -> journal key (order id)
+signal_audit = SignalAudit(worker_path(signal_audit_path), '1m')
+# Return covariance of the scanned pairs (fed by fetch_historical_prices) and the open exposure
+risk = PortfolioRisk(EwmCovariance('1m', halflife=60), max_volatility=max_portfolio_volatility,
+                     max_correlation=max_position_correlation, horizon_bars=60)
+
+
+def track_position(key, symbol, amount, entry_price, high_water_mark=None):
+    position = trailing_stops.open_position(symbol, amount, entry_price, high_water_mark=high_water_mark)
+    position_keys[position.position_id] = key
+    risk.add_exposure(symbol, amount * entry_price)
+    return position
+
+
+def close_position(position):
+    journal.delete('positions', position_keys.pop(position.position_id))
+    risk.add_exposure(position.symbol, -position.amount * position.entry_price)
+
+
+def close_positions(symbol):
+    # Positions sold by a sell signal instead of their trailing stops
+    for position in trailing_stops.positions(symbol):
+        trailing_stops.close_position(position.position_id)
+        close_position(position)
+
+
+def restore_positions():
+    # Re-arm the trailing stops of positions left open by a previous run (of this worker, in shard mode)
+    for key, saved in journal.items('positions'):
+        if key not in position_keys.values():
+            track_position(key, saved['symbol'], saved['amount'], saved['entry_price'], saved.get('high_water_mark'))
+    if position_keys:
+        logger.info("Restored %s open positions from the state journal", len(position_keys))
+
+
+def journal_high_water_marks(symbol):
+    # Journal each mark as soon as the stops raise it, so a crash does not reset the stops to their entry prices
+    for position in trailing_stops.positions(symbol):
+        key = position_keys[position.position_id]
+        saved = journal.get('positions', key)
+        if position.high_water_mark > saved.get('high_water_mark', saved['entry_price']):
+            journal.set('positions', key, {**saved, 'high_water_mark': position.high_water_mark})
+
 
 # Main trading logic
 async def trade():
+    restore_positions()
     pairs = await get_tradeable_pairs('USDT')
-    for pair in pairs:
+    shard = None
+    if shard_coordinator is not None:
+        shard = ShardClient(shard_coordinator, shard_worker_id)
+        pairs = await shard.join(pairs)
+    # A shard is followed as it changes mid-scan: pairs moved away are skipped, pairs moved here are added
+    for pair in (pairs if shard is None else shard.scan()):
         try:
             data = await fetch_historical_prices(pair)
             # print("es aris \n-----\n", data)
             if not data.empty:
-                signal, action = evaluate_trading_signals(data)
+                for position, _ in await trailing_stops.on_price(pair, data['close'].iloc[-1]):
+                    close_position(position)
+                journal_high_water_marks(pair)
+                signal, action = evaluate_trading_signals(data, pair)
                 if signal:
-                    logger.info(f"Signal detected: {action.upper()} for {pair}")
+                    logger.info("Signal detected: %s for %s", action.upper(), pair)
                     usdt_balance = await get_balance('USDT')
                     if usdt_balance < initial_investment:
-                        logger.warning(f"Insufficient USDT to trade. Available: {usdt_balance}, Required: {initial_investment}")
+                        logger.warning("Insufficient USDT to trade. Available: %s, Required: %s", usdt_balance, initial_investment)
                         continue
 
                     current_price = await get_current_price(pair)
@@ -212,31 +310,54 @@ async def trade():
 
                     amount = initial_investment / current_price
                     if action == 'buy':
+                        allowed, reason = risk.check(pair, initial_investment, usdt_balance + risk.gross_exposure())
+                        if not allowed:
+                            logger.warning("Skipping buy of %s: %s", pair, reason)
+                            continue
                         order_result = await place_market_order(pair, 'buy', amount)
                         if order_result:
-                            logger.info(f"Buy order placed for {amount} of {pair} at {current_price}")
+                            logger.info("Buy order placed for %s of %s at %s", amount, pair, current_price, extra=TRADE_EVENT)
+                            # Track what the balance received: the fill less the fee taken in the base asset
+                            held = net_filled(order_result, pair.split('/')[0], amount)
+                            entry_price = order_result.get('average') or current_price
+                            key = str(order_result.get('id') or f"{pair}@{order_result.get('timestamp')}")
+                            journal.set('positions', key, {'symbol': pair, 'amount': held, 'entry_price': entry_price})
+                            track_position(key, pair, held, entry_price)
                     elif action == 'sell':
                         asset = pair.split('/')[0]
                         asset_balance = await get_balance(asset)
-                        if asset_balance < amount:
-                            logger.warning(f"Insufficient {asset} balance. Available: {asset_balance}, Required: {amount}")
+                        tracked = trailing_stops.positions(pair)
+                        if tracked:
+                            # Sell the tracked positions as a whole; their stops and journal entries close with them
+                            amount = min(sum(position.amount for position in tracked), asset_balance)
+                        if asset_balance < amount or amount <= 0:
+                            logger.warning("Insufficient %s balance. Available: %s, Required: %s", asset, asset_balance, amount)
                             continue
                         order_result = await place_market_order(pair, 'sell', amount)
                         if order_result:
-                            logger.info(f"Sell order placed for {amount} of {pair} at {current_price}")
+                            logger.info("Sell order placed for %s of %s at %s", amount, pair, current_price, extra=TRADE_EVENT)
+                            close_positions(pair)
         except Exception as e:
-            logger.error(f"An error occurred while processing {pair}: {str(e)}")
+            logger.error("An error occurred while processing %s: %s", pair, e)
+    if shard is not None:
+        # The pairs handed over were scanned above; workers still mid-scan must not evaluate them again
+        await shard.leave(scanned=True)
 
 async def main():
     try:
         await trade()
     except Exception as e:
-        logger.error(f"An error occurred during trading: {e}")
+        logger.error("An error occurred during trading: %s", e)
     finally:
+        journal.close()
+        signal_audit.close()
+        logger.info("Indicator cache: %s", indicator_cache.stats())
         # Call the close_exchange function correctly
         await close_exchange()
         logger.info("Exchange connection closed.")
 
 if __name__ == "__main__":
+    # Pick the indicator backends before the loop starts rather than inside the first scan
+    indicators.warm_up(100)
     asyncio.run(main())
 
@@ -0,0 +1,149 @@
+"""
+Triangular-arbitrage scanner over every market of an exchange.
+
+Each market BASE/QUOTE gives two directed edges in a currency graph: selling
+BASE at the bid and buying BASE with QUOTE at the ask, both net of the
+commission. Edge weights are log conversion rates held in one NumPy vector,
+and every triangle of the graph is an index triple into it, so a full scan is
+a single gather-and-sum over all cycles. A quote update only touches its two
+edges and re-evaluates the triangles that use them.
+
+    python -m src.arbitrage    # one bulk ticker snapshot from Binance
+"""
+import asyncio
+import logging
+import math
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ArbitrageScanner:
+    """
+    :param symbols: Market symbols ('BASE/QUOTE'); derivatives with ':' are skipped
+    :param commission_rate: Taker fee charged on every leg
+    :param preferred_start: Currencies cycles are rotated to start from, in order of preference
+    """
+
+    def __init__(self, symbols, commission_rate=0.001, preferred_start=('USDT', 'BTC', 'ETH', 'BNB')):
+        self.fee_log = math.log1p(-commission_rate)
+        self.preferred_start = preferred_start
+        self.currencies = []
+        self.currency_index = {}
+        self.edge_index = {}   # (from currency id, to currency id) -> edge id
+        self.market_edges = {} # symbol -> (sell-base edge, buy-base edge)
+        neighbours = defaultdict(set)
+        for symbol in symbols:
+            if ':' in symbol or symbol.count('/') != 1:
+                continue
+            base, quote = symbol.split('/')
+            b, q = self._currency(base), self._currency(quote)
+            if b == q or (b, q) in self.edge_index:
+                continue
+            sell = self.edge_index[(b, q)] = len(self.edge_index)
+            buy = self.edge_index[(q, b)] = len(self.edge_index)
+            self.market_edges[symbol] = (sell, buy)
+            neighbours[b].add(q)
+            neighbours[q].add(b)
+        self.weights = np.full(len(self.edge_index), -np.inf)
+
+        cycles = []
+        for (a, b) in self.edge_index:
+            if a >= b:
+                continue
+            for c in neighbours[a] & neighbours[b]:
+                if c > b:
+                    cycles.append((a, b, c))
+                    cycles.append((a, c, b))
+        self.cycle_nodes = np.array(cycles, dtype=np.int64).reshape(-1, 3)
+        self.cycle_edges = np.array(
+            [(self.edge_index[(x, y)], self.edge_index[(y, z)], self.edge_index[(z, x)]) for x, y, z in cycles],
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        edge_cycles = defaultdict(list)
+        for i, edges in enumerate(self.cycle_edges.tolist()):
+            for edge in edges:
+                edge_cycles[edge].append(i)
+        self.edge_cycles = {edge: np.array(ids, dtype=np.int64) for edge, ids in edge_cycles.items()}
+
+    def _currency(self, code):
+        index = self.currency_index.get(code)
+        if index is None:
+            index = self.currency_index[code] = len(self.currencies)
+            self.currencies.append(code)
+        return index
+
+    def __len__(self):
+        return len(self.cycle_edges)
+
+    def set_quote(self, symbol, bid, ask):
+        """Update one market's top of book; returns False for unknown symbols."""
+        edges = self.market_edges.get(symbol)
+        if edges is None:
+            return False
+        sell, buy = edges
+        self.weights[sell] = math.log(bid) + self.fee_log if bid else -np.inf
+        self.weights[buy] = -math.log(ask) + self.fee_log if ask else -np.inf
+        return True
+
+    def set_tickers(self, tickers):
+        """Load a bulk ticker snapshot ({symbol: {'bid': ..., 'ask': ...}}, as from fetch_tickers)."""
+        for symbol, ticker in tickers.items():
+            self.set_quote(symbol, ticker.get('bid'), ticker.get('ask'))
+
+    def _opportunities(self, cycle_ids, min_profit):
+        log_returns = self.weights[self.cycle_edges[cycle_ids]].sum(axis=1)
+        hits = np.flatnonzero(log_returns > math.log1p(min_profit))
+        found = [self._describe(cycle_ids[i], log_returns[i]) for i in hits]
+        return sorted(found, key=lambda o: o['profit'], reverse=True)
+
+    def _describe(self, cycle_id, log_return):
+        path = [self.currencies[i] for i in self.cycle_nodes[cycle_id]]
+        for start in self.preferred_start:
+            if start in path:
+                k = path.index(start)
+                path = path[k:] + path[:k]
+                break
+        return {'path': path + path[:1], 'profit': math.expm1(log_return)}
+
+    def scan(self, min_profit=0.0):
+        """Every profitable cycle (after commission) in the whole graph, best first."""
+        return self._opportunities(np.arange(len(self.cycle_edges)), min_profit)
+
+    def update(self, symbol, bid, ask, min_profit=0.0):
+        """Apply one quote change and return the profitable cycles through that market."""
+        if not self.set_quote(symbol, bid, ask):
+            return []
+        ids = [self.edge_cycles.get(edge) for edge in self.market_edges[symbol]]
+        ids = [i for i in ids if i is not None]
+        if not ids:
+            return []
+        return self._opportunities(np.concatenate(ids), min_profit)
+
+
+async def scan_exchange(exchange, commission_rate=0.001, min_profit=0.0):
+    """Build a scanner from all of an exchange's markets and scan one bulk ticker snapshot."""
+    await exchange.load_markets()
+    scanner = ArbitrageScanner(exchange.symbols, commission_rate)
+    scanner.set_tickers(await exchange.fetch_tickers())
+    return scanner, scanner.scan(min_profit)
+
+
+async def _main():
+    import ccxt.async_support as ccxt
+
+    exchange = ccxt.binance({'enableRateLimit': True})
+    try:
+        scanner, opportunities = await scan_exchange(exchange)
+        logger.info("%s cycles over %s currencies", len(scanner), len(scanner.currencies))
+        for opportunity in opportunities[:20]:
+            logger.info("%s: %.4f%%", ' -> '.join(opportunity['path']), opportunity['profit'] * 100)
+    finally:
+        await exchange.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    asyncio.run(_main())
@@ -1,44 +1,51 @@
 import numpy as np
 import pandas as pd
-import logging
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from src.vwap import DAY_MS, VwapState, rolling_vwap, session_vwap
+
 
 def avl(prices, volumes):
     """
     Calculate the Average Value Line (AVL), which is a volume-weighted average of prices.
 
     Parameters:
-    prices (pd.Series): Series containing price data.
-    volumes (pd.Series): Series containing volume data corresponding to the prices.
+    prices (pd.Series or np.ndarray): Price data.
+    volumes (pd.Series or np.ndarray): Volume data corresponding to the prices.
 
     Returns:
     float: The calculated AVL value or None if volumes sum to zero.
-    """
-    # Check if prices and volumes are pandas Series
-    if not isinstance(prices, pd.Series) or not isinstance(volumes, pd.Series):
-        logger.error("Input prices and volumes must be pandas Series.")
-        return None
 
-    try:
-        if volumes.sum() == 0:
-            logger.warning("Total volume is zero, cannot compute AVL.")
+    Two Series are aligned on their index and NaNs are skipped, as pandas
+    arithmetic does; arrays are taken positionally and NaNs propagate.
+    """
+    if isinstance(prices, pd.Series) and isinstance(volumes, pd.Series):
+        total_volume = volumes.sum()
+        if total_volume == 0:
             return None
-        vwap = (prices * volumes).sum() / volumes.sum()
-        return vwap
-    except Exception as e:
-        logger.error(f"Error computing AVL: {str(e)}")
+        return float((prices * volumes).sum() / total_volume)
+    prices = np.asarray(prices, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    total_volume = volumes.sum()
+    if total_volume == 0:
         return None
+    return float(np.dot(prices, volumes) / total_volume)
+
 
+def rolling_avl(prices, volumes, window, min_periods=None):
+    """
+    AVL over the last `window` bars for every bar; see src.vwap.rolling_vwap.
 
+    Accepts (n_bars,) arrays or (n_bars, n_symbols) panels.
+    """
+    return rolling_vwap(prices, volumes, window, min_periods)
 
 
+def session_avl(prices, volumes, timestamps, session_ms=DAY_MS, offset_ms=0):
+    """
+    AVL anchored to the start of each session (UTC day by default); see src.vwap.session_vwap.
+    """
+    return session_vwap(prices, volumes, timestamps, session_ms, offset_ms)
 
 
-'''
-def avl(prices, volumes):
-    if volumes.sum() == 0:
-        return None  # Avoid division by zero
-    return (prices * volumes).sum() / volumes.sum()
-'''
\ No newline at end of file
+# Incremental form: AVL and VWAP share the same running sums.
+AvlState = VwapState
@@ -0,0 +1,237 @@
+"""
+Parallel, resumable historical OHLCV backfill.
+
+Candles are paginated from fetch_ohlcv with `since` for many symbols and
+timeframes at once and stored as a columnar dataset of raw .npy files:
+
+    <root>/<timeframe>/<BASE_QUOTE>/<YYYY-MM-DD>/{timestamp,open,high,low,close,volume}.npy
+    <root>/<timeframe>/<BASE_QUOTE>/manifest.json
+
+Each partition holds one UTC day and is replaced atomically, and the manifest
+records the next timestamp to fetch, so an interrupted run resumes where it
+stopped. Partitions can be memory-mapped and read without copying:
+
+    python -m src.backfill --quote USDT --timeframes 1m --since 2024-01-01
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+DAY_MS = 86_400_000
+_UNITS_MS = {'s': 1000, 'm': 60_000, 'h': 3_600_000, 'd': DAY_MS, 'w': 7 * DAY_MS}
+
+
+def timeframe_ms(timeframe):
+    return int(timeframe[:-1]) * _UNITS_MS[timeframe[-1]]
+
+
+def symbol_dir(root, symbol, timeframe):
+    return os.path.join(root, timeframe, symbol.replace('/', '_').replace(':', '_'))
+
+
+def _partition_name(day):
+    return datetime.datetime.fromtimestamp(day * DAY_MS / 1000, tz=datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_atomic(path, write):
+    tmp = f"{path}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _save_npy(tmp, array):
+    # np.save would append '.npy' to a path, so write through a file object
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+
+
+def write_manifest(path, manifest):
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+    _write_atomic(os.path.join(path, 'manifest.json'), write)
+
+
+def open_partition(path, mmap_mode='r'):
+    """Columns of one partition as memory-mapped arrays (no copy)."""
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in COLUMNS}
+
+
+def write_partition(path, rows):
+    """
+    Merge rows (n, 6) into the partition at path, deduplicated by timestamp.
+    Each column file is replaced atomically.
+    """
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, 'timestamp.npy')):
+        existing = open_partition(path, mmap_mode=None)
+        # Pages only move forward in time, so after a crash between column
+        # replacements the older columns are a prefix of the newer ones
+        n = min(len(values) for values in existing.values())
+        old = np.column_stack([existing[name][:n] for name in COLUMNS])
+        rows = np.concatenate([old, rows])
+    timestamps, index = np.unique(rows[:, 0].astype(np.int64), return_index=True)
+    rows = rows[index]
+    for i, name in enumerate(COLUMNS):
+        column = timestamps if name == 'timestamp' else np.ascontiguousarray(rows[:, i])
+        _write_atomic(os.path.join(path, f"{name}.npy"), lambda tmp: _save_npy(tmp, column))
+
+
+def partitions(root, symbol, timeframe, start=None, end=None):
+    """Partition directories for a symbol and timeframe in time order, optionally limited to [start, end) ms."""
+    base = symbol_dir(root, symbol, timeframe)
+    if not os.path.isdir(base):
+        return []
+    names = sorted(n for n in os.listdir(base) if os.path.isdir(os.path.join(base, n)))
+    if start is not None:
+        names = [n for n in names if n >= _partition_name(start // DAY_MS)]
+    if end is not None:
+        names = [n for n in names if n <= _partition_name((end - 1) // DAY_MS)]
+    return [os.path.join(base, n) for n in names]
+
+
+def load_ohlcv(root, symbol, timeframe, start=None, end=None):
+    """
+    Stored candles as a dict of column arrays. A single partition is returned
+    memory-mapped; several are concatenated.
+    """
+    parts = [open_partition(p) for p in partitions(root, symbol, timeframe, start, end)]
+    if not parts:
+        return {name: np.empty(0, dtype=np.int64 if name == 'timestamp' else np.float64) for name in COLUMNS}
+    data = parts[0] if len(parts) == 1 else {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+    if start is not None or end is not None:
+        ts = data['timestamp']
+        lo = 0 if start is None else np.searchsorted(ts, start)
+        hi = len(ts) if end is None else np.searchsorted(ts, end)
+        data = {name: values[lo:hi] for name, values in data.items()}
+    return data
+
+
+class WeightBudget:
+    """
+    Token bucket for the exchange's request-weight limit, shared by all backfill tasks.
+
+    :param weight_per_minute: Weight allowed per minute (keep below the exchange limit)
+    """
+
+    def __init__(self, weight_per_minute=600):
+        self.rate = weight_per_minute / 60.0
+        self.capacity = float(weight_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, weight=1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+
+
+def klines_weight(limit):
+    # Binance /api/v3/klines weight by limit
+    if limit <= 100:
+        return 1
+    if limit <= 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+async def backfill_symbol(exchange, root, symbol, timeframe, since, budget, end=None, limit=1000):
+    """Fetch candles for one symbol/timeframe from the manifest position (or `since`) up to `end`."""
+    path = symbol_dir(root, symbol, timeframe)
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+    step = timeframe_ms(timeframe)
+    cursor = max(manifest.get('next_since', since), since)
+    # Only closed candles are stored
+    end = (int(time.time() * 1000) // step) * step if end is None else end
+    fetched = 0
+    while cursor < end:
+        await budget.acquire(klines_weight(limit))
+        page = await exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=cursor, limit=limit)
+        if not page:
+            break
+        rows = np.asarray(page, dtype=np.float64)
+        rows = rows[(rows[:, 0] >= cursor) & (rows[:, 0] < end)]
+        if len(rows) == 0:
+            break
+        days = rows[:, 0].astype(np.int64) // DAY_MS
+        for day in np.unique(days):
+            write_partition(os.path.join(path, _partition_name(day)), rows[days == day])
+        cursor = int(rows[-1, 0]) + step
+        fetched += len(rows)
+        write_manifest(path, {'symbol': symbol, 'timeframe': timeframe, 'next_since': cursor})
+    logger.info("Backfilled %s %s candles for %s", fetched, timeframe, symbol)
+    return fetched
+
+
+async def backfill(exchange, root, symbols, timeframes, since, end=None, concurrency=8, weight_per_minute=600):
+    """Backfill every (symbol, timeframe) pair concurrently within one shared weight budget."""
+    budget = WeightBudget(weight_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(symbol, timeframe):
+        async with semaphore:
+            try:
+                return await backfill_symbol(exchange, root, symbol, timeframe, since, budget, end)
+            except Exception as e:
+                logger.error("Error backfilling %s %s: %s", symbol, timeframe, e)
+                return 0
+
+    jobs = [run(symbol, timeframe) for symbol in symbols for timeframe in timeframes]
+    return sum(await asyncio.gather(*jobs))
+
+
+async def _main(args):
+    import ccxt.async_support as ccxt
+
+    exchange = ccxt.binance({'enableRateLimit': True})
+    try:
+        symbols = args.symbols
+        if not symbols:
+            await exchange.load_markets()
+            symbols = [s for s in exchange.symbols if args.quote in s.split('/')]
+        since = int(datetime.datetime.fromisoformat(args.since).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        total = await backfill(exchange, args.out, symbols, args.timeframes, since,
+                               concurrency=args.concurrency, weight_per_minute=args.weight_per_minute)
+        logger.info("Backfill finished: %s candles", total)
+    finally:
+        await exchange.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Backfill historical OHLCV into a columnar .npy dataset")
+    parser.add_argument('--symbols', nargs='*', help="Symbols to fetch (default: every pair quoted in --quote)")
+    parser.add_argument('--quote', default='USDT')
+    parser.add_argument('--timeframes', nargs='+', default=['1m'])
+    parser.add_argument('--since', required=True, help="UTC start date, e.g. 2024-01-01")
+    parser.add_argument('--out', default='data/ohlcv')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--weight-per-minute', type=int, default=600)
+    asyncio.run(_main(parser.parse_args()))
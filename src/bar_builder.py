@@ -0,0 +1,246 @@
+"""
+Sub-minute OHLCV bars aggregated locally from the trade stream.
+
+Every trade updates the forming bar of each configured timeframe (1s, 5s,
+15s, ...) and, optionally, of a volume bar that closes once `volume_bar_size`
+base units have traded. Closed bars go into a fixed-size ring buffer per
+symbol and timeframe, so memory stays bounded for hundreds of symbols. Seconds
+without trades get flat zero-volume bars at the previous close, as Binance
+klines do, so indicator periods keep meaning a fixed span of time.
+
+Bars are served in fetch_ohlcv's format, forming bar last, so the indicator
+path runs on them unchanged; BarFeedExchange answers fetch_ohlcv for the
+builder's timeframes and passes every other call to the wrapped exchange:
+
+    builder = BarBuilder(('1s', '5s', '15s'))
+    exchange = BarFeedExchange(exchange, builder)
+    task = asyncio.create_task(capture(pairs, None, ('trade',), on_trade=builder.on_trade))
+    ohlcv = await exchange.fetch_ohlcv(pair, timeframe='5s', limit=100)
+"""
+import numpy as np
+
+from src.backfill import timeframe_ms
+
+VOLUME = 'volume'
+
+
+class _Bars:
+    """Closed bars of one symbol and timeframe in a ring buffer, plus the forming bar."""
+
+    __slots__ = ('rows', 'count', 'forming')
+
+    def __init__(self, capacity):
+        self.rows = np.empty((capacity, 6))
+        self.count = 0
+        self.forming = None
+
+    def close(self):
+        self.rows[self.count % len(self.rows)] = self.forming
+        self.count += 1
+        self.forming = None
+
+    def fill(self, start, stop, step):
+        """Close flat zero-volume bars at the last close for every step in [start, stop)."""
+        close = self.rows[(self.count - 1) % len(self.rows), 4]
+        capacity = len(self.rows)
+        start = max(start, stop - capacity * step)
+        n = (stop - start + step - 1) // step
+        if n <= 8:
+            for t in range(start, stop, step):
+                self.rows[self.count % capacity] = (t, close, close, close, close, 0.0)
+                self.count += 1
+            return
+        offsets = np.arange(n)
+        index = (self.count + offsets) % capacity
+        self.rows[index, 0] = start + offsets * step
+        self.rows[index, 1:5] = close
+        self.rows[index, 5] = 0.0
+        self.count += n
+
+    def push(self, start, open_, high, low, close, volume, step):
+        """Merge an aggregate of trades in the bar starting at `start` into the series."""
+        forming = self.forming
+        if forming is not None and start == forming[0]:
+            forming[2] = max(forming[2], high)
+            forming[3] = min(forming[3], low)
+            forming[4] = close
+            forming[5] += volume
+            return
+        if forming is not None:
+            if start < forming[0]:
+                return
+            self.close()
+            if start > forming[0] + step:
+                self.fill(int(forming[0]) + step, start, step)
+        self.forming = [start, open_, high, low, close, volume]
+
+    def last(self, limit=None, include_forming=True):
+        capacity = len(self.rows)
+        n = min(self.count, capacity)
+        i = self.count % capacity
+        rows = np.concatenate([self.rows[i:], self.rows[:i]]) if self.count > capacity else self.rows[:n]
+        if include_forming and self.forming is not None:
+            rows = np.vstack([rows, self.forming])
+        return rows[-limit:] if limit else rows
+
+
+class BarBuilder:
+    """
+    Callables appended to `listeners` receive (symbol, timeframe, bar) for every closed bar.
+
+    :param timeframes: Time-bar timeframes to build ('1s', '5s', '15s', '1m', ...)
+    :param volume_bar_size: Base volume per volume bar, a {symbol: size} dict, or None for no volume bars
+    :param history: Closed bars kept per symbol and timeframe
+    """
+
+    def __init__(self, timeframes=('1s', '5s', '15s'), volume_bar_size=None, history=1000):
+        self.steps = {timeframe: timeframe_ms(timeframe) for timeframe in timeframes}
+        self.volume_bar_size = volume_bar_size
+        self.history = history
+        self.series = {}
+        self.listeners = []
+        self.trades = 0
+        self.late = 0
+
+    @property
+    def timeframes(self):
+        return list(self.steps) + ([VOLUME] if self.volume_bar_size else [])
+
+    def _bars(self, symbol, timeframe):
+        bars = self.series.get((symbol, timeframe))
+        if bars is None:
+            bars = self.series[(symbol, timeframe)] = _Bars(self.history)
+        return bars
+
+    def _volume_size(self, symbol):
+        if isinstance(self.volume_bar_size, dict):
+            return self.volume_bar_size.get(symbol)
+        return self.volume_bar_size
+
+    def _closed(self, symbol, timeframe, bars, before):
+        for listener in self.listeners:
+            for k in range(max(before, bars.count - len(bars.rows)), bars.count):
+                row = bars.rows[k % len(bars.rows)].tolist()
+                listener(symbol, timeframe, [int(row[0])] + row[1:])
+
+    def on_trade(self, symbol, trade):
+        """Trade callback in TickReplay / capture() form (a ccxt-style trade dict)."""
+        self.add(symbol, trade['timestamp'], trade['price'], trade['amount'])
+
+    def add(self, symbol, timestamp, price, amount):
+        self.trades += 1
+        for timeframe, step in self.steps.items():
+            bars = self._bars(symbol, timeframe)
+            start = timestamp - timestamp % step
+            forming = bars.forming
+            if forming is not None and start == forming[0]:
+                # The common case, kept inline
+                if price > forming[2]:
+                    forming[2] = price
+                elif price < forming[3]:
+                    forming[3] = price
+                forming[4] = price
+                forming[5] += amount
+                continue
+            if forming is not None and start < forming[0]:
+                self.late += 1
+                continue
+            before = bars.count
+            bars.push(start, price, price, price, price, amount, step)
+            if self.listeners and bars.count > before:
+                self._closed(symbol, timeframe, bars, before)
+        if self._volume_size(symbol):
+            self._add_volume(symbol, timestamp, price, amount)
+
+    def add_trades(self, symbol, timestamps, prices, amounts):
+        """Aggregate a time-ordered batch of trades (e.g. a replayed chunk) with one reduction per timeframe."""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if not len(timestamps):
+            return
+        self.trades += len(timestamps)
+        for timeframe, step in self.steps.items():
+            bars = self._bars(symbol, timeframe)
+            starts = timestamps - timestamps % step
+            first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+            last = np.r_[first[1:], len(starts)] - 1
+            groups = zip(starts[first].tolist(), prices[first].tolist(),
+                         np.maximum.reduceat(prices, first).tolist(), np.minimum.reduceat(prices, first).tolist(),
+                         prices[last].tolist(), np.add.reduceat(amounts, first).tolist())
+            before = bars.count
+            for group in groups:
+                bars.push(*group, step)
+            if self.listeners and bars.count > before:
+                self._closed(symbol, timeframe, bars, before)
+        if self._volume_size(symbol):
+            for timestamp, price, amount in zip(timestamps.tolist(), prices.tolist(), amounts.tolist()):
+                self._add_volume(symbol, timestamp, price, amount)
+
+    def _add_volume(self, symbol, timestamp, price, amount):
+        bars = self._bars(symbol, VOLUME)
+        forming = bars.forming
+        if forming is None:
+            forming = bars.forming = [timestamp, price, price, price, price, amount]
+        else:
+            forming[2] = max(forming[2], price)
+            forming[3] = min(forming[3], price)
+            forming[4] = price
+            forming[5] += amount
+        if forming[5] >= self._volume_size(symbol):
+            bars.close()
+            if self.listeners:
+                self._closed(symbol, VOLUME, bars, bars.count - 1)
+
+    def symbols(self):
+        return sorted({symbol for symbol, _ in self.series})
+
+    def discard(self, symbol):
+        """Drop every bar of a symbol that is no longer followed."""
+        for key in [key for key in self.series if key[0] == symbol]:
+            del self.series[key]
+
+    def bar_count(self, symbol, timeframe, include_forming=True):
+        bars = self.series.get((symbol, timeframe))
+        if bars is None:
+            return 0
+        return min(bars.count, self.history) + (include_forming and bars.forming is not None)
+
+    def arrays(self, symbol, timeframe, limit=None, include_forming=True):
+        """(n, 6) float array of [timestamp, open, high, low, close, volume] rows, oldest first."""
+        bars = self.series.get((symbol, timeframe))
+        if bars is None:
+            return np.empty((0, 6))
+        return bars.last(limit, include_forming)
+
+    def ohlcv(self, symbol, timeframe, since=None, limit=None, include_forming=True):
+        """Bars in fetch_ohlcv's format: [[timestamp, open, high, low, close, volume], ...]."""
+        rows = self.arrays(symbol, timeframe, None if since is not None else limit, include_forming)
+        if since is not None:
+            rows = rows[rows[:, 0] >= since][:limit]
+        return [[int(row[0])] + row[1:] for row in rows.tolist()]
+
+
+class BarFeedExchange:
+    """
+    Serves fetch_ohlcv for the builder's timeframes from locally built bars;
+    every other call (and other timeframes) goes to the wrapped exchange.
+
+    :param min_bars: Bars a symbol needs before it is served locally; until then the call is passed through
+    """
+
+    def __init__(self, exchange, builder, min_bars=1):
+        self.exchange = exchange
+        self.builder = builder
+        self.min_bars = min_bars
+
+    def __getattr__(self, name):
+        return getattr(self.exchange, name)
+
+    def has_bars(self, symbol, timeframe, count=None):
+        return self.builder.bar_count(symbol, timeframe) >= (count or self.min_bars)
+
+    async def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params=None):
+        if timeframe in self.builder.timeframes and self.has_bars(symbol, timeframe):
+            return self.builder.ohlcv(symbol, timeframe, since, limit)
+        return await self.exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit)
@@ -1,5 +1,13 @@
+from collections import namedtuple
+
+import numpy as np
 import pandas as pd
 
+from src.rolling import rolling_mean_var
+
+Bands = namedtuple('Bands', ['middle', 'upper', 'lower', 'bandwidth', 'percent_b'])
+
+
 def bollinger_bands(data, window, num_std_dev):
     if len(data) < window:
         return pd.Series([None] * len(data)), pd.Series([None] * len(data))
@@ -8,3 +16,77 @@ def bollinger_bands(data, window, num_std_dev):
     upper_band = sma + (std * num_std_dev)
     lower_band = sma - (std * num_std_dev)
     return upper_band.bfill(), lower_band.bfill()
+
+
+def bollinger_bands_multi(data, windows=(20,), num_std_devs=(2.0,)):
+    """
+    Bollinger Bands for several windows and deviation multipliers from one pass over the data.
+
+    Every window's rolling mean and (population) variance come from
+    src.rolling.rolling_mean_var, whose blocked sums stay local to the window
+    (no drift of global prefix sums, no cancellation against the price level),
+    matching TA-Lib's BBANDS with matype=SMA.
+
+    :param data: Prices of shape (n_bars,) or (n_bars, n_symbols); NaN-free
+    :param windows: Rolling window lengths
+    :param num_std_devs: Band widths in standard deviations
+    :return: dict mapping (window, num_std_dev) to Bands(middle, upper, lower, bandwidth, percent_b),
+             each a NumPy array of the input shape with NaN for the first window - 1 bars
+    """
+    x = np.asarray(data, dtype=np.float64)
+    n = x.shape[0]
+    result = {}
+    if n == 0:
+        return {(w, k): Bands(*([x.copy()] * 5)) for w in windows for k in num_std_devs}
+
+    for window in windows:
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        mean = np.full(x.shape, np.nan)
+        std = np.full(x.shape, np.nan)
+        if window <= n:
+            mean[window - 1:], variance = rolling_mean_var(x, window)
+            std[window - 1:] = np.sqrt(variance)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in num_std_devs:
+                upper = mean + k * std
+                lower = mean - k * std
+                width = upper - lower
+                result[(window, k)] = Bands(
+                    middle=mean,
+                    upper=upper,
+                    lower=lower,
+                    bandwidth=width / mean,
+                    percent_b=np.where(width > 0, (x - lower) / width, np.nan),
+                )
+    return result
+
+
+def bollinger_frame(close, windows=(20,), num_std_devs=(2.0,)):
+    """
+    Bollinger Bands for a close Series as a DataFrame with columns such as
+    'upper_band_20_2', 'middle_band_20', 'bandwidth_20_2' and 'percent_b_20_2'.
+    """
+    frame = {}
+    for (window, k), bands in bollinger_bands_multi(close.to_numpy(), windows, num_std_devs).items():
+        suffix = f"{window}_{k:g}"
+        frame[f"middle_band_{window}"] = bands.middle
+        frame[f"upper_band_{suffix}"] = bands.upper
+        frame[f"lower_band_{suffix}"] = bands.lower
+        frame[f"bandwidth_{suffix}"] = bands.bandwidth
+        frame[f"percent_b_{suffix}"] = bands.percent_b
+    return pd.DataFrame(frame, index=close.index)
+
+
+def bollinger_panel(closes, windows=(20,), num_std_devs=(2.0,)):
+    """
+    Bollinger Bands across a symbol panel.
+
+    :param closes: DataFrame of closes, one column per symbol, rows aligned in time
+    :return: dict mapping (window, num_std_dev) to Bands of DataFrames shaped like closes
+    """
+    bands = bollinger_bands_multi(closes.to_numpy(), windows, num_std_devs)
+    return {
+        key: Bands(*(pd.DataFrame(values, index=closes.index, columns=closes.columns) for values in value))
+        for key, value in bands.items()
+    }
@@ -1,6 +1,72 @@
+import math
+
+import numpy as np
 import pandas as pd
 
 def ema(data, window):
     if len(data) < window:
         return pd.Series([None] * len(data))
     return data.ewm(span=window, adjust=False).mean().bfill()  # Using bfill() as recommended
+
+
+class EmaState:
+    """
+    Incremental EMA seeded with the SMA of the first `window` values (TA-Lib style).
+    update() returns NaN until the seed is complete.
+    """
+
+    def __init__(self, window, alpha=None):
+        self.window = window
+        self.alpha = 2.0 / (window + 1) if alpha is None else alpha
+        self.count = 0
+        self.value = np.nan
+        self._sum = 0.0
+
+    def update(self, x):
+        self.count += 1
+        if self.count < self.window:
+            self._sum += x
+            return np.nan
+        if self.count == self.window:
+            self.value = (self._sum + x) / self.window
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def peek(self, x):
+        """What update(x) would return, without changing the state."""
+        count = self.count + 1
+        if count < self.window:
+            return np.nan
+        if count == self.window:
+            return (self._sum + x) / self.window
+        return self.value + self.alpha * (x - self.value)
+
+
+def smooth(x, alpha, seed):
+    """
+    y[t] = y[t-1] + alpha * (x[t] - y[t-1]) with y[-1] = seed, vectorized.
+
+    Each block uses the closed form y = r^(t+1) * y0 + alpha * r^t * cumsum(x * r^-j)
+    with r = 1 - alpha; blocks are sized so that r^-j stays well inside float range.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.empty(x.shape)
+    if len(x) == 0:
+        return out
+    r = 1.0 - alpha
+    if r <= 0.0:
+        out[:] = x
+        return out
+    block = max(1, min(256, int(200 / -math.log10(r)))) if r < 1.0 else len(x)
+    powers = r ** np.arange(block + 1, dtype=np.float64)
+    inverse = 1.0 / powers[:-1]
+    extra = (slice(None),) + (None,) * (x.ndim - 1)
+    prev = seed
+    for start in range(0, len(x), block):
+        chunk = x[start:start + block]
+        m = len(chunk)
+        acc = np.cumsum(chunk * inverse[:m][extra], axis=0)
+        out[start:start + m] = powers[1:m + 1][extra] * prev + alpha * powers[:m][extra] * acc
+        prev = out[start + m - 1]
+    return out
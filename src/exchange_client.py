@@ -0,0 +1,146 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SharedSession:
+    """
+    One keep-alive aiohttp connection pool (with DNS caching) shared by every
+    exchange attached to it. The session is created lazily inside the running
+    event loop and closed when the last attached exchange is closed.
+
+    :param limit: Maximum number of simultaneous connections in the pool
+    :param ttl_dns_cache: Seconds to cache DNS lookups
+    :param keepalive_timeout: Seconds an idle connection is kept open
+    """
+
+    def __init__(self, limit=100, ttl_dns_cache=300, keepalive_timeout=60):
+        self.limit = limit
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.users = 0
+
+    def get(self):
+        if self.session is None or self.session.closed:
+            import aiohttp  # installed with ccxt
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                use_dns_cache=True,
+                ttl_dns_cache=self.ttl_dns_cache,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True,
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    def attach(self, exchange):
+        exchange.session = self.get()
+        # ccxt only closes sessions it owns; the pool is closed by release()
+        exchange.own_session = False
+        self.users += 1
+
+    async def release(self):
+        self.users = max(self.users - 1, 0)
+        if self.users == 0 and self.session is not None and not self.session.closed:
+            await self.session.close()
+        if self.users == 0:
+            self.session = None
+
+
+shared_session = SharedSession()
+
+
+class SingleFlightExchange:
+    """
+    Wraps a ccxt async exchange so that concurrent identical read-only requests
+    (same method and arguments) share a single in-flight call ("single-flight");
+    every caller receives the same result object, so treat it as read-only.
+    Everything else is passed through to the wrapped exchange unchanged.
+
+    :param exchange: ccxt.async_support exchange instance
+    :param session: SharedSession to pool connections with, or None to let ccxt manage its own
+    """
+
+    def __init__(self, exchange, session=shared_session):
+        self.exchange = exchange
+        self.shared = session
+        self.hits = 0
+        self.misses = 0
+        self._in_flight = {}
+        self._attached = False
+
+    def __getattr__(self, name):
+        return getattr(self.exchange, name)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'in_flight': len(self._in_flight),
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def _ensure_session(self):
+        if self.shared is not None and not self._attached:
+            self.shared.attach(self.exchange)
+            self._attached = True
+
+    async def _call(self, name, *args, **kwargs):
+        self._ensure_session()
+        # repr() so list arguments (e.g. fetch_tickers(symbols)) can be part of the key
+        key = (name, repr(args), tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(getattr(self.exchange, name)(*args, **kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    # Read-only calls that are safe to share between concurrent callers.
+    # Order placement is never coalesced.
+    async def load_markets(self, *args, **kwargs):
+        return await self._call('load_markets', *args, **kwargs)
+
+    async def fetch_balance(self, *args, **kwargs):
+        return await self._call('fetch_balance', *args, **kwargs)
+
+    async def fetch_ticker(self, *args, **kwargs):
+        return await self._call('fetch_ticker', *args, **kwargs)
+
+    async def fetch_tickers(self, *args, **kwargs):
+        return await self._call('fetch_tickers', *args, **kwargs)
+
+    async def fetch_ohlcv(self, *args, **kwargs):
+        return await self._call('fetch_ohlcv', *args, **kwargs)
+
+    async def fetch_raw_klines(self, *args, **kwargs):
+        return await self._call('fetch_raw_klines', *args, **kwargs)
+
+    async def fetch_order_book(self, *args, **kwargs):
+        return await self._call('fetch_order_book', *args, **kwargs)
+
+    async def fetch_trades(self, *args, **kwargs):
+        return await self._call('fetch_trades', *args, **kwargs)
+
+    async def create_market_buy_order(self, *args, **kwargs):
+        self._ensure_session()
+        return await self.exchange.create_market_buy_order(*args, **kwargs)
+
+    async def create_market_sell_order(self, *args, **kwargs):
+        self._ensure_session()
+        return await self.exchange.create_market_sell_order(*args, **kwargs)
+
+    async def close(self):
+        logger.info("Request coalescing stats: %s", self.stats())
+        await self.exchange.close()
+        if self._attached:
+            self._attached = False
+            await self.shared.release()
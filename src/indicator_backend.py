@@ -0,0 +1,621 @@
+"""
+Pluggable technical-indicator backends.
+
+Three interchangeable implementations of the indicators used by the bots, all
+following TA-Lib's call signatures, output alignment (NaN for the lookback
+bars) and seeding conventions:
+
+- 'talib': the TA-Lib C library, when it is installed
+- 'numpy': vectorized NumPy kernels
+- 'incremental': bar-by-bar state objects, the same ones used for live updates
+
+IndicatorEngine checks every backend against a reference for parity, times the
+candidates on synthetic data of the requested size, and routes each call to
+the fastest backend that agrees with the reference. Run
+
+    python -m src.indicator_backend
+
+for the parity report and benchmark table.
+"""
+import logging
+import math
+import time
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.bollinger_bands import bollinger_bands_multi
+from src.ema import EmaState, smooth
+from src.rolling import CciState, StochState, rolling_mad, rolling_max, rolling_mean, rolling_min
+from src.trix import TrixState
+
+try:
+    import talib
+except ImportError:  # TA-Lib C library not available on this host
+    talib = None
+
+logger = logging.getLogger(__name__)
+
+# Indicator name -> (input series, default parameters)
+INDICATORS = {
+    'EMA': (('close',), {'timeperiod': 14}),
+    'WMA': (('close',), {'timeperiod': 14}),
+    'BBANDS': (('close',), {'timeperiod': 20, 'nbdevup': 2, 'nbdevdn': 2}),
+    'TRIX': (('close',), {'timeperiod': 15}),
+    'RSI': (('close',), {'timeperiod': 14}),
+    'MACD': (('close',), {'fastperiod': 12, 'slowperiod': 26, 'signalperiod': 9}),
+    'ATR': (('high', 'low', 'close'), {'timeperiod': 14}),
+    'STOCH': (('high', 'low', 'close'), {'fastk_period': 14, 'slowk_period': 3, 'slowk_matype': 0,
+                                         'slowd_period': 3, 'slowd_matype': 0}),
+    'CCI': (('high', 'low', 'close'), {'timeperiod': 14}),
+    'OBV': (('close', 'volume'), {}),
+}
+
+
+def sample_ohlcv(n, seed=0):
+    """Random-walk OHLCV arrays used by the parity checks and the benchmark."""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    spread = close * rng.uniform(0, 0.01, n)
+    return {
+        'open': np.r_[close[:1], close[:-1]],
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+        'volume': rng.uniform(1, 1000, n),
+    }
+
+
+# ---------------------------------------------------------------------------
+# NumPy kernels
+
+def _sma(x, period):
+    out = np.full(x.shape, np.nan)
+    if period <= len(x):
+        csum = np.cumsum(np.r_[0.0, x])
+        out[period - 1:] = (csum[period:] - csum[:-period]) / period
+    return out
+
+
+def np_ema(close, timeperiod=30):
+    x = np.asarray(close, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    p = timeperiod
+    if len(x) >= p:
+        seed = x[:p].mean()
+        out[p - 1] = seed
+        out[p:] = smooth(x[p:], 2.0 / (p + 1), seed)
+    return out
+
+
+def np_wma(close, timeperiod=30):
+    x = np.asarray(close, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    p = timeperiod
+    if len(x) >= p:
+        weights = np.arange(1, p + 1, dtype=np.float64)
+        out[p - 1:] = sliding_window_view(x, p) @ weights / weights.sum()
+    return out
+
+
+def np_bbands(close, timeperiod=5, nbdevup=2, nbdevdn=2, matype=0):
+    if matype != 0:
+        raise NotImplementedError("only SMA Bollinger Bands are implemented")
+    bands = bollinger_bands_multi(close, (timeperiod,), sorted({nbdevup, nbdevdn}))
+    return bands[(timeperiod, nbdevup)].upper, bands[(timeperiod, nbdevup)].middle, bands[(timeperiod, nbdevdn)].lower
+
+
+def np_trix(close, timeperiod=30):
+    x = np.asarray(close, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    p = timeperiod
+    lookback = 3 * (p - 1) + 1
+    if len(x) > lookback:
+        e = x
+        for _ in range(3):
+            e = np_ema(e, p)[p - 1:]
+        out[lookback:] = (e[1:] / e[:-1] - 1.0) * 100.0
+    return out
+
+
+def _wilder_averages(x, p):
+    """Wilder-smoothed average gain and loss, aligned to x[p:]."""
+    diff = np.diff(x)
+    gain = np.maximum(diff, 0.0)
+    loss = np.maximum(-diff, 0.0)
+    avg_gain = np.r_[gain[:p].mean(), smooth(gain[p:], 1.0 / p, gain[:p].mean())]
+    avg_loss = np.r_[loss[:p].mean(), smooth(loss[p:], 1.0 / p, loss[:p].mean())]
+    return avg_gain, avg_loss
+
+
+def np_rsi(close, timeperiod=14):
+    x = np.asarray(close, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    p = timeperiod
+    if len(x) > p:
+        avg_gain, avg_loss = _wilder_averages(x, p)
+        total = avg_gain + avg_loss
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[p:] = np.where(total > 0, 100.0 * avg_gain / total, 0.0)
+    return out
+
+
+def _macd_lines(x, fastperiod, slowperiod, signalperiod):
+    """Fast EMA, slow EMA, MACD line and signal EMA, aligned to x[slowperiod - 1:]."""
+    start = slowperiod - 1
+    # Both EMAs start on the slow EMA's first bar, as in TA-Lib
+    slow = np_ema(x, slowperiod)[start:]
+    fast_seed = x[start - fastperiod + 1:start + 1].mean()
+    fast = np.r_[fast_seed, smooth(x[start + 1:], 2.0 / (fastperiod + 1), fast_seed)]
+    line = fast - slow
+    return fast, slow, line, np_ema(line, signalperiod)
+
+
+def np_macd(close, fastperiod=12, slowperiod=26, signalperiod=9):
+    x = np.asarray(close, dtype=np.float64)
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+    macd = np.full(x.shape, np.nan)
+    signal = np.full(x.shape, np.nan)
+    start = slowperiod - 1
+    lookback = start + signalperiod - 1
+    if len(x) > lookback:
+        _, _, line, signal_ema = _macd_lines(x, fastperiod, slowperiod, signalperiod)
+        macd[lookback:] = line[signalperiod - 1:]
+        signal[start:] = signal_ema
+        signal[:lookback] = np.nan
+    return macd, signal, macd - signal
+
+
+def _true_range(high, low, close):
+    prev = close[:-1]
+    return np.maximum(high[1:], prev) - np.minimum(low[1:], prev)
+
+
+def np_atr(high, low, close, timeperiod=14):
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    out = np.full(close.shape, np.nan)
+    p = timeperiod
+    if len(close) > p:
+        tr = _true_range(high, low, close)
+        seed = tr[:p].mean()
+        out[p] = seed
+        out[p + 1:] = smooth(tr[p:], 1.0 / p, seed)
+    return out
+
+
+def np_stoch(high, low, close, fastk_period=5, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0):
+    if slowk_matype != 0 or slowd_matype != 0:
+        raise NotImplementedError("only SMA smoothing is implemented for STOCH")
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    n = len(close)
+    slowk = np.full(n, np.nan)
+    slowd = np.full(n, np.nan)
+    lookback = fastk_period - 1 + slowk_period - 1 + slowd_period - 1
+    if n > lookback:
+        lowest = rolling_min(low, fastk_period)
+        span = rolling_max(high, fastk_period) - lowest
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fastk = np.where(span > 0, 100.0 * (close[fastk_period - 1:] - lowest) / span, 0.0)
+        k = _sma(fastk, slowk_period)[slowk_period - 1:]
+        d = _sma(k, slowd_period)
+        slowk[lookback:] = k[slowd_period - 1:]
+        slowd[lookback:] = d[slowd_period - 1:]
+    return slowk, slowd
+
+
+def np_cci(high, low, close, timeperiod=14):
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    out = np.full(close.shape, np.nan)
+    p = timeperiod
+    if len(close) >= p:
+        typical = (high + low + close) / 3.0
+        mean = rolling_mean(typical, p)
+        deviation = rolling_mad(typical, p, mean)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[p - 1:] = np.where(deviation > 0, (typical[p - 1:] - mean) / (0.015 * deviation), 0.0)
+    return out
+
+
+def np_obv(close, volume):
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    if len(close) == 0:
+        return np.empty(0)
+    signed = np.sign(np.diff(close)) * volume[1:]
+    return volume[0] + np.r_[0.0, np.cumsum(signed)]
+
+
+# ---------------------------------------------------------------------------
+# Incremental state objects
+
+class RsiState:
+    """Wilder RSI updated one close at a time (TA-Lib seeding)."""
+
+    def __init__(self, timeperiod=14):
+        self.period = timeperiod
+        self.prev = None
+        self.gain = EmaState(timeperiod, alpha=1.0 / timeperiod)
+        self.loss = EmaState(timeperiod, alpha=1.0 / timeperiod)
+
+    def update(self, close):
+        if self.prev is None:
+            self.prev = close
+            return np.nan
+        diff = close - self.prev
+        self.prev = close
+        gain = self.gain.update(max(diff, 0.0))
+        loss = self.loss.update(max(-diff, 0.0))
+        if gain != gain:  # still seeding
+            return np.nan
+        total = gain + loss
+        return 100.0 * gain / total if total > 0 else 0.0
+
+    def peek(self, close):
+        """What update(close) would return, without changing the state."""
+        if self.prev is None:
+            return np.nan
+        diff = close - self.prev
+        gain = self.gain.peek(max(diff, 0.0))
+        loss = self.loss.peek(max(-diff, 0.0))
+        if gain != gain:
+            return np.nan
+        total = gain + loss
+        return 100.0 * gain / total if total > 0 else 0.0
+
+
+class AtrState:
+    """Wilder ATR updated one bar at a time (TA-Lib seeding)."""
+
+    def __init__(self, timeperiod=14):
+        self.prev_close = None
+        self.tr = EmaState(timeperiod, alpha=1.0 / timeperiod)
+
+    def update(self, high, low, close):
+        if self.prev_close is None:
+            self.prev_close = close
+            return np.nan
+        tr = max(high, self.prev_close) - min(low, self.prev_close)
+        self.prev_close = close
+        return self.tr.update(tr)
+
+    def peek(self, high, low, close):
+        """What update() would return for this bar, without changing the state."""
+        if self.prev_close is None:
+            return np.nan
+        return self.tr.peek(max(high, self.prev_close) - min(low, self.prev_close))
+
+
+class MacdState:
+    """MACD line, signal and histogram updated one close at a time (TA-Lib seeding)."""
+
+    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+        self.fast_alpha = 2.0 / (fastperiod + 1)
+        self.recent = deque(maxlen=fastperiod)
+        self.fast = np.nan
+        self.slow = EmaState(slowperiod)
+        self.signal = EmaState(signalperiod)
+
+    def update(self, close):
+        self.recent.append(close)
+        slow = self.slow.update(close)
+        if slow != slow:  # still seeding
+            return np.nan, np.nan, np.nan
+        # Both EMAs start on the slow EMA's first bar, the fast one from the SMA of its last `fastperiod` closes
+        if self.fast != self.fast:
+            self.fast = sum(self.recent) / len(self.recent)
+        else:
+            self.fast += self.fast_alpha * (close - self.fast)
+        line = self.fast - slow
+        signal = self.signal.update(line)
+        if signal != signal:
+            return np.nan, np.nan, np.nan
+        return line, signal, line - signal
+
+    def peek(self, close):
+        """What update(close) would return, without changing the state."""
+        slow = self.slow.peek(close)
+        if slow != slow:
+            return np.nan, np.nan, np.nan
+        if self.fast != self.fast:
+            recent = list(self.recent)[len(self.recent) == self.recent.maxlen:] + [close]
+            fast = sum(recent) / len(recent)
+        else:
+            fast = self.fast + self.fast_alpha * (close - self.fast)
+        line = fast - slow
+        signal = self.signal.peek(line)
+        if signal != signal:
+            return np.nan, np.nan, np.nan
+        return line, signal, line - signal
+
+
+class ObvState:
+    """On-balance volume updated one bar at a time."""
+
+    def __init__(self):
+        self.prev = None
+        self.value = 0.0
+
+    def update(self, close, volume):
+        if self.prev is None:
+            self.value = volume
+        elif close > self.prev:
+            self.value += volume
+        elif close < self.prev:
+            self.value -= volume
+        self.prev = close
+        return self.value
+
+    def peek(self, close, volume):
+        """What update() would return for this bar, without changing the state."""
+        if self.prev is None:
+            return volume
+        if close > self.prev:
+            return self.value + volume
+        if close < self.prev:
+            return self.value - volume
+        return self.value
+
+
+def _replay(state, *inputs):
+    columns = [np.asarray(a, dtype=np.float64).tolist() for a in inputs]
+    return np.array([state.update(*values) for values in zip(*columns)], dtype=np.float64)
+
+
+def inc_ema(close, timeperiod=30):
+    return _replay(EmaState(timeperiod), close)
+
+
+def inc_trix(close, timeperiod=30):
+    return _replay(TrixState(timeperiod), close)
+
+
+def inc_rsi(close, timeperiod=14):
+    return _replay(RsiState(timeperiod), close)
+
+
+def inc_macd(close, fastperiod=12, slowperiod=26, signalperiod=9):
+    lines = _replay(MacdState(fastperiod, slowperiod, signalperiod), close).reshape(-1, 3)
+    return lines[:, 0].copy(), lines[:, 1].copy(), lines[:, 2].copy()
+
+
+def inc_atr(high, low, close, timeperiod=14):
+    return _replay(AtrState(timeperiod), high, low, close)
+
+
+def inc_obv(close, volume):
+    return _replay(ObvState(), close, volume)
+
+
+def inc_stoch(high, low, close, fastk_period=5, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0):
+    if slowk_matype != 0 or slowd_matype != 0:
+        raise NotImplementedError("only SMA smoothing is implemented for STOCH")
+    lines = _replay(StochState(fastk_period, slowk_period, slowd_period), high, low, close).reshape(-1, 2)
+    return lines[:, 0].copy(), lines[:, 1].copy()
+
+
+def inc_cci(high, low, close, timeperiod=14):
+    return _replay(CciState(timeperiod), high, low, close)
+
+
+# ---------------------------------------------------------------------------
+# Backends
+
+class Backend:
+    """A named set of indicator functions, keyed by TA-Lib function name."""
+
+    def __init__(self, name, functions):
+        self.name = name
+        self.functions = functions
+
+    def supports(self, indicator):
+        return indicator in self.functions
+
+    def __call__(self, indicator, *inputs, **params):
+        return self.functions[indicator](*inputs, **params)
+
+
+def _talib_backend():
+    if talib is None:
+        return None
+    return Backend('talib', {name: getattr(talib, name) for name in INDICATORS})
+
+
+numpy_backend = Backend('numpy', {
+    'EMA': np_ema,
+    'WMA': np_wma,
+    'BBANDS': np_bbands,
+    'TRIX': np_trix,
+    'RSI': np_rsi,
+    'MACD': np_macd,
+    'ATR': np_atr,
+    'STOCH': np_stoch,
+    'CCI': np_cci,
+    'OBV': np_obv,
+})
+
+incremental_backend = Backend('incremental', {
+    'EMA': inc_ema,
+    'TRIX': inc_trix,
+    'RSI': inc_rsi,
+    'MACD': inc_macd,
+    'ATR': inc_atr,
+    'STOCH': inc_stoch,
+    'CCI': inc_cci,
+    'OBV': inc_obv,
+})
+
+
+def available_backends():
+    backends = [_talib_backend(), numpy_backend, incremental_backend]
+    return [b for b in backends if b is not None]
+
+
+# ---------------------------------------------------------------------------
+# Parity checks and benchmark
+
+def _as_tuple(result):
+    return result if isinstance(result, tuple) else (result,)
+
+
+def compare_outputs(expected, actual, rtol=1e-7, atol=1e-9):
+    """Largest deviation between two indicator results, or inf if their NaN masks differ."""
+    worst = 0.0
+    for e, a in zip(_as_tuple(expected), _as_tuple(actual)):
+        e = np.asarray(e, dtype=np.float64)
+        a = np.asarray(a, dtype=np.float64)
+        if e.shape != a.shape or not np.array_equal(np.isnan(e), np.isnan(a)):
+            return math.inf
+        mask = ~np.isnan(e)
+        if mask.any():
+            scale = atol + rtol * np.abs(e[mask])
+            worst = max(worst, float(np.max(np.abs(e[mask] - a[mask]) / scale)))
+    return worst
+
+
+def check_parity(backend, reference, indicator, sizes=(10, 40, 300), seed=0, params=None):
+    """True if `backend` matches `reference` for `indicator` on random data of each size."""
+    names, defaults = INDICATORS[indicator]
+    params = defaults if params is None else params
+    for size in sizes:
+        data = sample_ohlcv(size, seed)
+        inputs = [data[name] for name in names]
+        try:
+            worst = compare_outputs(reference(indicator, *inputs, **params), backend(indicator, *inputs, **params))
+        except NotImplementedError:
+            return False
+        if worst > 1.0:
+            logger.warning("%s %s differs from %s on %s bars", backend.name, indicator, reference.name, size)
+            return False
+    return True
+
+
+def benchmark(backend, indicator, size, params=None, repeat=5, seed=0):
+    """Best-of-`repeat` wall time in seconds of one call on `size` bars."""
+    names, defaults = INDICATORS[indicator]
+    params = defaults if params is None else params
+    data = sample_ohlcv(size, seed)
+    inputs = [data[name] for name in names]
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        backend(indicator, *inputs, **params)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parity_report(backends=None, reference=None):
+    """Parity of every backend against the reference: {(backend, indicator): bool}."""
+    backends = available_backends() if backends is None else backends
+    reference = backends[0] if reference is None else reference
+    return {
+        (backend.name, indicator): check_parity(backend, reference, indicator)
+        for backend in backends
+        for indicator in INDICATORS
+        if backend.supports(indicator)
+    }
+
+
+def _params_key(params):
+    return tuple(sorted(params.items()))
+
+
+class IndicatorEngine:
+    """
+    Routes TA-Lib-style calls (engine.EMA(close, timeperiod=14), ...) to the
+    fastest backend that agrees with the reference backend.
+
+    The choice is made per indicator, parameter set and input-size bucket (next
+    power of two) from a parity check and a short micro-benchmark on synthetic
+    data, and cached; warm_up() makes it ahead of the first call. A backend that
+    raises NotImplementedError for particular parameters falls through to the
+    next fastest one.
+
+    :param backends: Backends to choose from (default: every available backend)
+    :param reference: Backend treated as correct (default: the first, TA-Lib when installed)
+    :param force: Name of a backend to always use when it supports the indicator
+    """
+
+    def __init__(self, backends=None, reference=None, force=None, repeat=5):
+        self.backends = available_backends() if backends is None else list(backends)
+        self.reference = self.backends[0] if reference is None else reference
+        self.force = force
+        self.repeat = repeat
+        self._parity = {}
+        self._ranking = {}
+
+    def __getattr__(self, name):
+        if name in INDICATORS:
+            return lambda *inputs, **params: self.compute(name, *inputs, **params)
+        raise AttributeError(name)
+
+    def _passes(self, backend, indicator, params):
+        key = (backend.name, indicator, _params_key(params))
+        if key not in self._parity:
+            self._parity[key] = backend is self.reference or \
+                check_parity(backend, self.reference, indicator, params=params)
+        return self._parity[key]
+
+    def ranking(self, indicator, size, params=None):
+        """Backends usable for `indicator` with `params`, fastest first, for inputs of `size` bars."""
+        params = {**INDICATORS[indicator][1], **(params or {})}
+        bucket = 1 << max(size - 1, 1).bit_length()
+        key = (indicator, bucket, _params_key(params))
+        if key not in self._ranking:
+            candidates = [b for b in self.backends if b.supports(indicator) and self._passes(b, indicator, params)]
+            if self.force is not None:
+                forced = [b for b in candidates if b.name == self.force]
+                ranked = forced + [b for b in candidates if b.name != self.force]
+            else:
+                timings = {b.name: benchmark(b, indicator, bucket, params, self.repeat) for b in candidates}
+                ranked = sorted(candidates, key=lambda b: timings[b.name])
+                logger.info("Indicator backend for %s %s at %s bars: %s", indicator, params, bucket,
+                            ", ".join(f"{b.name}={timings[b.name] * 1e6:.1f}us" for b in ranked))
+            self._ranking[key] = ranked
+        return self._ranking[key]
+
+    def warm_up(self, size, calls=None):
+        """
+        Run the parity checks and benchmarks for inputs of `size` bars ahead of
+        the first compute(), which would otherwise pay for them inline.
+
+        :param calls: (indicator, params) pairs to prepare (default: every indicator with its default parameters)
+        """
+        calls = [(indicator, {}) for indicator in INDICATORS] if calls is None else calls
+        for indicator, params in calls:
+            self.ranking(indicator, size, params)
+
+    def compute(self, indicator, *inputs, **params):
+        arrays = [np.asarray(a, dtype=np.float64) for a in inputs]
+        params = {**INDICATORS[indicator][1], **params}
+        for backend in self.ranking(indicator, len(arrays[0]), params):
+            try:
+                return backend(indicator, *arrays, **params)
+            except NotImplementedError:
+                continue
+        raise NotImplementedError(f"No backend can compute {indicator} with {params}")
+
+
+# Shared engine used by the bot scripts
+indicators = IndicatorEngine()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    backends = available_backends()
+    print(f"Reference backend: {backends[0].name}")
+    failures = [key for key, ok in parity_report(backends).items() if not ok]
+    for name, indicator in failures:
+        print(f"PARITY FAILURE: {name} {indicator}")
+    print(f"{'indicator':<10}{'bars':>8}" + "".join(f"{b.name:>14}" for b in backends))
+    for indicator in INDICATORS:
+        for size in (100, 1000, 10000):
+            cells = "".join(
+                f"{benchmark(b, indicator, size) * 1e6:>12.1f}us" if b.supports(indicator) else f"{'-':>14}"
+                for b in backends
+            )
+            print(f"{indicator:<10}{size:>8}{cells}")
+    raise SystemExit(1 if failures else 0)
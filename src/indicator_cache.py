@@ -0,0 +1,326 @@
+"""
+Memoization of indicator results per closed bar.
+
+The last bar of a fetch is the forming one: its close moves on every scan,
+so it is kept out of the cache. Results over the closed bars are keyed by
+(symbol, timeframe, last closed bar timestamp, indicator, parameters) plus
+the number of closed bars, which fixes where the window starts (EMA seeding
+depends on it). Each entry also keeps a tail state, from which the forming
+bar's value is computed incrementally and appended:
+
+- EMA, TRIX, RSI, MACD, ATR, OBV, STOCH and CCI keep their bar-by-bar state
+  after the closed bars (src.indicator_backend, src.trix, src.rolling), whose
+  peek() gives the next value without advancing it; the state is seeded from
+  the vectorized closed-bar values, or for STOCH and CCI by replaying their
+  last window
+- WMA and BBANDS keep the sums of the closed part of their last window
+
+So a symbol scanned again within a bar costs one O(1) tail step per indicator
+instead of a pass over the window. Every strategy in a process shares the
+module level cache, whose memory is bounded with LRU eviction.
+
+    bars = bar_indicators(pair, '1m', klines.timestamp)
+    df['ema'] = bars.EMA(df['close'], timeperiod=14)
+
+Cached closed-bar arrays are marked read-only; callers get new arrays.
+"""
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from src.ema import EmaState
+from src.indicator_backend import (INDICATORS, AtrState, MacdState, ObvState, RsiState, _macd_lines,
+                                   _wilder_averages, indicators, np_ema)
+from src.rolling import CciState, StochState
+from src.trix import TrixState
+
+
+def _as_tuple(result):
+    return result if isinstance(result, tuple) else (result,)
+
+
+def _nbytes(value):
+    return sum(getattr(v, 'nbytes', 0) for v in _as_tuple(value))
+
+
+def _freeze(value):
+    for array in _as_tuple(value):
+        array.flags.writeable = False
+    return value
+
+
+def _extend(closed, tail):
+    """Closed-bar result(s) with the forming bar's value(s) appended."""
+    if isinstance(closed, tuple):
+        return tuple(np.append(c, t) for c, t in zip(closed, tail))
+    return np.append(closed, tail[0])
+
+
+def _replay(state, closed):
+    for values in zip(*(a.tolist() for a in closed)):
+        state.update(*values)
+    return state
+
+
+def _ema_at(window, count, value, alpha=None):
+    """An EmaState that has seen `count` (>= window) inputs and holds `value`."""
+    state = EmaState(window, alpha)
+    state.count = count
+    state.value = float(value)
+    return state
+
+
+# Seeds of the recursive states. Short histories, still inside the seeding
+# period, are replayed bar by bar; longer ones take the last values of the
+# vectorized closed-bar computation.
+
+def _seed_ema(closed, result, timeperiod):
+    if len(closed[0]) < timeperiod:
+        return _replay(EmaState(timeperiod), closed)
+    return _ema_at(timeperiod, len(closed[0]), result[-1])
+
+
+def _seed_rsi(closed, result, timeperiod):
+    close = closed[0]
+    if len(close) <= timeperiod:
+        return _replay(RsiState(timeperiod), closed)
+    avg_gain, avg_loss = _wilder_averages(close, timeperiod)
+    state = RsiState(timeperiod)
+    state.prev = float(close[-1])
+    state.gain = _ema_at(timeperiod, len(close) - 1, avg_gain[-1], 1.0 / timeperiod)
+    state.loss = _ema_at(timeperiod, len(close) - 1, avg_loss[-1], 1.0 / timeperiod)
+    return state
+
+
+def _seed_macd(closed, result, fastperiod, slowperiod, signalperiod):
+    close = closed[0]
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+    if len(close) < slowperiod + signalperiod:
+        return _replay(MacdState(fastperiod, slowperiod, signalperiod), closed)
+    fast, slow, line, signal = _macd_lines(close, fastperiod, slowperiod, signalperiod)
+    state = MacdState(fastperiod, slowperiod, signalperiod)
+    state.fast = float(fast[-1])
+    state.slow = _ema_at(slowperiod, len(close), slow[-1])
+    state.signal = _ema_at(signalperiod, len(line), signal[-1])
+    return state
+
+
+def _seed_trix(closed, result, timeperiod):
+    close = closed[0]
+    if len(close) <= 3 * timeperiod:
+        return _replay(TrixState(timeperiod), closed)
+    state = TrixState(timeperiod)
+    state.count = len(close)
+    e = close
+    for stage in range(3):
+        e = np_ema(e, timeperiod)[timeperiod - 1:]
+        state.emas[stage] = np.asarray(e[-1])
+    state.prev = state.emas[2]
+    return state
+
+
+def _seed_atr(closed, result, timeperiod):
+    close = closed[2]
+    if len(close) <= timeperiod:
+        return _replay(AtrState(timeperiod), closed)
+    state = AtrState(timeperiod)
+    state.prev_close = float(close[-1])
+    state.tr = _ema_at(timeperiod, len(close) - 1, result[-1], 1.0 / timeperiod)
+    return state
+
+
+def _seed_obv(closed, result):
+    state = ObvState()
+    state.prev = float(closed[0][-1])
+    state.value = float(result[-1])
+    return state
+
+
+# STOCH and CCI only remember their last window: replaying it rebuilds the state
+
+def _seed_stoch(closed, result, fastk_period=5, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0):
+    if slowk_matype != 0 or slowd_matype != 0:
+        raise NotImplementedError("only SMA smoothing is implemented for STOCH")
+    lookback = fastk_period + slowk_period + slowd_period - 3
+    rows = [a[max(len(a) - lookback, 0):] for a in closed]
+    return _replay(StochState(fastk_period, slowk_period, slowd_period), rows)
+
+
+def _seed_cci(closed, result, timeperiod):
+    rows = [a[max(len(a) - (timeperiod - 1), 0):] for a in closed]
+    return _replay(CciState(timeperiod), rows)
+
+
+class _WmaTail:
+    """The newest WMA from the weighted sum of the last timeperiod - 1 closed closes."""
+
+    def __init__(self, close, timeperiod=30):
+        rows = close[max(len(close) - (timeperiod - 1), 0):]
+        self.ready = len(close) >= timeperiod - 1
+        self.partial = float(rows @ np.arange(1, len(rows) + 1, dtype=np.float64))
+        self.weight = timeperiod
+        self.norm = timeperiod * (timeperiod + 1) / 2.0
+
+    def peek(self, close):
+        return (self.partial + self.weight * close) / self.norm if self.ready else np.nan
+
+
+class _BbandsTail:
+    """The newest Bollinger Bands from the sums of the last timeperiod - 1 closed closes."""
+
+    def __init__(self, close, timeperiod=5, nbdevup=2, nbdevdn=2, matype=0):
+        if matype != 0:
+            raise NotImplementedError("only SMA Bollinger Bands are implemented")
+        rows = close[max(len(close) - (timeperiod - 1), 0):]
+        self.ready = len(close) >= timeperiod - 1
+        self.period = timeperiod
+        self.nbdevup = nbdevup
+        self.nbdevdn = nbdevdn
+        # Deviations from the last closed close, so the squares do not cancel against the price level
+        self.reference = float(rows[-1]) if len(rows) else 0.0
+        deviations = rows - self.reference
+        self.sum = float(deviations.sum())
+        self.sum2 = float(deviations @ deviations)
+
+    def peek(self, close):
+        if not self.ready:
+            return np.nan, np.nan, np.nan
+        d = close - self.reference
+        mean = (self.sum + d) / self.period
+        std = math.sqrt(max((self.sum2 + d * d) / self.period - mean * mean, 0.0))
+        middle = self.reference + mean
+        return middle + self.nbdevup * std, middle, middle - self.nbdevdn * std
+
+
+# Indicator -> seed(closed input arrays, closed-bar result, **params), returning a state whose
+# peek(*forming bar inputs) gives the forming bar's value(s) without changing the state
+TAILS = {
+    'EMA': _seed_ema,
+    'WMA': lambda closed, result, **params: _WmaTail(closed[0], **params),
+    'BBANDS': lambda closed, result, **params: _BbandsTail(closed[0], **params),
+    'TRIX': _seed_trix,
+    'RSI': _seed_rsi,
+    'MACD': _seed_macd,
+    'ATR': _seed_atr,
+    'STOCH': _seed_stoch,
+    'CCI': _seed_cci,
+    'OBV': _seed_obv,
+}
+
+
+class IndicatorCache:
+    """
+    :param max_bytes: Memory bound of the cached result arrays
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        size = _nbytes(value[0])
+        if size > self.max_bytes:
+            return value
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def invalidate(self, symbol):
+        """Drop every cached result of one symbol."""
+        for key in [k for k in self.entries if k[0] == symbol]:
+            self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'evictions': self.evictions,
+        }
+
+
+class BarIndicators:
+    """
+    The indicator engine bound to one symbol's bars: bars.EMA(close, timeperiod=14), ...,
+    with the closed bars answered from the cache and the forming bar computed from its tail.
+
+    :param timestamps: Open times (ms) of the bars whose inputs are passed; the last bar is the forming one
+    """
+
+    def __init__(self, symbol, timeframe, timestamps, engine=indicators, cache=None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.closed_timestamp = int(timestamps[-2]) if len(timestamps) > 1 else None
+        self.engine = engine
+        self.cache = indicator_cache if cache is None else cache
+
+    def __getattr__(self, name):
+        if name in INDICATORS:
+            return lambda *inputs, **params: self.compute(name, *inputs, **params)
+        raise AttributeError(name)
+
+    def compute(self, indicator, *inputs, **params):
+        arrays = [np.asarray(a, dtype=np.float64) for a in inputs]
+        params = {**INDICATORS[indicator][1], **params}
+        tail = TAILS.get(indicator)
+        if tail is None or self.closed_timestamp is None or len(arrays[0]) < 2:
+            return self.engine.compute(indicator, *arrays, **params)
+        closed = [a[:-1] for a in arrays]
+        key = (self.symbol, self.timeframe, self.closed_timestamp, indicator, tuple(sorted(params.items())),
+               len(closed[0]))
+        try:
+            result, state = self.cache.get_or_compute(key, lambda: self._seed(tail, indicator, closed, params))
+        except NotImplementedError:  # e.g. a moving-average type the incremental states lack
+            return self.engine.compute(indicator, *arrays, **params)
+        forming = state.peek(*(float(a[-1]) for a in arrays))
+        return _extend(result, tuple(float(v) for v in _as_tuple(forming)))
+
+    def _seed(self, tail, indicator, closed, params):
+        result = _freeze(self.engine.compute(indicator, *closed, **params))
+        return result, tail(closed, result, **params)
+
+
+# Shared by every strategy in the process
+indicator_cache = IndicatorCache()
+
+
+def bar_indicators(symbol, timeframe, timestamps, cache=None):
+    return BarIndicators(symbol, timeframe, timestamps, cache=cache)
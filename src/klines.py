@@ -0,0 +1,243 @@
+"""
+Raw kline fast path: Binance /api/v3/klines bodies parsed straight into arrays.
+
+fetch_ohlcv goes through ccxt's JSON decoding and unified OHLCV parsing (a
+Python list per candle, a str and a float object per field), and the bots then
+build a DataFrame from those lists. parse_klines skips all of that: the
+brackets and quotes of the response body are deleted with one bytes.translate,
+and the remaining comma-separated numbers are parsed in a single C pass by
+np.fromstring, then copied column-wise into preallocated typed arrays (int64
+open times, float64 OHLCV). No Python object is created per candle or field.
+
+Binance prints every decimal field with exactly 8 decimals, so when the body
+has that layout the decimal points are deleted too and the fields parsed as
+int64, which is several times faster than parsing floats; dividing by 1e8 then
+gives the same doubles as parsing the decimal strings, as long as the scaled
+OHLCV integers stay below 2**53 (integer parts of at most 7 digits). Other
+bodies are parsed as floats.
+
+The exchange read is fetch_raw_klines(symbol, timeframe, limit), which returns
+the unparsed body; RawKlineExchange implements it for a ccxt exchange on its
+own aiohttp session (and rate limiter), SimulatedExchange serves the same
+layout, and ResilientExchange / SingleFlightExchange wrap it like every other
+read:
+
+    exchange = SingleFlightExchange(ResilientExchange(RawKlineExchange(ccxt.binance({...}))))
+    klines = await fetch_klines(exchange, 'BTC/USDT', '1m', limit=100)
+    df = klines.frame()
+
+    python -m src.klines --symbols 200 --limit 100
+"""
+import argparse
+import asyncio
+import json
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+KLINES_URL = 'https://api.binance.com/api/v3/klines'
+FIELDS = 12  # open time, open, high, low, close, volume, close time, quote volume, trades, taker base, taker quote, ignore
+DECIMAL_FIELDS = 8  # open ... volume, quote volume, taker base, taker quote
+SCALE = 1e8
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class KlineArrays:
+    """Candles as typed columns; `capacity` rows are allocated once and refilled by load()."""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._timestamp = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty((len(COLUMNS), capacity))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def load(self, rows, scale=None):
+        """Fill from an (n, >= 6) array of [timestamp, open, high, low, close, volume, ...] rows; keeps the last capacity."""
+        rows = rows[-self.capacity:]
+        n = self.count = len(rows)
+        self._timestamp[:n] = rows[:, 0]
+        if scale is None:
+            self._values[:, :n] = rows[:, 1:6].T
+        else:
+            np.divide(rows[:, 1:6].T, scale, out=self._values[:, :n])
+        return self
+
+    @property
+    def timestamp(self):
+        return self._timestamp[:self.count]
+
+    def column(self, name):
+        return self._values[COLUMNS.index(name), :self.count]
+
+    @property
+    def open(self):
+        return self.column('open')
+
+    @property
+    def high(self):
+        return self.column('high')
+
+    @property
+    def low(self):
+        return self.column('low')
+
+    @property
+    def close(self):
+        return self.column('close')
+
+    @property
+    def volume(self):
+        return self.column('volume')
+
+    def ohlcv(self):
+        """Candles in fetch_ohlcv's list format (builds Python objects; for callers that need them)."""
+        return [[int(ts)] + row for ts, row in zip(self.timestamp.tolist(), self._values[:, :self.count].T.tolist())]
+
+    def frame(self):
+        """DataFrame of copies of the columns, indexed by open time like the bots' fetch_ohlcv frames."""
+        index = pd.DatetimeIndex(self.timestamp.astype('datetime64[ms]'), name='timestamp')
+        return pd.DataFrame({name: self.column(name).copy() for name in COLUMNS}, index=index)
+
+
+def _fixed_point_rows(raw):
+    """Rows parsed as scaled int64 when the body has the 8-decimal layout and OHLCV stays exact, else None."""
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    dots = np.flatnonzero(buf == ord('.'))
+    if not len(dots) or dots[-1] + 9 >= len(buf) or (buf[dots + 9] != ord('"')).any():
+        return None
+    values = np.fromstring(raw.translate(None, b'[]".'), sep=',', dtype=np.int64)
+    if len(values) % FIELDS or len(dots) != DECIMAL_FIELDS * (len(values) // FIELDS):
+        return None
+    rows = values.reshape(-1, FIELDS)
+    # Parsing saturates instead of wrapping, so out-of-range fields fail this check too
+    if rows[:, 1:6].max() >= 2 ** 53:
+        return None
+    return rows
+
+
+def parse_klines(raw, out=None):
+    """Parse a klines response body (bytes) into `out` (a KlineArrays sized for it, or a new one)."""
+    rows = _fixed_point_rows(raw)
+    scale = SCALE
+    if rows is None:
+        scale = None
+        text = raw.translate(None, b'[]"')
+        with warnings.catch_warnings():
+            # Unparseable text is only a DeprecationWarning (and a truncated result) in numpy
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                values = np.fromstring(text, sep=',') if text.strip() else np.empty(0)
+            except DeprecationWarning:
+                values = None
+        if values is None or len(values) % FIELDS:
+            raise ValueError(f"Malformed klines response: {raw[:200]!r}")
+        rows = values.reshape(-1, FIELDS)
+    if out is None:
+        out = KlineArrays(max(len(rows), 1))
+    return out.load(rows, scale)
+
+
+async def fetch_klines(exchange, symbol, timeframe='1m', limit=100, out=None):
+    return parse_klines(await exchange.fetch_raw_klines(symbol, timeframe, limit), out or KlineArrays(limit))
+
+
+class RawKlineExchange:
+    """
+    Adds fetch_raw_klines to a ccxt async Binance exchange: the klines endpoint
+    is read on the exchange's own aiohttp session, after its rate limiter, and
+    the body is returned unparsed. Everything else is passed through.
+    """
+
+    def __init__(self, exchange, url=KLINES_URL):
+        self.exchange = exchange
+        self.url = url
+
+    def __getattr__(self, name):
+        return getattr(self.exchange, name)
+
+    # SharedSession.attach() sets these on the exchange it is given
+    @property
+    def session(self):
+        return self.exchange.session
+
+    @session.setter
+    def session(self, value):
+        self.exchange.session = value
+
+    @property
+    def own_session(self):
+        return self.exchange.own_session
+
+    @own_session.setter
+    def own_session(self, value):
+        self.exchange.own_session = value
+
+    async def fetch_raw_klines(self, symbol, timeframe='1m', limit=100):
+        exchange = self.exchange
+        if exchange.session is None:
+            exchange.open()
+        if exchange.enableRateLimit:
+            await exchange.throttle(1)
+        params = {'symbol': exchange.market_id(symbol), 'interval': timeframe, 'limit': str(limit)}
+        async with exchange.session.get(self.url, params=params) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise OSError(f"klines {symbol} {timeframe}: HTTP {response.status}: {body[:200]!r}")
+            return body
+
+
+def _dataframe_path(raw):
+    """The current path: JSON decoding, ccxt-style unified parsing, DataFrame, datetime index, fills."""
+    ohlcv = [[int(k[0]), float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5])] for k in json.loads(raw)]
+    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('timestamp', inplace=True)
+    return df.ffill().bfill()
+
+
+def benchmark(symbols=200, limit=100, repeat=5):
+    """Per-symbol microseconds of the current path and the fast path on simulated klines bodies."""
+    from src.sim_exchange import SimulatedExchange
+
+    sim = SimulatedExchange(n_symbols=symbols)
+    bodies = asyncio.run(_bodies(sim, limit))
+    buffer = KlineArrays(limit)
+
+    def timed(fn):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for raw in bodies:
+                fn(raw)
+            best = min(best, time.perf_counter() - start)
+        return best / len(bodies) * 1e6
+
+    reference = _dataframe_path(bodies[0])
+    fast = parse_klines(bodies[0]).frame()
+    if not np.array_equal(reference.to_numpy(), fast.to_numpy()) or not reference.index.equals(fast.index):
+        raise AssertionError("fast path disagrees with the DataFrame path")
+    return {
+        'dataframe_path_us': timed(_dataframe_path),
+        'fast_parse_us': timed(lambda raw: parse_klines(raw, buffer)),
+        'fast_parse_frame_us': timed(lambda raw: parse_klines(raw, buffer).frame()),
+    }
+
+
+async def _bodies(exchange, limit):
+    await exchange.load_markets()
+    return [await exchange.fetch_raw_klines(symbol, '1m', limit) for symbol in exchange.symbols]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the raw kline fast path with the DataFrame path")
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for name, us in benchmark(args.symbols, args.limit, args.repeat).items():
+        print(f"{name:22s} {us:8.1f} us/symbol")
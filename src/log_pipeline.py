@@ -0,0 +1,221 @@
+"""
+Non-blocking logging for the trading loops.
+
+setup_logging() replaces logging.basicConfig: records are put on a bounded
+queue by the calling coroutine and formatted and written by a background
+listener thread, so the event loop never waits on I/O or string formatting.
+Hot-path messages should use %-style arguments (logger.info("price %s", p))
+so formatting is deferred to the listener and repeated messages share one
+template, which the rate limiter uses as its key. Order and fill records are
+logged with extra=TRADE_EVENT and are never rate limited. An optional compact binary
+event log stores each record as a template id plus its arguments.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import struct
+import time
+
+_EVENT = struct.Struct('<dHHI')  # created, levelno, template id, payload length
+_DEFINE = 0                      # levelno of a record that defines a template
+_INLINE = 0                      # template id of a record whose payload is its formatted message
+_MAX_TEMPLATES = 0xFFFF          # template ids are uint16
+_SEPARATOR = '\x1f'
+
+# logger.info(..., extra=TRADE_EVENT) marks an order or fill record, which always passes the rate limiter
+TRADE_EVENT = {'trade_event': True}
+
+
+class lazy:
+    """Defers building a log argument until the record is actually formatted."""
+
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per-template rate limiting with sampling.
+
+    Each distinct (logger, message template) may emit `rate` records per `per`
+    seconds; beyond that only every `sample`-th record passes, annotated with
+    the number suppressed since the last one. Warnings, errors and trade events
+    (records logged with extra=TRADE_EVENT) always pass.
+    """
+
+    def __init__(self, rate=5, per=1.0, sample=100, max_keys=10000):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.sample = sample
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [window start, count in window, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'trade_event', False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None and len(self._buckets) >= self.max_keys:
+            # f-string messages create a key per record; forget idle ones
+            self._buckets = {k: b for k, b in self._buckets.items() if now - b[0] < self.per}
+        if bucket is None or now - bucket[0] >= self.per:
+            suppressed = bucket[2] if bucket else 0
+            self._buckets[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        bucket[1] += 1
+        if bucket[1] <= self.rate:
+            return True
+        if (bucket[1] - self.rate) % self.sample == 0:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+            return True
+        bucket[2] += 1
+        return False
+
+
+class SuppressedCountFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{text} [+{suppressed} suppressed]" if suppressed else text
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread and drops
+    records (counting them) instead of blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Exception text must be captured here, while the traceback still exists
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BinaryEventHandler(logging.Handler):
+    """
+    Appends records to a compact binary file: a fixed header per event, the
+    message template stored once, and only the arguments per event. Once
+    `max_templates` templates are defined, records with new templates are
+    stored inline as their formatted message. Read it back with read_event_log().
+    """
+
+    def __init__(self, path, max_templates=4096):
+        super().__init__()
+        self.file = open(path, 'ab', buffering=1 << 16)
+        self.max_templates = min(max_templates, _MAX_TEMPLATES)
+        self.templates = {}
+        self.inline = 0
+
+    def emit(self, record):
+        # Called with the handler lock held (logging.Handler.handle)
+        template = str(record.msg)
+        template_id = self.templates.get(template)
+        if template_id is None:
+            if len(self.templates) >= self.max_templates:
+                self.inline += 1
+                self._write(record.created, record.levelno, _INLINE, record.getMessage())
+                return
+            template_id = self.templates[template] = len(self.templates) + 1
+            self._write(record.created, _DEFINE, template_id, template)
+        args = record.args if isinstance(record.args, tuple) else (record.args,) if record.args else ()
+        self._write(record.created, record.levelno, template_id, _SEPARATOR.join(map(str, args)))
+
+    def _write(self, created, levelno, template_id, text):
+        payload = text.encode('utf-8')
+        self.file.write(_EVENT.pack(created, levelno, template_id, len(payload)))
+        self.file.write(payload)
+
+    def flush(self):
+        self.acquire()
+        try:
+            self.file.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        super().close()
+
+
+def read_event_log(path):
+    """Yield (created, levelno, template, args) tuples from a binary event log (inline records: message, [])."""
+    templates = {}
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + _EVENT.size <= len(data):
+        created, levelno, template_id, length = _EVENT.unpack_from(data, offset)
+        offset += _EVENT.size
+        text = data[offset:offset + length].decode('utf-8')
+        offset += length
+        if levelno == _DEFINE:
+            templates[template_id] = text
+        elif template_id == _INLINE:
+            yield created, levelno, text, []
+        else:
+            yield created, levelno, templates.get(template_id), text.split(_SEPARATOR) if text else []
+
+
+def setup_logging(level=logging.INFO, fmt='%(asctime)s [%(levelname)s] %(message)s', rate=5, per=1.0,
+                  sample=100, binary_path=None, max_queue=10000):
+    """
+    Configure the root logger with a queue handler feeding a background listener.
+
+    :param rate: Records per template allowed per `per` seconds before sampling starts
+    :param sample: Pass one of every `sample` records beyond the rate
+    :param binary_path: Optional path of a binary event log written alongside the text log
+    :param max_queue: Queue size; records are dropped rather than blocking when full
+    :return: The started QueueListener (stopped automatically at exit)
+    """
+    log_queue = queue.Queue(max_queue)
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate, per, sample))
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(SuppressedCountFormatter(fmt))
+    handlers = [stream]
+    if binary_path is not None:
+        handlers.append(BinaryEventHandler(binary_path))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        listener.stop()
+        for handler in handlers:
+            handler.close()
+    atexit.register(stop)
+    return listener
@@ -0,0 +1,352 @@
+"""
+Locally maintained L2 order book for slippage-aware order sizing.
+
+A book is built from a depth snapshot (ccxt fetch_order_book or Binance
+/depth) and kept current with incremental diffs in Binance's depthUpdate
+format ({'U': first id, 'u': last id, 'b': [[price, qty]], 'a': [...]},
+qty 0 removes a level). Price levels are kept in sorted lists, so updates
+are a bisect plus a list insert, and fill queries walk only the levels they
+consume. Recorded snapshot/diff streams can be replayed with replay_depth().
+
+LocalBooks keeps the books of the symbols a bot trades live: stream_depth()
+feeds it Binance's diff depth stream, each book starts from a REST snapshot
+and is re-snapshotted after a sequence gap or a reconnect, and
+cap_to_liquidity() sizes orders against the live book, falling back to a REST
+snapshot only when the book is missing or stale:
+
+    books = LocalBooks(exchange)
+    books.follow(['COMBO/USDT'])
+    task = asyncio.create_task(stream_depth(books))
+    amount = await cap_to_liquidity(exchange, 'COMBO/USDT', 'buy', amount, 0.02, books)
+"""
+import asyncio
+import bisect
+import json
+import logging
+import time
+
+from src.log_pipeline import TRADE_EVENT
+from src.tick_capture import stream_name
+
+logger = logging.getLogger(__name__)
+
+BINANCE_WS = 'wss://stream.binance.com:9443/ws'
+
+
+class BookSide:
+    """
+    One side of the book as parallel sorted arrays of keys and quantities.
+    Asks are keyed by price, bids by negated price, so index 0 is always the best level.
+    """
+
+    def __init__(self, is_bid):
+        self.sign = -1.0 if is_bid else 1.0
+        self.keys = []
+        self.quantities = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.keys.clear()
+        self.quantities.clear()
+
+    def set(self, price, quantity):
+        key = self.sign * price
+        i = bisect.bisect_left(self.keys, key)
+        exists = i < len(self.keys) and self.keys[i] == key
+        if quantity > 0:
+            if exists:
+                self.quantities[i] = quantity
+            else:
+                self.keys.insert(i, key)
+                self.quantities.insert(i, quantity)
+        elif exists:
+            del self.keys[i]
+            del self.quantities[i]
+
+    def best(self):
+        return self.sign * self.keys[0] if self.keys else None
+
+    def levels(self, depth=None):
+        n = len(self.keys) if depth is None else min(depth, len(self.keys))
+        return [(self.sign * self.keys[i], self.quantities[i]) for i in range(n)]
+
+    def fill(self, amount):
+        """(average price, filled amount) for taking `amount` from this side."""
+        remaining = amount
+        cost = 0.0
+        for key, quantity in zip(self.keys, self.quantities):
+            take = quantity if quantity < remaining else remaining
+            cost += take * key
+            remaining -= take
+            if remaining <= 0:
+                break
+        filled = amount - remaining
+        return (self.sign * cost / filled if filled > 0 else None), filled
+
+    def max_size(self, limit_price):
+        """Largest amount whose average fill price stays at or better than limit_price."""
+        limit = self.sign * limit_price
+        cost = 0.0
+        filled = 0.0
+        for key, quantity in zip(self.keys, self.quantities):
+            if (cost + key * quantity) <= limit * (filled + quantity):
+                cost += key * quantity
+                filled += quantity
+                continue
+            if key > limit:
+                # Partial level: (cost + key * q) / (filled + q) == limit
+                filled += max((limit * filled - cost) / (key - limit), 0.0)
+            break
+        return filled
+
+
+class OrderBook:
+    """
+    :param symbol: Market symbol, e.g. 'COMBO/USDT'
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        self.last_update_id = None
+        self.synced = False
+
+    @classmethod
+    def from_snapshot(cls, symbol, snapshot):
+        book = cls(symbol)
+        book.apply_snapshot(snapshot)
+        return book
+
+    def apply_snapshot(self, snapshot):
+        """Replace the book with a snapshot: {'bids': [[p, q], ...], 'asks': [...], 'nonce' or 'lastUpdateId': id}."""
+        self.bids.clear()
+        self.asks.clear()
+        for level in snapshot['bids']:
+            self.bids.set(float(level[0]), float(level[1]))
+        for level in snapshot['asks']:
+            self.asks.set(float(level[0]), float(level[1]))
+        self.last_update_id = snapshot.get('nonce', snapshot.get('lastUpdateId'))
+        self.synced = False
+
+    def apply_diff(self, diff):
+        """
+        Apply one depth diff. Returns False (and marks the book out of sync) on a
+        sequence gap; the caller should then load a fresh snapshot.
+        """
+        first, last = diff['U'], diff['u']
+        if self.last_update_id is not None:
+            if last <= self.last_update_id:
+                return True  # already contained in the snapshot
+            expected = self.last_update_id + 1
+            if (self.synced and first != expected) or (not self.synced and not first <= expected <= last):
+                logger.warning("Order book gap for %s: expected %s, got %s-%s", self.symbol, expected, first, last)
+                self.synced = False
+                self.last_update_id = None
+                return False
+        for price, quantity in diff['b']:
+            self.bids.set(float(price), float(quantity))
+        for price, quantity in diff['a']:
+            self.asks.set(float(price), float(quantity))
+        self.last_update_id = last
+        self.synced = True
+        return True
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def mid_price(self):
+        bid, ask = self.best_bid(), self.best_ask()
+        return (bid + ask) / 2 if bid is not None and ask is not None else None
+
+    def _side(self, side):
+        # A buy takes liquidity from the asks, a sell from the bids
+        return self.asks if side == 'buy' else self.bids
+
+    def expected_fill_price(self, side, amount):
+        """(average fill price, fillable amount) of a market order of `amount` base units."""
+        return self._side(side).fill(amount)
+
+    def slippage(self, side, amount):
+        """Relative distance of the average fill price from the best price (>= 0)."""
+        book_side = self._side(side)
+        best = book_side.best()
+        price, filled = book_side.fill(amount)
+        if best is None or price is None:
+            return None
+        return abs(price - best) / best
+
+    def max_size_for_slippage(self, side, max_slippage):
+        """Largest market order (base units) whose average fill stays within max_slippage of the best price."""
+        book_side = self._side(side)
+        best = book_side.best()
+        if best is None:
+            return 0.0
+        limit = best * (1 + max_slippage) if side == 'buy' else best * (1 - max_slippage)
+        return book_side.max_size(limit)
+
+
+async def fetch_order_book(exchange, symbol, limit=100):
+    """Build an OrderBook from a REST depth snapshot."""
+    return OrderBook.from_snapshot(symbol, await exchange.fetch_order_book(symbol, limit=limit))
+
+
+class LocalBooks:
+    """
+    Order books of the followed symbols, kept current by stream_depth().
+
+    :param exchange: Exchange the REST snapshots are fetched from
+    :param max_age: Seconds without a diff after which a book is stale
+    :param snapshot_limit: Levels per side of the REST snapshots
+    """
+
+    def __init__(self, exchange, max_age=5.0, snapshot_limit=1000):
+        self.exchange = exchange
+        self.max_age = max_age
+        self.snapshot_limit = snapshot_limit
+        self.symbols = {}  # stream name -> symbol
+        self.books = {}
+        self.updated = {}  # symbol -> time.monotonic() of its last applied diff
+        self.changes = asyncio.Queue()  # ('SUBSCRIBE' | 'UNSUBSCRIBE', symbol) for the running stream
+
+    def follow(self, symbols):
+        """Follow exactly `symbols`; the books of symbols no longer followed are dropped."""
+        followed = {stream_name(symbol): symbol for symbol in symbols}
+        for name in followed.keys() - self.symbols.keys():
+            self.changes.put_nowait(('SUBSCRIBE', followed[name]))
+        for name in self.symbols.keys() - followed.keys():
+            self.changes.put_nowait(('UNSUBSCRIBE', self.symbols[name]))
+            self._drop(self.symbols[name])
+        self.symbols = followed
+
+    def book(self, symbol):
+        """The live book of `symbol`, or None when it is missing, out of sync or stale."""
+        book = self.books.get(symbol)
+        if book is None or not book.synced or time.monotonic() - self.updated[symbol] > self.max_age:
+            return None
+        return book
+
+    def reset(self):
+        """Forget every book and pending change (the stream reconnected and resubscribes everything)."""
+        self.books.clear()
+        self.updated.clear()
+        while not self.changes.empty():
+            self.changes.get_nowait()
+
+    def _drop(self, symbol):
+        self.books.pop(symbol, None)
+        self.updated.pop(symbol, None)
+
+    async def on_diff(self, diff):
+        """Apply a depthUpdate event, loading the symbol's snapshot first when it has no book."""
+        symbol = self.symbols.get(diff['s'].lower())
+        if symbol is None:
+            return
+        book = self.books.get(symbol)
+        if book is None:
+            # Diffs keep queueing on the socket meanwhile; apply_diff skips those the snapshot contains
+            try:
+                snapshot = await self.exchange.fetch_order_book(symbol, limit=self.snapshot_limit)
+            except Exception as e:
+                logger.error("Error fetching the order book snapshot for %s: %s", symbol, e)
+                return
+            if self.symbols.get(diff['s'].lower()) != symbol:
+                return
+            book = self.books[symbol] = OrderBook.from_snapshot(symbol, snapshot)
+        if book.apply_diff(diff):
+            self.updated[symbol] = time.monotonic()
+        else:
+            # Re-snapshotted on the next diff
+            self._drop(symbol)
+
+
+async def _send_subscriptions(ws, books):
+    request_id = 0
+
+    async def send(method, symbols):
+        nonlocal request_id
+        request_id += 1
+        await ws.send_json({'method': method, 'params': [f"{stream_name(s)}@depth@100ms" for s in symbols],
+                            'id': request_id})
+
+    if books.symbols:
+        await send('SUBSCRIBE', sorted(books.symbols.values()))
+    while True:
+        method, symbol = await books.changes.get()
+        await send(method, [symbol])
+
+
+async def stream_depth(books, url=BINANCE_WS, reconnect_delay=1.0, max_reconnect_delay=60.0):
+    """Feed `books` from Binance's diff depth streams until cancelled; reconnects with exponential backoff."""
+    import aiohttp  # installed with ccxt
+
+    delay = reconnect_delay
+    async with aiohttp.ClientSession() as session:
+        while True:
+            sender = None
+            try:
+                async with session.ws_connect(url, heartbeat=30) as ws:
+                    delay = reconnect_delay
+                    books.reset()
+                    sender = asyncio.create_task(_send_subscriptions(ws, books))
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                break
+                            continue
+                        event = json.loads(msg.data)
+                        if isinstance(event, dict) and event.get('e') == 'depthUpdate':
+                            await books.on_diff(event)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error("Depth stream connection failed: %s", e)
+            finally:
+                if sender is not None:
+                    sender.cancel()
+            logger.info("Reconnecting the depth stream in %.0fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_reconnect_delay)
+
+
+async def cap_to_liquidity(exchange, symbol, side, amount, max_slippage, books=None):
+    """
+    `amount` (base units) reduced to what the book holds within max_slippage of
+    the best price. The live book in `books` is used when it is fresh, a REST
+    snapshot otherwise. Without either the order is skipped (0.0) rather than
+    sent uncapped into a book of unknown depth.
+    """
+    book = books.book(symbol) if books is not None else None
+    if book is None:
+        try:
+            book = await fetch_order_book(exchange, symbol)
+        except Exception as e:
+            logger.warning("Skipping %s order for %s: no order book (%s)", side, symbol, e)
+            return 0.0
+    max_amount = book.max_size_for_slippage(side, max_slippage)
+    if max_amount < amount:
+        logger.info("Reducing %s order for %s from %s to %s to stay within %.1f%% slippage",
+                    side, symbol, amount, max_amount, max_slippage * 100, extra=TRADE_EVENT)
+    return min(amount, max_amount)
+
+
+def replay_depth(path, books=None):
+    """
+    Replay a recorded depth stream (JSON lines of {'type': 'snapshot'|'diff', 'symbol': ..., 'data': ...})
+    into order books, yielding (symbol, book) after each event.
+    """
+    books = {} if books is None else books
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            symbol = event['symbol']
+            if event['type'] == 'snapshot':
+                books[symbol] = OrderBook.from_snapshot(symbol, event['data'])
+            elif symbol in books:
+                books[symbol].apply_diff(event['data'])
+            else:
+                continue
+            yield symbol, books[symbol]
@@ -0,0 +1,166 @@
+"""
+Staged async pipeline with bounded queues, and independent position tasks.
+
+A scan is split into stages (fetch -> indicators -> signal -> execute), each
+a pool of worker tasks taking items from a bounded asyncio.Queue and handing
+their result to the next stage's queue. When a stage falls behind, its queue
+fills and the workers upstream wait in put(): a slow stage throttles the
+stages feeding it instead of freezing everything behind one call. A stage
+that returns None drops the item; an exception is logged and drops it too.
+
+Positions opened by the execute stage are handed to PositionTasks, which runs
+each position's lifecycle (holding, monitoring, exiting) as its own task, so
+the pipeline keeps scanning while positions are open:
+
+    pipeline = Pipeline([Stage('fetch', fetch, workers=4), Stage('signal', decide), Stage('execute', execute)])
+    await pipeline.start()
+    await pipeline.put(pair)
+"""
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    :param fn: Callable (sync or async) mapping an item to the next stage's item, or None to drop it
+    :param workers: Concurrent workers of this stage
+    :param maxsize: Capacity of the stage's input queue
+    """
+
+    def __init__(self, name, fn, workers=1, maxsize=16):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queue = None
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'busy_s': round(self.busy, 3),
+            'blocked_s': round(self.blocked, 3),
+        }
+
+
+class Pipeline:
+    """
+    :param on_done: Called with an item (in the form the last stage it reached was given) once it
+                    leaves the pipeline: dropped, failed or through the last stage
+    """
+
+    def __init__(self, stages, on_done=None):
+        self.stages = list(stages)
+        self.on_done = on_done
+        self._tasks = []
+
+    async def start(self):
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(stage.maxsize)
+        for i, stage in enumerate(self.stages):
+            downstream = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            for n in range(stage.workers):
+                self._tasks.append(asyncio.create_task(self._work(stage, downstream), name=f"{stage.name}-{n}"))
+        return self
+
+    async def _work(self, stage, downstream):
+        while True:
+            item = await stage.queue.get()
+            try:
+                start = time.perf_counter()
+                try:
+                    result = stage.fn(item)
+                    if inspect.isawaitable(result):
+                        result = await result
+                except Exception as e:
+                    stage.errors += 1
+                    logger.error("Pipeline stage %s failed: %s", stage.name, e)
+                    self._done(item)
+                    continue
+                finally:
+                    stage.busy += time.perf_counter() - start
+                stage.processed += 1
+                if downstream is None:
+                    self._done(item)
+                    continue
+                if result is None:
+                    stage.dropped += 1
+                    self._done(item)
+                else:
+                    start = time.perf_counter()
+                    await downstream.queue.put(result)
+                    stage.blocked += time.perf_counter() - start
+            finally:
+                stage.queue.task_done()
+
+    def _done(self, item):
+        if self.on_done is not None:
+            self.on_done(item)
+
+    async def put(self, item):
+        """Feed the first stage; waits while it is full."""
+        await self.stages[0].queue.put(item)
+
+    async def join(self):
+        """Wait until every item fed so far has left the last stage."""
+        # Workers hand an item downstream before marking it done, so stage order suffices
+        for stage in self.stages:
+            await stage.queue.join()
+
+    async def run(self, items):
+        for item in items:
+            await self.put(item)
+        await self.join()
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class PositionTasks:
+    """One lifecycle task per position key; a key can only have one running lifecycle."""
+
+    def __init__(self):
+        self.tasks = {}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def running(self, key):
+        return key in self.tasks
+
+    def start(self, key, coro):
+        """Run `coro` as the lifecycle of `key`; returns False (and closes it) if one is already running."""
+        if key in self.tasks:
+            coro.close()
+            return False
+        task = self.tasks[key] = asyncio.create_task(coro, name=f"position-{key}")
+        task.add_done_callback(lambda t: self._done(key, t))
+        return True
+
+    def _done(self, key, task):
+        self.tasks.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Position task for %s failed: %s", key, task.exception())
+
+    async def close(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Order = namedtuple('Order', ['pair', 'side', 'amount', 'price'])
+
+
+def allocate_quote(buys, quote_balance, min_order=10.0, max_order=None, fee_rate=0.001):
+    """
+    Split one quote balance across the buy signals of a scan.
+
+    The balance (less fees) is divided equally; if that would leave orders below
+    `min_order`, only as many signals as the balance can fund are kept, in the
+    order given (put the strongest first).
+
+    :param buys: List of (pair, price) buy candidates
+    :param quote_balance: Free quote currency (e.g. USDT)
+    :param min_order: Smallest order value in quote currency
+    :param max_order: Optional cap on each order's value in quote currency
+    :return: List of Order(pair, 'buy', amount, price)
+    """
+    budget = quote_balance * (1 - fee_rate)
+    # Candidates without a usable price take no share of the budget
+    buys = [(pair, price) for pair, price in buys if price and price > 0]
+    if not buys or budget < min_order:
+        return []
+    count = min(len(buys), int(budget // min_order)) if min_order > 0 else len(buys)
+    per_order = budget / count
+    if max_order is not None:
+        per_order = min(per_order, max_order)
+    return [Order(pair, 'buy', per_order / price, price) for pair, price in buys[:count]]
+
+
+def net_filled(order, currency, default=0.0):
+    """
+    Amount of `currency` an order added to the balance: its filled amount less
+    the fees charged in that currency (Binance takes buy fees in the base asset).
+    """
+    filled = order.get('filled')
+    if filled is None:
+        filled = order.get('amount') or default
+    fees = order.get('fees') or ([order['fee']] if order.get('fee') else [])
+    return filled - sum(fee.get('cost') or 0.0 for fee in fees if fee and fee.get('currency') == currency)
+
+
+def plan_orders(signals, balances, quote_currency='USDT', min_order=10.0, max_order=None, fee_rate=0.001):
+    """
+    Turn all (pair, action, price) signals of one scan into a consistent order batch:
+    buys share the free quote balance, sells close the free base balance.
+
+    :param balances: Free balances by currency, from a single fetch_balance()
+    :return: List of Order
+    """
+    orders = []
+    buys = []
+    seen = set()
+    for pair, action, price in signals:
+        if pair in seen:
+            continue
+        seen.add(pair)
+        if action == 'buy':
+            buys.append((pair, price))
+        elif action == 'sell':
+            amount = balances.get(pair.split('/')[0]) or 0
+            if amount > 0:
+                orders.append(Order(pair, 'sell', amount, price))
+    orders.extend(allocate_quote(buys, balances.get(quote_currency) or 0, min_order, max_order, fee_rate))
+    return orders
+
+
+async def submit_orders(orders, place_order):
+    """Submit a batch concurrently; returns the results in order (None for failures)."""
+    results = await asyncio.gather(*(place_order(o.pair, o.side, o.amount) for o in orders), return_exceptions=True)
+    for order, result in zip(orders, results):
+        if isinstance(result, Exception):
+            logger.error("Error placing %s order for %s: %s", order.side, order.pair, result)
+    return [None if isinstance(result, Exception) else result for result in results]
@@ -0,0 +1,380 @@
+"""
+Profiling mode for the bot entry points.
+
+Runs a fixed number of scan cycles of one bot (main, new, autobest, automain,
+combo) against the simulated exchange or candles recorded by src.backfill,
+with the bot's sleeps skipped, and writes to the output directory:
+
+    <bot>.summary.txt / .json   per-function calls, wall time and await time,
+                                per-indicator time, cycle durations
+    <bot>.cpu.prof / .cpu.txt   cProfile stats (snakeviz, pstats)
+    <bot>.folded                sampled stacks for flamegraph.pl / speedscope
+    <bot>.memory.txt / .snapshot  tracemalloc allocations by line
+
+Every function defined in the bot module, every exchange call and every
+indicator is timed. For coroutines, await time is the time spent suspended
+(waiting on I/O or other tasks) rather than running.
+
+    python -m src.profiling main --cycles 3 --symbols 40
+    python -m src.profiling autobest --cycles 2 --data data --timeframe 1m
+"""
+import argparse
+import asyncio
+import cProfile
+import importlib
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# bot module -> (entry coroutine, function called once at the start of every scan cycle)
+BOTS = {
+    'main': ('trade', 'trade'),
+    'new': ('trade', 'get_tickers'),
+    'autobest': ('trade', 'get_tickers'),
+    'automain': ('trade', 'detect_newly_listed_coins'),
+    'combo': ('main', 'trade_combo'),
+}
+
+# Markets a bot trades by name, added to the simulated exchange
+SYMBOLS = {'combo': ['COMBO/USDT']}
+
+# Bots that watch for new listings: one withheld symbol is listed at the start of every cycle
+LISTING_BOTS = {'automain'}
+
+
+async def _no_stream(*args, **kwargs):
+    # Stand-in for the bots' live streams (capture, stream_depth): a stand-in exchange has none
+    await asyncio.Event().wait()
+
+
+# Bot module globals replaced while profiling; automain checks for listings on every cycle
+OVERRIDES = {
+    'automain': {'listing_interval': 0, 'capture': _no_stream, 'stream_depth': _no_stream},
+    'combo': {'stream_depth': _no_stream},
+}
+
+
+class _CyclesDone(BaseException):
+    # BaseException so the bots' `except Exception` handlers let it through
+    pass
+
+
+class FunctionStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.running = 0.0
+        self.is_coroutine = False
+
+    def as_dict(self):
+        return {
+            'function': self.name,
+            'calls': self.calls,
+            'wall_s': self.wall,
+            'mean_ms': self.wall / self.calls * 1e3 if self.calls else 0.0,
+            'await_s': self.wall - self.running if self.is_coroutine else 0.0,
+        }
+
+
+class _Timed:
+    """Drives a coroutine step by step, timing the steps it runs and the time it is suspended."""
+
+    def __init__(self, coro, stats):
+        self.coro = coro
+        self.stats = stats
+
+    def __await__(self):
+        stats = self.stats
+        stats.calls += 1
+        stats.is_coroutine = True
+        start = time.perf_counter()
+        value, error = None, None
+        try:
+            while True:
+                step = time.perf_counter()
+                try:
+                    future = self.coro.throw(error) if error is not None else self.coro.send(value)
+                except StopIteration as stop:
+                    stats.running += time.perf_counter() - step
+                    return stop.value
+                stats.running += time.perf_counter() - step
+                try:
+                    value, error = (yield future), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            stats.wall += time.perf_counter() - start
+
+
+class Profiler:
+    """Call timing for wrapped functions plus scan-cycle accounting."""
+
+    def __init__(self, cycles):
+        self.cycles = cycles
+        self.functions = {}
+        self.cycle_starts = []
+        self.skipped_sleep = 0.0
+        self.on_cycle = None
+
+    def stats(self, name):
+        if name not in self.functions:
+            self.functions[name] = FunctionStats(name)
+        return self.functions[name]
+
+    def wrap(self, name, fn):
+        stats = self.stats(name)
+        if asyncio.iscoroutinefunction(fn):
+            async def timed(*args, **kwargs):
+                return await _Timed(fn(*args, **kwargs), stats)
+        else:
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    stats.calls += 1
+                    stats.wall += time.perf_counter() - start
+        timed.__name__ = getattr(fn, '__name__', name)
+        timed.__wrapped__ = fn
+        return timed
+
+    def mark(self):
+        """Start a scan cycle; stops the run once `cycles` cycles have completed."""
+        self.cycle_starts.append(time.perf_counter())
+        if len(self.cycle_starts) > self.cycles:
+            raise _CyclesDone()
+        if self.on_cycle is not None:
+            self.on_cycle()
+
+    def cycle_marker(self, fn):
+        def marked(*args, **kwargs):
+            self.mark()
+            return fn(*args, **kwargs)
+        if asyncio.iscoroutinefunction(fn):
+            async def marked_async(*args, **kwargs):
+                return await marked(*args, **kwargs)
+            return marked_async
+        return marked
+
+    def cycle_times(self):
+        return [b - a for a, b in zip(self.cycle_starts, self.cycle_starts[1:])]
+
+
+class _TimedExchange:
+    """Times every coroutine method of an exchange as 'exchange.<method>'."""
+
+    def __init__(self, exchange, profiler):
+        self._exchange = exchange
+        self._profiler = profiler
+        self._methods = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        if name not in self._methods:
+            self._methods[name] = self._profiler.wrap(f"exchange.{name}", attr)
+        return self._methods[name]
+
+
+def _fast_asyncio(profiler):
+    """A stand-in for the bot module's `asyncio` whose sleep() only yields to the loop."""
+    proxy = types.ModuleType('asyncio')
+    proxy.__dict__.update(asyncio.__dict__)
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, result=None):
+        profiler.skipped_sleep += delay
+        return await real_sleep(0, result)
+
+    proxy.sleep = sleep
+    return proxy
+
+
+class StackSampler(threading.Thread):
+    """Samples the main thread's stack every `interval` seconds into collapsed-stack counts."""
+
+    def __init__(self, interval=0.001):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.target = threading.main_thread().ident
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _ensure_config():
+    # The bots import API keys from securedFiles.config; none are needed against a stand-in exchange
+    try:
+        importlib.import_module('securedFiles.config')
+    except ImportError:
+        package = types.ModuleType('securedFiles')
+        config = types.ModuleType('securedFiles.config')
+        config.API_KEY = config.SECRET = ''
+        package.config = config
+        sys.modules['securedFiles'] = package
+        sys.modules['securedFiles.config'] = config
+
+
+def instrument(bot, exchange, profiler):
+    """Import a bot module and route its exchange, functions, indicators and sleeps through the profiler."""
+    from src.exchange_client import SingleFlightExchange
+    from src.indicator_backend import indicators
+
+    _ensure_config()
+    module = importlib.import_module(bot)
+    entry, marker = BOTS[bot]
+    module.exchange = _TimedExchange(SingleFlightExchange(exchange, session=None), profiler)
+    module.asyncio = _fast_asyncio(profiler)
+    module.__dict__.update(OVERRIDES.get(bot, {}))
+    if bot in LISTING_BOTS:
+        profiler.on_cycle = exchange.list_next
+    for name, fn in list(vars(module).items()):
+        if isinstance(fn, types.FunctionType) and fn.__module__ == module.__name__ and name != entry:
+            module.__dict__[name] = profiler.wrap(name, fn)
+    module.__dict__[marker] = profiler.cycle_marker(module.__dict__[marker])
+
+    compute = indicators.compute
+    timed = {}
+
+    def timed_compute(indicator, *inputs, **params):
+        if indicator not in timed:
+            timed[indicator] = profiler.wrap(f"indicators.{indicator}", compute)
+        return timed[indicator](indicator, *inputs, **params)
+
+    indicators.compute = timed_compute
+    return module, getattr(module, entry)
+
+
+async def _run_cycles(entry):
+    try:
+        while True:
+            await entry()
+    except _CyclesDone:
+        pass
+
+
+def _write_reports(out, bot, profiler, cpu, sampler, snapshots, peak):
+    os.makedirs(out, exist_ok=True)
+    base = os.path.join(out, bot)
+
+    cpu.dump_stats(f"{base}.cpu.prof")
+    with open(f"{base}.cpu.txt", 'w') as f:
+        pstats.Stats(cpu, stream=f).sort_stats('cumulative').print_stats(40)
+    sampler.write_folded(f"{base}.folded")
+
+    start, end = snapshots
+    end.dump(f"{base}.memory.snapshot")
+    with open(f"{base}.memory.txt", 'w') as f:
+        f.write(f"Peak traced memory: {peak / 1e6:.1f} MB\n\n")
+        for stat in end.compare_to(start, 'lineno')[:30]:
+            f.write(f"{stat}\n")
+
+    rows = sorted((s.as_dict() for s in profiler.functions.values() if s.calls), key=lambda r: -r['wall_s'])
+    cycles = profiler.cycle_times()
+    summary = {
+        'bot': bot,
+        'cycles': cycles,
+        'skipped_sleep_s': profiler.skipped_sleep,
+        'peak_memory_mb': peak / 1e6,
+        'functions': rows,
+    }
+    with open(f"{base}.summary.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+    with open(f"{base}.summary.txt", 'w') as f:
+        f.write(f"{bot}: {len(cycles)} cycles, " + ", ".join(f"{c:.3f}s" for c in cycles)
+                + f" (skipped {profiler.skipped_sleep:.0f}s of sleeps), peak memory {peak / 1e6:.1f} MB\n\n")
+        f.write(f"{'function':<40}{'calls':>8}{'wall s':>10}{'mean ms':>10}{'await s':>10}\n")
+        for row in rows:
+            f.write(f"{row['function']:<40}{row['calls']:>8}{row['wall_s']:>10.3f}{row['mean_ms']:>10.3f}"
+                    f"{row['await_s']:>10.3f}\n")
+    return summary
+
+
+async def profile_bot(bot, exchange, cycles=3, out='profile', interval=0.001, trace_frames=1):
+    """Profile `cycles` scan cycles of a bot against `exchange`; returns the summary dict."""
+    profiler = Profiler(cycles)
+    module, entry = instrument(bot, exchange, profiler)
+    sampler = StackSampler(interval)
+    cpu = cProfile.Profile()
+    tracemalloc.start(trace_frames)
+    start = tracemalloc.take_snapshot()
+    sampler.start()
+    cpu.enable()
+    try:
+        await _run_cycles(entry)
+    finally:
+        cpu.disable()
+        sampler.stop()
+        end = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return _write_reports(out, bot, profiler, cpu, sampler, (start, end), peak)
+
+
+def _main(args):
+    from src.sim_exchange import RecordedExchange, SimulatedExchange
+
+    out = os.path.abspath(args.out)
+    if args.data:
+        exchange = RecordedExchange(os.path.abspath(args.data), args.timeframe, latency=args.latency)
+    else:
+        symbols = [f"SIM{i}/USDT" for i in range(args.symbols)] + SYMBOLS.get(args.bot, [])
+        exchange = SimulatedExchange(symbols, seed=args.seed, latency=args.latency)
+    missing = set(SYMBOLS.get(args.bot, [])) - set(exchange.symbols)
+    if missing:
+        logger.warning("%s trades %s, which the exchange does not list", args.bot, sorted(missing))
+    if args.bot in LISTING_BOTS:
+        exchange.withhold(exchange.symbols[-args.cycles:])
+    # Bots keep their state journals under relative paths; keep the profiling run's away from the real ones
+    sys.path.insert(0, os.getcwd())
+    workdir = os.path.join(out, 'workdir')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    summary = asyncio.run(profile_bot(args.bot, exchange, args.cycles, out, args.interval, args.trace_frames))
+    print(open(os.path.join(out, f"{args.bot}.summary.txt")).read())
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile bot scan cycles against a stand-in exchange")
+    parser.add_argument('bot', choices=sorted(BOTS))
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--out', default='profile')
+    parser.add_argument('--data', help="Backfill dataset root to replay instead of the simulated exchange")
+    parser.add_argument('--timeframe', default='1m', help="Recorded timeframe in --data")
+    parser.add_argument('--symbols', type=int, default=40, help="Simulated symbols")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds per exchange call")
+    parser.add_argument('--interval', type=float, default=0.001, help="Stack sampling interval in seconds")
+    parser.add_argument('--trace-frames', type=int, default=1, help="tracemalloc frames kept per allocation")
+    _main(parser.parse_args())
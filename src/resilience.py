@@ -0,0 +1,316 @@
+"""
+Resilience layer for exchange read calls: deadlines, hedged requests and
+circuit breakers.
+
+Every read call gets a deadline. Once an endpoint has enough latency samples,
+a call still running after the endpoint's hedge percentile (p95 by default)
+gets a duplicate request and the first success wins. Consecutive failures
+open a circuit breaker per endpoint and per symbol, so calls to a failing
+endpoint or symbol fail immediately with CircuitOpenError instead of costing
+the scan a timeout each; after `reset_timeout` one trial call is let through.
+Errors of a call for one symbol count against that symbol's breaker only,
+unless they are network-level (timeouts, connection errors), which count
+against the endpoint too.
+Order placement is passed through untouched (never hedged or cut short).
+
+Wrap it inside the single-flight layer so coalesced callers share one hedged call:
+
+    exchange = SingleFlightExchange(ResilientExchange(ccxt.binance({...})))
+
+Compare scan latency with and without it against a fault-injecting stand-in:
+
+    python -m src.resilience --scans 10 --symbols 30
+"""
+import argparse
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('load_markets', 'fetch_balance', 'fetch_ticker', 'fetch_tickers', 'fetch_ohlcv',
+                'fetch_order_book', 'fetch_trades', 'fetch_raw_klines')
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def _endpoint_wide(error):
+    """Whether an error says nothing about the symbol called (ccxt NetworkError and its subclasses included)."""
+    return isinstance(error, (asyncio.TimeoutError, OSError)) or \
+        any(cls.__name__ == 'NetworkError' for cls in type(error).__mro__)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+class LatencyTracker:
+    """Sliding window of call latencies with percentile queries."""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.sorted = []
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, seconds):
+        if len(self.samples) == self.samples.maxlen:
+            del self.sorted[bisect.bisect_left(self.sorted, self.samples[0])]
+        self.samples.append(seconds)
+        bisect.insort(self.sorted, seconds)
+
+    def percentile(self, q):
+        if not self.sorted:
+            return None
+        return self.sorted[min(int(q * len(self.sorted)), len(self.sorted) - 1)]
+
+
+class CircuitBreaker:
+    """
+    :param failure_threshold: Consecutive failures that open the breaker
+    :param reset_timeout: Seconds the breaker stays open before a trial call
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.clock() - self.opened_at >= self.reset_timeout else 'open'
+
+    def available(self):
+        """Whether allow() would let a call through, without taking the trial."""
+        state = self.state
+        return state == 'closed' or (state == 'half_open' and not self.trial)
+
+    def allow(self):
+        if not self.available():
+            return False
+        if self.state == 'half_open':
+            self.trial = True
+        return True
+
+    def release(self):
+        """Give back a trial whose call ended without an outcome for this breaker (shed, cancelled)."""
+        self.trial = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self.trial = False
+
+
+class ResilientExchange:
+    """
+    :param exchange: ccxt.async_support exchange (or a stand-in)
+    :param deadlines: Per-method deadlines in seconds; others get `default_deadline`
+    :param hedge_percentile: Latency percentile after which a duplicate request is sent (None disables hedging)
+    :param hedge_min_samples: Latency samples an endpoint needs before it is hedged
+    :param max_hedges: Duplicate requests per call
+    """
+
+    def __init__(self, exchange, deadlines=None, default_deadline=8.0, hedge_percentile=0.95,
+                 hedge_min_samples=20, max_hedges=1, failure_threshold=5, reset_timeout=30.0):
+        self.exchange = exchange
+        self.deadlines = {'fetch_ticker': 3.0, 'fetch_ohlcv': 5.0, 'fetch_raw_klines': 5.0, 'fetch_order_book': 3.0,
+                          **(deadlines or {})}
+        self.default_deadline = default_deadline
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_hedges = max_hedges
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency = {}
+        self.breakers = {}
+        self.counts = {'calls': 0, 'hedges': 0, 'hedge_wins': 0, 'deadlines': 0, 'errors': 0, 'shed': 0}
+
+    def __getattr__(self, name):
+        return getattr(self.exchange, name)
+
+    # SharedSession.attach() sets these on the exchange it is given
+    @property
+    def session(self):
+        return self.exchange.session
+
+    @session.setter
+    def session(self, value):
+        self.exchange.session = value
+
+    @property
+    def own_session(self):
+        return self.exchange.own_session
+
+    @own_session.setter
+    def own_session(self, value):
+        self.exchange.own_session = value
+
+    def _breaker(self, key):
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def _hedge_delay(self, name):
+        tracker = self.latency.get(name)
+        if self.hedge_percentile is None or tracker is None or len(tracker) < self.hedge_min_samples:
+            return None
+        return tracker.percentile(self.hedge_percentile)
+
+    async def _call(self, name, *args, **kwargs):
+        self.counts['calls'] += 1
+        keys = [name]
+        if args and isinstance(args[0], str):
+            keys.append((name, args[0]))
+        breakers = [self._breaker(key) for key in keys]
+        # Every breaker is checked before any takes its trial, so a shed call holds none
+        for key, breaker in zip(keys, breakers):
+            if not breaker.available():
+                self.counts['shed'] += 1
+                raise CircuitOpenError(f"Circuit open for {key}")
+        for breaker in breakers:
+            breaker.allow()
+        try:
+            result = await self._hedged(name, args, kwargs)
+        except asyncio.CancelledError:
+            for breaker in breakers:
+                breaker.release()
+            raise
+        except Exception as error:
+            blamed = breakers if len(breakers) == 1 or _endpoint_wide(error) else breakers[1:]
+            for breaker in breakers:
+                if breaker in blamed:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+            raise
+        for breaker in breakers:
+            breaker.record_success()
+        return result
+
+    async def _hedged(self, name, args, kwargs):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.deadlines.get(name, self.default_deadline)
+        delay = self._hedge_delay(name)
+        attempts = {}
+
+        def launch():
+            task = asyncio.ensure_future(getattr(self.exchange, name)(*args, **kwargs))
+            attempts[task] = loop.time()
+            return task
+
+        pending = {launch()}
+        error = None
+        try:
+            while pending:
+                wake = deadline
+                if delay is not None and len(attempts) <= self.max_hedges:
+                    wake = min(wake, start + delay * len(attempts))
+                done, pending = await asyncio.wait(pending, timeout=max(wake - loop.time(), 0.0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.setdefault(name, LatencyTracker()).add(loop.time() - attempts[task])
+                        if task is not next(iter(attempts)):
+                            self.counts['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+                if loop.time() >= deadline:
+                    self.counts['deadlines'] += 1
+                    raise DeadlineExceeded(f"{name} exceeded its {deadline - start:.1f}s deadline")
+                if pending and delay is not None and len(attempts) <= self.max_hedges \
+                        and loop.time() >= start + delay * len(attempts):
+                    self.counts['hedges'] += 1
+                    pending.add(launch())
+            self.counts['errors'] += 1
+            raise error
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self):
+        opened = [key for key, breaker in self.breakers.items() if breaker.state != 'closed']
+        return {**self.counts, 'open_breakers': opened}
+
+    async def close(self):
+        logger.info("Resilience stats: %s", self.stats())
+        await self.exchange.close()
+
+
+for _name in READ_METHODS:
+    async def _method(self, *args, _name=_name, **kwargs):
+        return await self._call(_name, *args, **kwargs)
+    _method.__name__ = _name
+    setattr(ResilientExchange, _name, _method)
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else float('nan')
+
+
+async def _scan(exchange, symbols, timeout):
+    """One sequential trade()-style pass; returns (seconds, failures)."""
+    start = time.perf_counter()
+    failures = 0
+    for symbol in symbols:
+        try:
+            await asyncio.wait_for(exchange.fetch_ohlcv(symbol, '1m', limit=100), timeout)
+        except Exception:
+            failures += 1
+    return time.perf_counter() - start, failures
+
+
+async def _main(args):
+    from src.sim_exchange import FaultyExchange, SimulatedExchange
+
+    def faulty():
+        return FaultyExchange(SimulatedExchange(n_symbols=args.symbols, latency=args.latency),
+                              slow_rate=args.slow_rate, slow_delay=args.slow_delay, hang_rate=args.hang_rate,
+                              error_rate=args.error_rate, failing_symbols=['SIM0/USDT'], seed=args.seed)
+
+    for label, exchange in (('plain', faulty()), ('resilient', ResilientExchange(faulty()))):
+        await exchange.load_markets()
+        symbols = exchange.symbols
+        # warm-up pass so the resilient client has latency samples to hedge from
+        await _scan(exchange, symbols, args.client_timeout)
+        results = [await _scan(exchange, symbols, args.client_timeout) for _ in range(args.scans)]
+        seconds = [r[0] for r in results]
+        print(f"{label:>10}: scan p50 {_percentile(seconds, 0.5):.2f}s  p99 {_percentile(seconds, 0.99):.2f}s  "
+              f"max {max(seconds):.2f}s  failed calls/scan {sum(r[1] for r in results) / len(results):.1f}")
+        if isinstance(exchange, ResilientExchange):
+            print(f"{'':>10}  {exchange.stats()}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Scan latency with and without the resilience layer")
+    parser.add_argument('--symbols', type=int, default=30)
+    parser.add_argument('--scans', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.02, help="Normal seconds per call")
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-delay', type=float, default=1.0)
+    parser.add_argument('--hang-rate', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--client-timeout', type=float, default=10.0, help="ccxt-style timeout of a plain call")
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,236 @@
+"""
+Cross-symbol exposure control from an exponentially weighted return covariance.
+
+EwmCovariance keeps, for every pair of symbols, the exponentially weighted sum
+of products of their per-bar log returns (zero mean, RiskMetrics style) and
+the sum of the weights over the bars both reported, so covariance = sums /
+weights stays unbiased when symbols join late or skip bars. The sums are
+linear in the observations: a new bar decays both matrices once, and each
+symbol's returns are added with one vectorized product against a ring of the
+other symbols' recent returns. Symbols can therefore arrive in any order
+within a scan, and a symbol seen for the first time is seeded from its whole
+fetched history, without recomputing anything for the rest of the universe.
+
+PortfolioRisk holds the open exposures (quote value per symbol) and caches
+cov @ exposures and the portfolio variance, refreshed once after new data; a
+pre-trade check is then O(1):
+
+    var' = var + 2 * delta * (cov @ e)[j] + delta ** 2 * cov[j, j]
+
+    risk = PortfolioRisk(EwmCovariance('1m', halflife=60), max_volatility=0.02, horizon_bars=60)
+    risk.covariance.observe_ohlcv(pair, ohlcv)
+    allowed, reason = risk.check(pair, quote_amount, capital)
+"""
+import math
+
+import numpy as np
+
+from src.backfill import timeframe_ms
+
+
+class EwmCovariance:
+    """
+    :param timeframe: Bar timeframe of the observed candles
+    :param halflife: Bars after which an observation's weight has halved
+    :param history: Bars of returns kept for pairing late or first observations
+    """
+
+    def __init__(self, timeframe='1m', halflife=60, history=500, capacity=64):
+        self.step = timeframe_ms(timeframe)
+        self.alpha = 1.0 - 0.5 ** (1.0 / halflife)
+        self.decay = 1.0 - self.alpha
+        self.history = history
+        self.symbols = []
+        self.index = {}
+        self.now = None
+        self.version = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        old = len(self.symbols)
+        sums = np.zeros((capacity, capacity))
+        weights = np.zeros((capacity, capacity))
+        returns = np.full((self.history, capacity), np.nan)
+        last_ts = np.full(capacity, -1, dtype=np.int64)
+        last_close = np.full(capacity, np.nan)
+        counts = np.zeros(capacity, dtype=np.int64)
+        if old:
+            sums[:old, :old] = self.sums[:old, :old]
+            weights[:old, :old] = self.weights[:old, :old]
+            returns[:, :old] = self.returns[:, :old]
+            last_ts[:old] = self.last_ts[:old]
+            last_close[:old] = self.last_close[:old]
+            counts[:old] = self.counts[:old]
+        self.sums, self.weights, self.returns = sums, weights, returns
+        self.last_ts, self.last_close, self.counts = last_ts, last_close, counts
+
+    def _slot(self, symbol):
+        i = self.index.get(symbol)
+        if i is None:
+            if len(self.symbols) == len(self.counts):
+                self._allocate(2 * len(self.counts))
+            i = self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return i
+
+    def _advance(self, bar):
+        if self.now is None:
+            self.now = bar
+            return
+        bars = (bar - self.now) // self.step
+        factor = self.decay ** bars
+        self.sums *= factor
+        self.weights *= factor
+        # Ring rows of the bars entering the window are reused
+        stale = (self.now // self.step + 1 + np.arange(min(bars, self.history))) % self.history
+        self.returns[stale] = np.nan
+        self.now = bar
+
+    def observe(self, symbol, timestamps, closes):
+        """Add a symbol's closed bars (bars already seen for the symbol are skipped)."""
+        ts = np.asarray(timestamps, dtype=np.int64)
+        log_close = np.log(np.asarray(closes, dtype=np.float64))
+        i = self._slot(symbol)
+        new = ts > self.last_ts[i]
+        if not new.any():
+            return 0
+        ts, log_close = ts[new], log_close[new]
+        prev_ts = np.r_[self.last_ts[i], ts[:-1]]
+        prev_close = np.r_[math.log(self.last_close[i]) if self.last_close[i] > 0 else np.nan, log_close[:-1]]
+        self.last_ts[i], self.last_close[i] = ts[-1], math.exp(log_close[-1])
+        r = log_close - prev_close
+        keep = (ts - prev_ts == self.step) & np.isfinite(r)
+        if self.now is None or ts[-1] > self.now:
+            self._advance(int(ts[-1]))
+        ages = (self.now - ts) // self.step
+        keep &= ages < self.history
+        if not keep.any():
+            return 0
+        r, ages, rows = r[keep], ages[keep], (ts[keep] // self.step) % self.history
+        w = self.alpha * self.decay ** ages
+        others = self.returns[rows]
+        present = ~np.isnan(others)
+        cross = (w * r) @ np.where(present, others, 0.0)
+        cross_weights = w @ present
+        self.sums[i] += cross
+        self.sums[:, i] += cross
+        self.weights[i] += cross_weights
+        self.weights[:, i] += cross_weights
+        self.sums[i, i] += w @ (r * r)
+        self.weights[i, i] += w.sum()
+        self.returns[rows, i] = r
+        self.counts[i] += len(r)
+        self.version += 1
+        return len(r)
+
+    def observe_ohlcv(self, symbol, ohlcv):
+        """Add fetch_ohlcv rows; the last row is the forming bar and is left out."""
+        if ohlcv is None or len(ohlcv) < 2:
+            return 0
+        rows = np.asarray(ohlcv, dtype=np.float64)[:-1]
+        return self.observe(symbol, rows[:, 0].astype(np.int64), rows[:, 4])
+
+    def observations(self, symbol):
+        i = self.index.get(symbol)
+        return 0 if i is None else int(self.counts[i])
+
+    def covariance(self, symbols=None):
+        """Per-bar return covariance matrix of `symbols` (default: every observed symbol, in order)."""
+        idx = np.arange(len(self.symbols)) if symbols is None else np.array([self.index[s] for s in symbols], dtype=int)
+        sums, weights = self.sums[np.ix_(idx, idx)], self.weights[np.ix_(idx, idx)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(weights > 0, sums / weights, 0.0)
+
+    def correlation(self, symbols=None):
+        cov = self.covariance(symbols)
+        sd = np.sqrt(np.clip(np.diag(cov), 0.0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(np.outer(sd, sd) > 0, cov / np.outer(sd, sd), 0.0)
+        np.fill_diagonal(corr, 1.0)
+        return np.clip(corr, -1.0, 1.0)
+
+    def variance(self, symbol):
+        i = self.index.get(symbol)
+        if i is None or self.weights[i, i] <= 0:
+            return 0.0
+        return float(self.sums[i, i] / self.weights[i, i])
+
+
+class PortfolioRisk:
+    """
+    :param max_volatility: Largest portfolio volatility over `horizon_bars`, as a fraction of capital
+    :param max_correlation: Largest correlation of a new buy with the current portfolio
+    :param min_observations: Returns a symbol needs before it is checked (until then buys pass)
+    """
+
+    def __init__(self, covariance, max_volatility=0.02, max_correlation=0.8, horizon_bars=60, min_observations=30):
+        self.covariance = covariance
+        self.max_volatility = max_volatility
+        self.max_correlation = max_correlation
+        self.horizon_bars = horizon_bars
+        self.min_observations = min_observations
+        self.exposures = {}
+        self._version = None
+        self._gradient = None
+        self._variance = 0.0
+        self._diagonal = None
+
+    def add_exposure(self, symbol, value):
+        self._refresh()
+        i = self.covariance.index.get(symbol)
+        if i is not None and i < len(self._gradient):
+            self._variance += 2 * value * self._gradient[i] + value * value * self._diagonal[i]
+            self._gradient += value * self._cov_column(i)
+        else:
+            self._version = None
+        exposure = self.exposures.get(symbol, 0.0) + value
+        if abs(exposure) > 1e-12:
+            self.exposures[symbol] = exposure
+        else:
+            self.exposures.pop(symbol, None)
+
+    def gross_exposure(self):
+        return sum(abs(v) for v in self.exposures.values())
+
+    def _cov_column(self, i):
+        n = len(self._gradient)
+        sums, weights = self.covariance.sums[:n, i], self.covariance.weights[:n, i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(weights > 0, sums / weights, 0.0)
+
+    def _refresh(self):
+        """Recompute cov @ exposures and the variance; only after the covariance changed."""
+        if self._version == self.covariance.version and self._gradient is not None:
+            return
+        cov = self.covariance.covariance()
+        exposures = np.zeros(len(cov))
+        for symbol, value in self.exposures.items():
+            i = self.covariance.index.get(symbol)
+            if i is not None:
+                exposures[i] = value
+        self._gradient = cov @ exposures
+        self._variance = float(exposures @ self._gradient)
+        self._diagonal = np.diag(cov).copy()
+        self._version = self.covariance.version
+
+    def volatility(self):
+        """Portfolio volatility over the horizon, in quote currency."""
+        self._refresh()
+        return math.sqrt(max(self._variance, 0.0) * self.horizon_bars)
+
+    def check(self, symbol, quote_amount, capital):
+        """(allowed, reason) for adding `quote_amount` of exposure to `symbol`."""
+        self._refresh()
+        i = self.covariance.index.get(symbol)
+        if i is None or i >= len(self._gradient) or self.covariance.observations(symbol) < self.min_observations:
+            return True, "insufficient history"
+        variance = self._variance + 2 * quote_amount * self._gradient[i] + quote_amount ** 2 * self._diagonal[i]
+        volatility = math.sqrt(max(variance, 0.0) * self.horizon_bars)
+        if capital > 0 and volatility > self.max_volatility * capital:
+            return False, (f"portfolio volatility would be {volatility / capital:.2%} of capital "
+                           f"(limit {self.max_volatility:.2%})")
+        if self._variance > 0 and self._diagonal[i] > 0:
+            correlation = self._gradient[i] / math.sqrt(self._variance * self._diagonal[i])
+            if correlation > self.max_correlation:
+                return False, f"correlation with the open positions is {correlation:.2f} (limit {self.max_correlation:.2f})"
+        return True, "ok"
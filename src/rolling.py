@@ -0,0 +1,336 @@
+"""
+Rolling-window primitives that stay linear in the series length.
+
+Batch functions return one value per complete window (len(x) - window + 1
+values, like sliding_window_view(x, window).max(-1)). Maxima, minima and sums
+use the van Herk/Gil-Werman decomposition: the series is cut into blocks of
+`window` values, prefix and suffix scans are taken inside every block, and
+each window combines one block's suffix with the next block's prefix. That is
+a fixed number of passes whatever the window length, and a sum never adds more
+than 2 * window terms, so it does not drift the way a global cumsum does over
+long histories. Mean absolute deviation has no sliding O(1) update; it is one
+vectorized pass per window, run in chunks so memory stays bounded.
+
+The state objects update one value at a time: monotonic deques for min/max
+(amortized O(1)), a running sum re-anchored once per window, and a ring buffer
+for the mean deviation. STOCH, CCI and Donchian channels are built on them,
+in batch and incremental form, with TA-Lib's alignment (NaN for lookback bars).
+"""
+import math
+import operator
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _check_window(window):
+    if window < 1:
+        raise ValueError("window must be at least 1")
+
+
+def _blocked(x, window, ufunc, fill):
+    """(suffix, prefix) scans whose ufunc-combination is the reduction of every complete window."""
+    _check_window(window)
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    if n < window:
+        return np.empty(0), np.empty(0)
+    blocks = np.r_[x, np.full(-n % window, fill)].reshape(-1, window)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    m = n - window + 1
+    return suffix[:m], prefix[window - 1:window - 1 + m]
+
+
+def rolling_max(x, window):
+    return np.maximum(*_blocked(x, window, np.maximum, -np.inf))
+
+
+def rolling_min(x, window):
+    return np.minimum(*_blocked(x, window, np.minimum, np.inf))
+
+
+def rolling_sum(x, window):
+    suffix, prefix = _blocked(x, window, np.add, 0.0)
+    out = suffix + prefix
+    # A window starting on a block boundary is that whole block, already the suffix
+    out[::window] = suffix[::window]
+    return out
+
+
+def rolling_mean(x, window):
+    return rolling_sum(x, window) / window
+
+
+def rolling_mean_var(x, window):
+    """
+    (mean, population variance) of every complete window, over axis 0 of x.
+
+    Uses the block decomposition of rolling_sum on the sums of x and x**2, with
+    every block centred on its own first value; a window's prefix part is
+    re-centred onto its suffix block's reference before combining. The sums
+    therefore only see deviations from a value inside (or next to) the window,
+    so sum2 / n - mean**2 does not cancel against the series' level.
+    """
+    _check_window(window)
+    x = np.asarray(x, dtype=np.float64)
+    n, rest = x.shape[0], x.shape[1:]
+    m = n - window + 1
+    if m <= 0:
+        return np.empty((0,) + rest), np.empty((0,) + rest)
+    blocks = np.concatenate([x, np.zeros((-n % window,) + rest)]).reshape((-1, window) + rest)
+    d = blocks - blocks[:, :1]
+    flat = (-1,) + rest
+    d.reshape(flat)[n:] = 0.0
+    d2 = d * d
+    # Window i: suffix part from i to its block's end, prefix part from the next block's start to i + window - 1
+    suffix1 = np.cumsum(d[:, ::-1], axis=1)[:, ::-1].reshape(flat)[:m]
+    suffix2 = np.cumsum(d2[:, ::-1], axis=1)[:, ::-1].reshape(flat)[:m]
+    p1 = np.cumsum(d, axis=1).reshape(flat)[window - 1:window - 1 + m].copy()
+    p2 = np.cumsum(d2, axis=1).reshape(flat)[window - 1:window - 1 + m].copy()
+    reference = np.repeat(blocks[:, :1], window, axis=1).reshape(flat)
+    shift = reference[window - 1:window - 1 + m] - reference[:m]
+    count = ((np.arange(m) - 1) % window + 1).astype(np.float64)[(slice(None),) + (None,) * len(rest)]
+    # A window starting on a block boundary is that whole block: no prefix part
+    count[::window] = 0.0
+    p1[::window] = 0.0
+    p2[::window] = 0.0
+    sum1 = suffix1 + p1 + count * shift
+    sum2 = suffix2 + p2 + (2.0 * p1 + count * shift) * shift
+    mean = sum1 / window
+    return reference[:m] + mean, np.maximum(sum2 / window - mean * mean, 0.0)
+
+
+def rolling_mad(x, window, mean=None, chunk=1 << 20):
+    """
+    Mean absolute deviation of every window from its mean (`mean`: precomputed rolling_mean).
+
+    O(len(x) * window), unlike the other batch functions: the deviation is taken
+    over each window in vectorized chunks. A sorted window with prefix sums would
+    be O(len(x) * log(window)) but needs a per-value Python loop, which only
+    catches up near window = 2000; CCI uses 14-20.
+    """
+    _check_window(window)
+    x = np.asarray(x, dtype=np.float64)
+    m = len(x) - window + 1
+    if m <= 0:
+        return np.empty(0)
+    mean = rolling_mean(x, window) if mean is None else mean
+    windows = sliding_window_view(x, window)
+    out = np.empty(m)
+    step = max(chunk // window, 1)
+    for start in range(0, m, step):
+        stop = min(start + step, m)
+        out[start:stop] = np.abs(windows[start:stop] - mean[start:stop, None]).mean(axis=-1)
+    return out
+
+
+def _aligned(values, n):
+    out = np.full(n, np.nan)
+    if len(values):
+        out[n - len(values):] = values
+    return out
+
+
+def donchian(high, low, timeperiod=20):
+    """(upper, middle, lower) Donchian channel: highest high, midpoint and lowest low of `timeperiod` bars."""
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    upper = _aligned(rolling_max(high, timeperiod), len(high))
+    lower = _aligned(rolling_min(low, timeperiod), len(low))
+    return upper, (upper + lower) / 2.0, lower
+
+
+# ---------------------------------------------------------------------------
+# Incremental state objects
+
+class _MonotonicWindow:
+    """Extremum of the last `window` values; update() returns NaN until `window` values were seen."""
+
+    def __init__(self, window, dominates):
+        _check_window(window)
+        self.window = window
+        self.count = 0
+        self.value = np.nan
+        self._dominates = dominates
+        self._deque = deque()  # (index, value); values monotonic from the front
+
+    def update(self, x):
+        entries = self._deque
+        while entries and self._dominates(x, entries[-1][1]):
+            entries.pop()
+        entries.append((self.count, x))
+        if entries[0][0] <= self.count - self.window:
+            entries.popleft()
+        self.count += 1
+        if self.count < self.window:
+            return np.nan
+        self.value = entries[0][1]
+        return self.value
+
+    def peek(self, x):
+        """What update(x) would return, without changing the state."""
+        if self.count + 1 < self.window:
+            return np.nan
+        start = self.count + 1 - self.window
+        for index, value in self._deque:
+            # The front entry may be the one x pushes out of the window
+            if index >= start:
+                return x if self._dominates(x, value) else value
+        return x
+
+
+class RollingMax(_MonotonicWindow):
+    def __init__(self, window):
+        super().__init__(window, operator.ge)
+
+
+class RollingMin(_MonotonicWindow):
+    def __init__(self, window):
+        super().__init__(window, operator.le)
+
+
+class RollingSum:
+    """Sum of the last `window` values; update() returns NaN until the window is full."""
+
+    def __init__(self, window):
+        _check_window(window)
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+        self._updates = 0
+
+    def update(self, x):
+        self.values.append(x)
+        self.total += x
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+        self._updates += 1
+        if self._updates % self.window == 0:
+            # Re-anchor so add/subtract rounding does not accumulate over long runs
+            self.total = math.fsum(self.values)
+        return self.total if len(self.values) == self.window else np.nan
+
+    def peek(self, x):
+        """What update(x) would return, without changing the state."""
+        if len(self.values) + 1 < self.window:
+            return np.nan
+        return self.total + x - (self.values[0] if len(self.values) == self.window else 0.0)
+
+
+class RollingMeanDeviation:
+    """
+    Mean absolute deviation of the last `window` values from their mean (also kept in `mean`).
+
+    Each update is O(window), one vectorized pass over the ring buffer; at CCI's
+    window lengths that costs about as much as the call overhead.
+    """
+
+    def __init__(self, window):
+        _check_window(window)
+        self.window = window
+        self.count = 0
+        self.mean = np.nan
+        self._sum = RollingSum(window)
+        self._buffer = np.empty(window)
+
+    def update(self, x):
+        self._buffer[self.count % self.window] = x
+        self.count += 1
+        total = self._sum.update(x)
+        if self.count < self.window:
+            return np.nan
+        self.mean = total / self.window
+        return float(np.abs(self._buffer - self.mean).mean())
+
+    def peek(self, x):
+        """(deviation, mean) that update(x) would leave, without changing the state."""
+        if self.count + 1 < self.window:
+            return np.nan, np.nan
+        mean = self._sum.peek(x) / self.window
+        deviation = np.abs(self._buffer[:self.count] - mean).sum() + abs(x - mean)
+        if self.count >= self.window:
+            # x takes the oldest value's slot
+            deviation -= abs(self._buffer[self.count % self.window] - mean)
+        return float(deviation / self.window), mean
+
+
+class StochState:
+    """Slow stochastic (SMA smoothing, TA-Lib alignment) updated one bar at a time; returns (slowk, slowd)."""
+
+    def __init__(self, fastk_period=5, slowk_period=3, slowd_period=3):
+        self.highest = RollingMax(fastk_period)
+        self.lowest = RollingMin(fastk_period)
+        self.slowk = RollingSum(slowk_period)
+        self.slowd = RollingSum(slowd_period)
+        self.slowk_period = slowk_period
+        self.slowd_period = slowd_period
+
+    def update(self, high, low, close):
+        highest = self.highest.update(high)
+        lowest = self.lowest.update(low)
+        if highest != highest:
+            return np.nan, np.nan
+        span = highest - lowest
+        fastk = 100.0 * (close - lowest) / span if span > 0 else 0.0
+        k = self.slowk.update(fastk)
+        if k != k:
+            return np.nan, np.nan
+        k /= self.slowk_period
+        d = self.slowd.update(k)
+        if d != d:
+            return np.nan, np.nan
+        return k, d / self.slowd_period
+
+    def peek(self, high, low, close):
+        """What update() would return for this bar, without changing the state."""
+        highest = self.highest.peek(high)
+        lowest = self.lowest.peek(low)
+        if highest != highest:
+            return np.nan, np.nan
+        span = highest - lowest
+        fastk = 100.0 * (close - lowest) / span if span > 0 else 0.0
+        k = self.slowk.peek(fastk)
+        if k != k:
+            return np.nan, np.nan
+        k /= self.slowk_period
+        d = self.slowd.peek(k)
+        if d != d:
+            return np.nan, np.nan
+        return k, d / self.slowd_period
+
+
+class CciState:
+    """Commodity channel index updated one bar at a time."""
+
+    def __init__(self, timeperiod=14):
+        self.deviation = RollingMeanDeviation(timeperiod)
+
+    def update(self, high, low, close):
+        typical = (high + low + close) / 3.0
+        deviation = self.deviation.update(typical)
+        if deviation != deviation:
+            return np.nan
+        return (typical - self.deviation.mean) / (0.015 * deviation) if deviation > 0 else 0.0
+
+    def peek(self, high, low, close):
+        """What update() would return for this bar, without changing the state."""
+        typical = (high + low + close) / 3.0
+        deviation, mean = self.deviation.peek(typical)
+        if deviation != deviation:
+            return np.nan
+        return (typical - mean) / (0.015 * deviation) if deviation > 0 else 0.0
+
+
+class DonchianState:
+    """Donchian channel updated one bar at a time; returns (upper, middle, lower)."""
+
+    def __init__(self, timeperiod=20):
+        self.highest = RollingMax(timeperiod)
+        self.lowest = RollingMin(timeperiod)
+
+    def update(self, high, low):
+        upper = self.highest.update(high)
+        lower = self.lowest.update(low)
+        return upper, (upper + lower) / 2.0, lower
@@ -0,0 +1,379 @@
+"""
+Sharding of the tradeable-pair universe across worker processes and hosts.
+
+Symbols are placed on a consistent-hash ring of worker ids, so adding or
+losing a worker only moves that worker's share of the universe. A small
+coordinator (one asyncio TCP server speaking JSON lines) owns the ring:
+workers join with their id, heartbeat to keep their shard, and a worker that
+stops heartbeating is dropped so its symbols move to the survivors on their
+next heartbeat. A worker that leaves after scanning its shard hands its
+symbols over as released: a survivor mid-scan does not follow them, since
+they were already scanned. Each worker keeps its own exchange client and
+weight budget.
+
+Without a coordinator, static_shard() gives the same split for a fixed worker
+count. Local multi-process run against the simulated exchange:
+
+    python -m src.sharding --workers 3 --symbols 60 --kill-after 6
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import time
+
+from src.backfill import WeightBudget, klines_weight
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    :param nodes: Initial worker ids
+    :param replicas: Virtual points per worker; more points give a more even split
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self.points = []
+        self.owners = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            j = bisect.bisect(self.points, point)
+            self.points.insert(j, point)
+            self.owners.insert(j, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        keep = [i for i, owner in enumerate(self.owners) if owner != node]
+        self.points = [self.points[i] for i in keep]
+        self.owners = [self.owners[i] for i in keep]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.owners[bisect.bisect(self.points, _hash(key)) % len(self.points)]
+
+    def assign(self, keys):
+        """{node: [keys]} for every node on the ring (nodes without keys get an empty list)."""
+        shards = {node: [] for node in self.nodes}
+        for key in keys:
+            if self.points:
+                shards[self.owner(key)].append(key)
+        return shards
+
+
+def static_shard(symbols, worker, workers, replicas=160):
+    """The symbols worker `worker` (0-based) owns out of `workers`, without a coordinator."""
+    ring = HashRing([f"worker-{i}" for i in range(workers)], replicas)
+    return [s for s in symbols if ring.owner(s) == f"worker-{worker}"]
+
+
+class Coordinator:
+    """
+    :param universe: Symbols to shard; if empty, the first worker to join supplies it
+    :param heartbeat_timeout: Seconds without a heartbeat before a worker's shard is reassigned
+    """
+
+    def __init__(self, universe=(), heartbeat_timeout=10.0, replicas=160):
+        self.universe = list(universe)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ring = HashRing(replicas=replicas)
+        self.last_seen = {}
+        self.released = set()  # symbols handed over by workers that left after scanning them
+        self.epoch = 0
+        self.server = None
+        self._reaper = None
+        self._shards = None
+
+    def shards(self):
+        if self._shards is None:
+            self._shards = self.ring.assign(self.universe)
+        return self._shards
+
+    def _changed(self):
+        self.epoch += 1
+        self._shards = None
+
+    def join(self, worker, universe=None):
+        if universe and not self.universe:
+            self.universe = list(universe)
+            self._changed()
+        self.last_seen[worker] = time.monotonic()
+        if worker not in self.ring.nodes:
+            self.ring.add(worker)
+            self._changed()
+            logger.info("Worker %s joined; %s workers, epoch %s", worker, len(self.ring), self.epoch)
+        symbols = self.shards().get(worker, [])
+        return {'epoch': self.epoch, 'workers': len(self.ring), 'symbols': symbols,
+                'released': [s for s in symbols if s in self.released]}
+
+    def leave(self, worker, scanned=False):
+        """
+        :param scanned: The worker scanned its shard before leaving, so workers
+            gaining those symbols mid-scan should not scan them again
+        """
+        self.last_seen.pop(worker, None)
+        if worker in self.ring.nodes:
+            shard = self.shards().get(worker, [])
+            moved = len(shard)
+            if scanned:
+                self.released.update(shard)
+            else:
+                self.released.difference_update(shard)
+            self.ring.remove(worker)
+            self._changed()
+            logger.info("Worker %s left; %s symbols reassigned, epoch %s", worker, moved, self.epoch)
+
+    def reap(self):
+        """Drop workers whose last heartbeat is older than heartbeat_timeout."""
+        deadline = time.monotonic() - self.heartbeat_timeout
+        for worker, seen in list(self.last_seen.items()):
+            if seen < deadline:
+                logger.warning("Worker %s missed its heartbeats", worker)
+                self.leave(worker)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            if request['op'] == 'heartbeat':
+                reply = self.join(request['worker'], request.get('universe'))
+            elif request['op'] == 'leave':
+                self.leave(request['worker'], request.get('scanned', False))
+                reply = {'epoch': self.epoch}
+            elif request['op'] == 'status':
+                reply = {'epoch': self.epoch, 'shards': self.shards()}
+            else:
+                reply = {'error': f"unknown op {request['op']}"}
+        except Exception as e:
+            reply = {'error': str(e)}
+        writer.write(json.dumps(reply).encode() + b'\n')
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_timeout / 4)
+            self.reap()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self._reaper = asyncio.create_task(self._reap_forever())
+        logger.info("Shard coordinator listening on %s:%s", host, port)
+        return self
+
+    async def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+async def _request(address, message, timeout=5.0):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), timeout)
+    try:
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+        reply = json.loads(await asyncio.wait_for(reader.readline(), timeout))
+    finally:
+        writer.close()
+    if 'error' in reply:
+        raise RuntimeError(f"Shard coordinator error: {reply['error']}")
+    return reply
+
+
+class ShardClient:
+    """
+    A worker's membership: joins the coordinator, then heartbeats in the
+    background and keeps `symbols` current. Check owns() before acting on a
+    symbol, since a shard can shrink mid-scan when another worker joins.
+
+    :param address: (host, port) of the coordinator
+    :param worker_id: Stable id of this worker (reusing it after a restart keeps the same shard)
+    """
+
+    def __init__(self, address, worker_id, heartbeat_interval=2.0):
+        self.address = tuple(address)
+        self.worker_id = worker_id
+        self.heartbeat_interval = heartbeat_interval
+        self.symbols = []
+        self.epoch = None
+        self._owned = set()
+        self._released = set()
+        self._task = None
+
+    def owns(self, symbol):
+        return symbol in self._owned
+
+    def scan(self):
+        """
+        Iterate this worker's shard once while following it: symbols lost
+        mid-scan are skipped, and symbols gained mid-scan from a worker that
+        stopped heartbeating are visited too. Symbols gained from a worker that
+        left after scanning them are not.
+        """
+        seen = set()
+        symbols, i = None, 0
+        start = set(self.symbols)
+        while True:
+            if symbols is not self.symbols:
+                # A heartbeat replaced the shard; walk the new one, skipping what was visited
+                symbols, i = self.symbols, 0
+                seen.update(s for s in symbols if s in self._released and s not in start)
+            while i < len(symbols) and symbols[i] in seen:
+                i += 1
+            if i == len(symbols):
+                return
+            seen.add(symbols[i])
+            yield symbols[i]
+            i += 1
+
+    async def heartbeat(self, universe=None):
+        message = {'op': 'heartbeat', 'worker': self.worker_id}
+        if universe is not None:
+            message['universe'] = list(universe)
+        reply = await _request(self.address, message)
+        if reply['epoch'] != self.epoch:
+            logger.info("%s: shard of %s symbols (%s workers, epoch %s)",
+                        self.worker_id, len(reply['symbols']), reply['workers'], reply['epoch'])
+        self.epoch = reply['epoch']
+        self.symbols = reply['symbols']
+        self._owned = set(self.symbols)
+        self._released = set(reply.get('released', ()))
+        return self.symbols
+
+    async def _heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error("%s: heartbeat failed: %s", self.worker_id, e)
+
+    async def join(self, universe=None):
+        symbols = await self.heartbeat(universe)
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_forever())
+        return symbols
+
+    async def leave(self, scanned=False):
+        """:param scanned: This worker scanned its whole shard, so the workers taking it over need not"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        try:
+            await _request(self.address, {'op': 'leave', 'worker': self.worker_id, 'scanned': scanned})
+        except Exception as e:
+            logger.error("%s: leave failed: %s", self.worker_id, e)
+
+
+async def run_worker(address, worker_id, make_exchange, scan, interval=1.0, cycles=None,
+                     weight_per_minute=1200, heartbeat_interval=2.0):
+    """
+    Scan this worker's shard in a loop with its own exchange client and weight budget.
+
+    :param make_exchange: Callable returning this worker's (async ccxt-style) exchange
+    :param scan: async scan(exchange, symbols, client, budget), called once per cycle
+    """
+    exchange = make_exchange()
+    budget = WeightBudget(weight_per_minute)
+    client = ShardClient(address, worker_id, heartbeat_interval)
+    try:
+        await exchange.load_markets()
+        await client.join(exchange.symbols)
+        cycle = 0
+        while cycles is None or cycle < cycles:
+            await scan(exchange, list(client.symbols), client, budget)
+            cycle += 1
+            await asyncio.sleep(interval)
+    finally:
+        await client.leave()
+        await exchange.close()
+
+
+async def _demo_scan(exchange, symbols, client, budget):
+    from src.indicator_backend import indicators
+    import numpy as np
+
+    scanned = 0
+    for symbol in client.scan():
+        await budget.acquire(klines_weight(100))
+        ohlcv = np.asarray(await exchange.fetch_ohlcv(symbol, '1m', limit=100), dtype=float)
+        indicators.RSI(ohlcv[:, 4], timeperiod=14)
+        scanned += 1
+    logger.info("%s: scanned %s symbols", client.worker_id, scanned)
+
+
+def _worker_process(address, worker_id, n_symbols, seed, latency):
+    from src.sim_exchange import SimulatedExchange
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    asyncio.run(run_worker(
+        address, worker_id,
+        lambda: SimulatedExchange(n_symbols=n_symbols, seed=seed, latency=latency),
+        _demo_scan,
+    ))
+
+
+async def _main(args):
+    address = ('127.0.0.1', args.port)
+    coordinator = await Coordinator(heartbeat_timeout=args.heartbeat_timeout).start(*address)
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(address, f"worker-{i}", args.symbols, args.seed, args.latency))
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        start = time.monotonic()
+        killed = False
+        while time.monotonic() - start < args.duration:
+            await asyncio.sleep(1)
+            if not killed and args.kill_after and time.monotonic() - start >= args.kill_after:
+                logger.info("Killing worker-0")
+                processes[0].kill()
+                killed = True
+        sizes = {worker: len(symbols) for worker, symbols in coordinator.shards().items()}
+        logger.info("Final shards (epoch %s): %s", coordinator.epoch, sizes)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        await coordinator.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Local sharded run against the simulated exchange")
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--symbols', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.01, help="Simulated seconds per exchange call")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--heartbeat-timeout', type=float, default=4.0)
+    parser.add_argument('--kill-after', type=float, default=6.0, help="Seconds before worker-0 is killed (0: never)")
+    parser.add_argument('--duration', type=float, default=15.0)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,294 @@
+"""
+Bit-packed audit log of every signal evaluation.
+
+Each evaluation of a pair is one 6-byte row: the symbol's id, the bar's index
+within its UTC day and the 16 condition results (bit i: buy condition i, bit
+8 + i: sell condition i). Rows are appended to one file per day behind a
+fixed header (magic, bar step, day start), and ids map to symbols through an
+append-only symbols.txt next to them:
+
+    <root>/symbols.txt
+    <root>/<YYYY-MM-DD>.sig
+
+A million evaluations take 6 MB, a file is a plain array that np.memmap reads
+without parsing, and a torn row at the end (crash mid-write) is ignored on
+read and truncated when the writer reopens the file. Queries are vectorized
+over the condition column, e.g. the buy near-misses of a day and which
+condition blocked them:
+
+    audit = SignalAudit('audit/main', '1m')
+    audit.record(pair, bar_ts, buy_conditions, sell_conditions)
+
+    rows = load_rows('audit/main', start='2024-03-01')
+    misses = rows[near_misses(rows['conditions'], 'buy')]
+    blocking_conditions(misses['conditions'], 'buy')
+
+    python -m src.signal_audit audit/main --since 2024-03-01
+"""
+import argparse
+import datetime
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+
+from src.backfill import DAY_MS, timeframe_ms
+
+logger = logging.getLogger(__name__)
+
+BUY_CONDITIONS = ('close > ema', 'close > wma', 'trix > 0', 'close < lower band',
+                  'rsi < 30', 'macd > signal', 'cci < -100', 'stoch < 20')
+SELL_CONDITIONS = ('close < ema', 'close < wma', 'trix < 0', 'close > upper band',
+                   'rsi > 70', 'macd < signal', 'cci > 100', 'stoch > 80')
+MASKS = {'buy': 0x00FF, 'sell': 0xFF00}
+SHIFTS = {'buy': 0, 'sell': 8}
+
+ROW = np.dtype([('symbol', '<u2'), ('bar', '<u2'), ('conditions', '<u2')])
+RECORD = np.dtype([('symbol', '<u2'), ('timestamp', '<i8'), ('conditions', '<u2')])
+_HEADER = struct.Struct('<4sIq')  # magic, bar step (ms), day start (ms)
+_MAGIC = b'SIG1'
+
+# Set bits of every 8-bit value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def pack_conditions(buy, sell):
+    """16-bit condition word of up to 8 buy and 8 sell results."""
+    bits = 0
+    for i, met in enumerate(buy):
+        if met:
+            bits |= 1 << i
+    for i, met in enumerate(sell):
+        if met:
+            bits |= 1 << (8 + i)
+    return bits
+
+
+def _timestamp_ms(bar_ts):
+    # pandas Timestamps carry nanoseconds in .value
+    value = getattr(bar_ts, 'value', None)
+    return int(value) // 1_000_000 if value is not None else int(bar_ts)
+
+
+def audit_path(root, day):
+    name = datetime.datetime.fromtimestamp(day * DAY_MS / 1000, tz=datetime.timezone.utc).strftime('%Y-%m-%d')
+    return os.path.join(root, f"{name}.sig")
+
+
+class SignalAudit:
+    """
+    :param timeframe: Bar resolution of the recorded timestamps (at least 2s, so a day fits 16-bit indices)
+    :param buffer_rows: Rows buffered before they are written
+    :param flush_interval: Seconds after which buffered rows are written anyway
+    """
+
+    def __init__(self, root, timeframe='1m', buffer_rows=4096, flush_interval=5.0):
+        self.root = root
+        self.step = timeframe_ms(timeframe)
+        if DAY_MS // self.step > 1 << 16:
+            raise ValueError(f"{timeframe} bars do not fit 16-bit bar indices within a day")
+        self.flush_interval = flush_interval
+        self.buffer = np.empty(buffer_rows, dtype=ROW)
+        self.count = 0
+        self.records = 0
+        self.day = None
+        self.file = None
+        self.ids = {}
+        self._symbols = None
+        self._flushed = time.monotonic()
+
+    def _symbol_id(self, symbol):
+        i = self.ids.get(symbol)
+        if i is None:
+            if self._symbols is None:
+                os.makedirs(self.root, exist_ok=True)
+                self.ids = {name: i for i, name in enumerate(read_symbols(self.root))}
+                self._symbols = open(os.path.join(self.root, 'symbols.txt'), 'a')
+                i = self.ids.get(symbol)
+                if i is not None:
+                    return i
+            i = self.ids[symbol] = len(self.ids)
+            if i >= 1 << 16:
+                raise ValueError("Signal audit symbol table is full")
+            self._symbols.write(symbol + '\n')
+            self._symbols.flush()
+        return i
+
+    def _open(self, day):
+        path = audit_path(self.root, day)
+        os.makedirs(self.root, exist_ok=True)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if 0 < size < _HEADER.size:
+            logger.warning("Rewriting the torn header of %s", path)
+            os.truncate(path, 0)
+            size = 0
+        if size:
+            step, _ = _read_header(path)
+            if step != self.step:
+                raise ValueError(f"{path} holds {step} ms bars, not {self.step} ms")
+            valid = _HEADER.size + (size - _HEADER.size) // ROW.itemsize * ROW.itemsize
+            if valid < size:
+                logger.warning("Truncating %s torn bytes at the end of %s", size - valid, path)
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+        self.file = open(path, 'ab')
+        if not size:
+            self.file.write(_HEADER.pack(_MAGIC, self.step, day * DAY_MS))
+        self.day = day
+
+    def record(self, symbol, bar_ts, buy, sell):
+        """Log one evaluation: the bar's open time (ms or pandas Timestamp) and its condition results."""
+        ts = _timestamp_ms(bar_ts)
+        day = ts // DAY_MS
+        if day != self.day:
+            self.flush()
+            if self.file is not None:
+                self.file.close()
+            self._open(day)
+        self.buffer[self.count] = (self._symbol_id(symbol), (ts - day * DAY_MS) // self.step,
+                                   pack_conditions(buy, sell))
+        self.count += 1
+        if self.count == len(self.buffer) or time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed = time.monotonic()
+        if not self.count:
+            return
+        self.file.write(self.buffer[:self.count].tobytes())
+        self.file.flush()
+        self.records += self.count
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        for f in (self.file, self._symbols):
+            if f is not None:
+                f.close()
+        self.file = self._symbols = None
+
+
+def read_symbols(root):
+    path = os.path.join(root, 'symbols.txt')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        magic, step, day_start = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError(f"{path} is not a signal audit file")
+    return step, day_start
+
+
+def open_day(path):
+    """(bar step ms, day start ms, rows) of one file; rows is a read-only memmap of ROW."""
+    if os.path.getsize(path) < _HEADER.size:
+        return None, None, np.empty(0, ROW)
+    step, day_start = _read_header(path)
+    n = (os.path.getsize(path) - _HEADER.size) // ROW.itemsize
+    rows = np.memmap(path, ROW, 'r', offset=_HEADER.size, shape=(n,)) if n else np.empty(0, ROW)
+    return step, day_start, rows
+
+
+def audit_files(root, start=None, end=None):
+    """Day files under `root` overlapping [start, end) (ms or ISO dates), oldest first."""
+    start, end = _bound(start), _bound(end)
+    names = sorted(name for name in os.listdir(root) if name.endswith('.sig')) if os.path.isdir(root) else []
+    paths = []
+    for name in names:
+        day_start = int(datetime.datetime.fromisoformat(name[:-4]).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        if (start is None or day_start + DAY_MS > start) and (end is None or day_start < end):
+            paths.append(os.path.join(root, name))
+    return paths
+
+
+def _bound(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def load_rows(root, start=None, end=None):
+    """Evaluations in [start, end) as a RECORD array (symbol id, bar timestamp in ms, condition bits)."""
+    start, end = _bound(start), _bound(end)
+    parts = []
+    for path in audit_files(root, start, end):
+        step, day_start, rows = open_day(path)
+        if not len(rows):
+            continue
+        part = np.empty(len(rows), RECORD)
+        part['symbol'] = rows['symbol']
+        part['timestamp'] = day_start + rows['bar'].astype(np.int64) * step
+        part['conditions'] = rows['conditions']
+        keep = np.ones(len(part), dtype=bool)
+        if start is not None:
+            keep &= part['timestamp'] >= start
+        if end is not None:
+            keep &= part['timestamp'] < end
+        parts.append(part[keep])
+    return np.concatenate(parts) if parts else np.empty(0, RECORD)
+
+
+def conditions_met(conditions, side):
+    """Number of the side's conditions met in every condition word."""
+    side_bits = (np.asarray(conditions, dtype=np.uint16) & MASKS[side]) >> SHIFTS[side]
+    return _POPCOUNT[side_bits]
+
+
+def near_misses(conditions, side, missing=1):
+    """Mask of evaluations where all but `missing` of the side's conditions were met."""
+    return conditions_met(conditions, side) == len(BUY_CONDITIONS) - missing
+
+
+def condition_bits(conditions, side):
+    """(n, 8) boolean matrix of the side's condition results, in BUY_/SELL_CONDITIONS order."""
+    side_bits = ((np.asarray(conditions, dtype=np.uint16) & MASKS[side]) >> SHIFTS[side]).astype(np.uint8)
+    return np.unpackbits(side_bits[:, None], axis=1, bitorder='little').astype(bool)
+
+
+def condition_rates(conditions, side):
+    """Share of evaluations meeting each of the side's conditions."""
+    names = BUY_CONDITIONS if side == 'buy' else SELL_CONDITIONS
+    if not len(conditions):
+        return dict.fromkeys(names, 0.0)
+    return dict(zip(names, condition_bits(conditions, side).mean(axis=0).tolist()))
+
+
+def blocking_conditions(conditions, side):
+    """How often each of the side's conditions was among the unmet ones."""
+    names = BUY_CONDITIONS if side == 'buy' else SELL_CONDITIONS
+    return dict(zip(names, (~condition_bits(conditions, side)).sum(axis=0).tolist()))
+
+
+def _main(args):
+    rows = load_rows(args.root, args.since, args.until)
+    symbols = read_symbols(args.root)
+    print(f"{len(rows)} evaluations of {len(np.unique(rows['symbol']))} symbols")
+    for side in ('buy', 'sell'):
+        met = conditions_met(rows['conditions'], side)
+        misses = rows[near_misses(rows['conditions'], side, args.missing)]
+        print(f"\n{side}: {int((met == 8).sum())} signals, {len(misses)} evaluations missing {args.missing} condition(s)")
+        rates = condition_rates(rows['conditions'], side)
+        blocking = blocking_conditions(misses['conditions'], side)
+        for name in rates:
+            print(f"  {name:<20} met {rates[name]:7.2%}   blocking {blocking[name]:>8}")
+        ids, counts = np.unique(misses['symbol'], return_counts=True)
+        top = np.argsort(-counts, kind='stable')[:args.top]
+        if len(top):
+            print("  near misses: " + ", ".join(f"{symbols[ids[i]]} {counts[i]}" for i in top))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a signal audit log")
+    parser.add_argument('root')
+    parser.add_argument('--since', help="UTC start (ISO date/time)")
+    parser.add_argument('--until', help="UTC end (ISO date/time)")
+    parser.add_argument('--missing', type=int, default=1, help="Unmet conditions that make a near miss")
+    parser.add_argument('--top', type=int, default=10, help="Symbols listed with the most near misses")
+    _main(parser.parse_args())
@@ -0,0 +1,290 @@
+"""
+Simulated exchange with the subset of the ccxt async API the bots use.
+
+Prices are deterministic random walks per symbol (seeded by the symbol name),
+aligned to the clock, so independent processes started with the same seed see
+the same market. Symbols can be withheld and listed later to simulate new
+listings. RecordedExchange serves candles recorded by src.backfill
+instead. Orders fill immediately at the simulated bid/ask with the commission
+deducted. Used for local multi-process runs, profiling and replay.
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+from src.backfill import load_ohlcv, timeframe_ms
+
+class SimulatedExchange:
+    """
+    :param symbols: Market symbols, or None for n_symbols generated 'SIMn/USDT' pairs
+    :param seed: Random seed shared by every process that should see the same market
+    :param latency: Seconds awaited per call, to mimic network round trips
+    :param balances: Initial free balances, e.g. {'USDT': 1000}
+    :param clock: Callable returning the current time in ms (wall clock by default)
+    :param commission_rate: Fee deducted from every fill
+    :param history: Number of 1m bars generated per symbol before the series repeats
+    """
+
+    def __init__(self, symbols=None, n_symbols=50, seed=0, latency=0.0, balances=None, clock=None,
+                 commission_rate=0.001, history=20_000):
+        self.symbols = list(symbols) if symbols is not None else [f"SIM{i}/USDT" for i in range(n_symbols)]
+        self.markets = {}
+        self.seed = seed
+        self.latency = latency
+        self.balances = dict(balances or {'USDT': 1000.0})
+        self.clock = clock or (lambda: time.time() * 1000)
+        self.commission_rate = commission_rate
+        self.history = history
+        self.calls = {}
+        self.withheld = []  # symbols kept off the market until list_next()
+        self._paths = {}
+        self._order_ids = itertools.count(1)
+
+    async def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _path(self, symbol):
+        """(per-minute prices, per-minute volumes) of a symbol."""
+        path = self._paths.get(symbol)
+        if path is None:
+            rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())])
+            start = 10 ** rng.uniform(-2, 3)
+            prices = start * np.exp(np.cumsum(rng.normal(0, 0.002, self.history)))
+            path = self._paths[symbol] = prices, rng.uniform(1, 1000, self.history)
+        return path
+
+    def _last(self, symbol, now):
+        return float(self._path(symbol)[0][int(now // 60_000) % self.history])
+
+    def _bars(self, symbol, step, start, stop):
+        """Candles of `step` ms with open times in [start, stop)."""
+        prices, volumes = self._path(symbol)
+        bars = []
+        for ts in range(start, stop, step):
+            minutes = np.arange(ts // 60_000, (ts + step - 1) // 60_000 + 1) % self.history
+            p = prices[minutes]
+            # Sub-minute bars get their share of the minute's volume
+            volume = float(volumes[minutes].sum()) * min(step / 60_000, 1.0)
+            bars.append([ts, float(p[0]), float(p.max()) * 1.001, float(p.min()) * 0.999, float(p[-1]), volume])
+        return bars
+
+    def withhold(self, symbols):
+        """Take symbols off the market; list_next() lists them back one at a time, like new listings."""
+        self.withheld.extend(s for s in symbols if s not in self.withheld)
+        self.symbols = [s for s in self.symbols if s not in self.withheld]
+
+    def list_next(self):
+        """List the next withheld symbol and return it (None when none are left)."""
+        if not self.withheld:
+            return None
+        symbol = self.withheld.pop(0)
+        self.symbols.append(symbol)
+        return symbol
+
+    async def load_markets(self, reload=False):
+        await self._call('load_markets')
+        self.markets.clear()
+        for symbol in self.symbols:
+            base, quote = symbol.split('/')
+            self.markets[symbol] = {'symbol': symbol, 'base': base, 'quote': quote, 'active': True}
+        return self.markets
+
+    async def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=100):
+        await self._call('fetch_ohlcv')
+        if symbol not in self.symbols:
+            raise ValueError(f"Unknown symbol {symbol}")
+        step = timeframe_ms(timeframe)
+        now = int(self.clock()) // step * step
+        start = now - (limit - 1) * step if since is None else -(-int(since) // step) * step
+        return self._bars(symbol, step, start, min(start + limit * step, now + step))
+
+    async def fetch_raw_klines(self, symbol, timeframe='1m', limit=100):
+        """fetch_ohlcv's candles as an unparsed Binance /api/v3/klines body."""
+        bars = await self.fetch_ohlcv(symbol, timeframe, limit=limit)
+        step = timeframe_ms(timeframe)
+        rows = ','.join(f'[{ts},"{o:.8f}","{h:.8f}","{l:.8f}","{c:.8f}","{v:.8f}",{ts + step - 1},"{c * v:.8f}",'
+                        f'0,"0.00000000","0.00000000","0"]' for ts, o, h, l, c, v in bars)
+        return f'[{rows}]'.encode()
+
+    async def fetch_ticker(self, symbol):
+        await self._call('fetch_ticker')
+        return self._ticker(symbol)
+
+    def _ticker(self, symbol):
+        if symbol not in self.symbols:
+            raise ValueError(f"Unknown symbol {symbol}")
+        now = self.clock()
+        last = self._last(symbol, now)
+        return {'symbol': symbol, 'timestamp': int(now), 'last': last, 'close': last,
+                'bid': last * 0.9995, 'ask': last * 1.0005}
+
+    async def fetch_tickers(self, symbols=None):
+        await self._call('fetch_tickers')
+        return {symbol: self._ticker(symbol) for symbol in (symbols or self.symbols)}
+
+    async def fetch_order_book(self, symbol, limit=100):
+        await self._call('fetch_order_book')
+        ticker = self._ticker(symbol)
+        levels = np.arange(limit)
+        sizes = (1000.0 / ticker['last']) * (1 + levels)
+        return {
+            'symbol': symbol,
+            'bids': [[ticker['bid'] * (1 - 0.0005 * i), float(q)] for i, q in zip(levels, sizes)],
+            'asks': [[ticker['ask'] * (1 + 0.0005 * i), float(q)] for i, q in zip(levels, sizes)],
+            'nonce': int(ticker['timestamp']),
+        }
+
+    async def fetch_balance(self):
+        await self._call('fetch_balance')
+        # Like the exchange, report every listed currency, held or not
+        free = {currency: 0.0 for symbol in self.symbols for currency in symbol.split('/')}
+        free.update(self.balances)
+        return {'free': free, 'total': dict(free)}
+
+    async def _fill(self, symbol, side, amount):
+        ticker = self._ticker(symbol)
+        base, quote = symbol.split('/')
+        if side == 'buy':
+            price = ticker['ask']
+            cost = amount * price
+            if self.balances.get(quote, 0.0) < cost:
+                raise ValueError(f"Insufficient {quote} balance for {amount} {base}")
+            self.balances[quote] -= cost
+            self.balances[base] = self.balances.get(base, 0.0) + amount * (1 - self.commission_rate)
+        else:
+            price = ticker['bid']
+            if self.balances.get(base, 0.0) < amount:
+                raise ValueError(f"Insufficient {base} balance to sell {amount}")
+            self.balances[base] -= amount
+            self.balances[quote] = self.balances.get(quote, 0.0) + amount * price * (1 - self.commission_rate)
+        # Buy fees are taken from the received base asset, sell fees from the quote
+        fee = ({'cost': amount * self.commission_rate, 'currency': base} if side == 'buy'
+               else {'cost': amount * price * self.commission_rate, 'currency': quote})
+        return {'id': str(next(self._order_ids)), 'symbol': symbol, 'side': side, 'type': 'market',
+                'amount': amount, 'filled': amount, 'price': price, 'average': price,
+                'timestamp': ticker['timestamp'], 'status': 'closed', 'fee': fee, 'fees': [fee]}
+
+    async def create_market_buy_order(self, symbol, amount, params=None):
+        await self._call('create_market_buy_order')
+        return await self._fill(symbol, 'buy', amount)
+
+    async def create_market_sell_order(self, symbol, amount, params=None):
+        await self._call('create_market_sell_order')
+        return await self._fill(symbol, 'sell', amount)
+
+    async def close(self):
+        pass
+
+
+class RecordedExchange(SimulatedExchange):
+    """
+    Serves candles recorded by src.backfill; higher timeframes are aggregated
+    from the recorded one. The clock defaults to the open time of the last
+    recorded bar, so fetch_ohlcv(limit=n) returns the last n recorded bars.
+
+    :param root: Root directory of the backfill dataset
+    :param timeframe: Recorded timeframe to serve from
+    :param symbols: Symbols to load (default: every recorded symbol)
+    """
+
+    def __init__(self, root, timeframe='1m', symbols=None, clock=None, **kwargs):
+        if symbols is None:
+            symbols = []
+            base = os.path.join(root, timeframe)
+            for name in sorted(os.listdir(base)) if os.path.isdir(base) else []:
+                manifest = os.path.join(base, name, 'manifest.json')
+                if os.path.exists(manifest):
+                    with open(manifest) as f:
+                        symbols.append(json.load(f)['symbol'])
+        self.step = timeframe_ms(timeframe)
+        self.data = {symbol: load_ohlcv(root, symbol, timeframe) for symbol in symbols}
+        self.data = {symbol: columns for symbol, columns in self.data.items() if len(columns['timestamp'])}
+        if clock is None:
+            end = max((int(c['timestamp'][-1]) for c in self.data.values()), default=0)
+            clock = lambda: end
+        super().__init__(symbols=list(self.data), clock=clock, **kwargs)
+
+    def _last(self, symbol, now):
+        columns = self.data[symbol]
+        i = max(int(np.searchsorted(columns['timestamp'], now, 'right')) - 1, 0)
+        return float(columns['close'][i])
+
+    def _bars(self, symbol, step, start, stop):
+        if step % self.step:
+            raise ValueError(f"Cannot serve {step} ms candles from {self.step} ms recordings")
+        columns = self.data[symbol]
+        ts = columns['timestamp']
+        lo, hi = np.searchsorted(ts, start), np.searchsorted(ts, stop)
+        if lo == hi:
+            return []
+        ts = ts[lo:hi]
+        groups = ts // step
+        first = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        last = np.r_[first[1:], len(ts)] - 1
+        rows = np.column_stack([
+            groups[first] * step,
+            columns['open'][lo:hi][first],
+            np.maximum.reduceat(columns['high'][lo:hi], first),
+            np.minimum.reduceat(columns['low'][lo:hi], first),
+            columns['close'][lo:hi][last],
+            np.add.reduceat(columns['volume'][lo:hi], first),
+        ]).tolist()
+        return [[int(row[0])] + row[1:] for row in rows]
+
+
+class FaultyExchange:
+    """
+    Injects latency spikes, hangs and errors into another exchange's read calls,
+    to exercise timeouts, hedging and circuit breakers locally.
+
+    :param slow_rate: Share of calls delayed by `slow_delay` seconds
+    :param hang_rate: Share of calls that never return
+    :param error_rate: Share of calls that raise ConnectionError
+    :param failing_symbols: Symbols whose calls always raise (ValueError, like an unknown symbol)
+    """
+
+    READ_METHODS = ('load_markets', 'fetch_balance', 'fetch_ticker', 'fetch_tickers', 'fetch_ohlcv',
+                    'fetch_raw_klines', 'fetch_order_book', 'fetch_trades')
+
+    def __init__(self, exchange, slow_rate=0.05, slow_delay=1.0, hang_rate=0.01, error_rate=0.02,
+                 failing_symbols=(), seed=0):
+        self.exchange = exchange
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.hang_rate = hang_rate
+        self.error_rate = error_rate
+        self.failing_symbols = set(failing_symbols)
+        self.rng = np.random.default_rng(seed)
+        self.injected = {'slow': 0, 'hang': 0, 'error': 0}
+
+    def __getattr__(self, name):
+        attr = getattr(self.exchange, name)
+        if name not in self.READ_METHODS:
+            return attr
+
+        async def faulty(*args, **kwargs):
+            # fetch_tickers takes a list of symbols; only single-symbol calls fail by symbol
+            if args and isinstance(args[0], str) and args[0] in self.failing_symbols:
+                self.injected['error'] += 1
+                raise ValueError(f"Injected failure for {args[0]}")
+            if name != 'load_markets':
+                roll = self.rng.random()
+                if roll < self.hang_rate:
+                    self.injected['hang'] += 1
+                    await asyncio.Event().wait()
+                elif roll < self.hang_rate + self.error_rate:
+                    self.injected['error'] += 1
+                    raise ConnectionError(f"Injected {name} error")
+                elif roll < self.hang_rate + self.error_rate + self.slow_rate:
+                    self.injected['slow'] += 1
+                    await asyncio.sleep(self.slow_delay)
+            return await attr(*args, **kwargs)
+
+        return faulty
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class StateJournal:
+    """
+    Append-only journal of bot state (positions, entry prices, listing snapshots,
+    order ids) for fast crash recovery.
+
+    State is a set of namespaces, each a dict of JSON-serializable values. Every
+    change is appended as one JSON line to `<path>.log`; after `compact_every`
+    appends the full state is written atomically to `<path>.snapshot` and the
+    log is truncated. Loading reads the snapshot and replays the log, ignoring a
+    partially written last line, so a restarted bot resumes without API calls.
+
+    :param path: Base path of the journal files
+    :param compact_every: Appends between compactions
+    :param sync: fsync after every append (survives power loss, costs latency)
+    """
+
+    def __init__(self, path, compact_every=1000, sync=False):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.log_path = f"{path}.log"
+        self.compact_every = compact_every
+        self.sync = sync
+        self.state = {}
+        self.appends = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._log = open(self.log_path, 'a')
+
+    def _load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                self.state = json.load(f)
+        if not os.path.exists(self.log_path):
+            return
+        good = 0
+        with open(self.log_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                self.appends += 1
+                good += len(line)
+            torn = f.seek(0, os.SEEK_END) > good
+        if torn:
+            # Drop the partially written last record so new appends start on a clean line
+            logger.warning("Discarding a truncated record at the end of the state journal")
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(good)
+
+    def _apply(self, record):
+        namespace = self.state.setdefault(record['ns'], {})
+        if record['op'] == 'set':
+            namespace[record['key']] = record['value']
+        elif record['op'] == 'del':
+            namespace.pop(record['key'], None)
+        elif record['op'] == 'clear':
+            namespace.clear()
+
+    def _append(self, record):
+        self._apply(record)
+        self._log.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._log.flush()
+        if self.sync:
+            os.fsync(self._log.fileno())
+        self.appends += 1
+        if self.appends >= self.compact_every:
+            self.compact()
+
+    def get(self, namespace, key, default=None):
+        return self.state.get(namespace, {}).get(key, default)
+
+    def items(self, namespace):
+        return list(self.state.get(namespace, {}).items())
+
+    def set(self, namespace, key, value):
+        self._append({'op': 'set', 'ns': namespace, 'key': key, 'value': value})
+
+    def delete(self, namespace, key):
+        if key in self.state.get(namespace, {}):
+            self._append({'op': 'del', 'ns': namespace, 'key': key})
+
+    def clear(self, namespace):
+        if self.state.get(namespace):
+            self._append({'op': 'clear', 'ns': namespace})
+
+    def compact(self):
+        """Write the full state as a snapshot and start an empty log."""
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self._log.close()
+        self._log = open(self.log_path, 'w')
+        self.appends = 0
+
+    def close(self):
+        self._log.close()
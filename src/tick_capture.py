@@ -0,0 +1,510 @@
+"""
+Capture and replay of raw trades and book tickers.
+
+The capture service subscribes to Binance's combined websocket streams
+(<symbol>@trade, <symbol>@bookTicker) and appends every event to compressed,
+chunked binary files, one per stream, symbol and UTC day:
+
+    <root>/<stream>/<BASE_QUOTE>/<YYYY-MM-DD>.tck
+
+A file is a sequence of chunks: a fixed header (magic, record count, payload
+length, CRC32, first timestamp) followed by a zlib payload holding the chunk's
+columns back to back, ids and timestamps delta-encoded and every column
+byte-shuffled so the compressor sees runs of similar bytes. A torn chunk at the
+end of a file (crash mid-write) is dropped on read and truncated when the
+writer reopens the file.
+
+TickReplay merges the captured streams of many symbols in timestamp order and
+paces them at a multiple of real time (or as fast as possible), handing each
+event to on_trade / on_book_ticker callbacks as ccxt-style trade and ticker
+dicts. TapeExchange is such a callback that also answers fetch_ticker,
+fetch_tickers, fetch_trades and fetch_order_book from the replayed tape, so the
+bots' exchange calls see the captured market:
+
+    python -m src.tick_capture capture BTC/USDT ETH/USDT --out ticks
+    python -m src.tick_capture replay BTC/USDT ETH/USDT --out ticks --speed 200
+"""
+import argparse
+import asyncio
+import datetime
+import heapq
+import inspect
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+
+from src.backfill import DAY_MS, symbol_dir
+
+logger = logging.getLogger(__name__)
+
+BINANCE_WS = 'wss://stream.binance.com:9443/stream'
+
+STREAMS = {
+    'trade': np.dtype([('timestamp', '<i8'), ('id', '<i8'), ('price', '<f8'), ('amount', '<f8'),
+                       ('buyer_maker', 'u1')]),
+    # Spot book tickers carry no event time; the capture's receive time is stored instead
+    'bookTicker': np.dtype([('timestamp', '<i8'), ('update_id', '<i8'), ('bid', '<f8'), ('bid_qty', '<f8'),
+                            ('ask', '<f8'), ('ask_qty', '<f8')]),
+}
+_DELTA = ('timestamp', 'id', 'update_id')
+_MAGIC = b'TCK1'
+_CHUNK = struct.Struct('<4sIIIq')   # magic, records, payload bytes, crc32, first timestamp
+
+
+def _day_name(day):
+    return datetime.datetime.fromtimestamp(day * DAY_MS / 1000, tz=datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def tick_path(root, stream, symbol, day):
+    return os.path.join(symbol_dir(root, symbol, stream), f"{_day_name(day)}.tck")
+
+
+def encode_chunk(records, level=6):
+    """Header + compressed payload of a structured array of one stream's records."""
+    columns = []
+    for name in records.dtype.names:
+        column = np.ascontiguousarray(records[name])
+        if name in _DELTA:
+            column = np.diff(column, prepend=column.dtype.type(0))
+        columns.append(column.view(np.uint8).reshape(len(column), column.itemsize).T.tobytes())
+    payload = zlib.compress(b''.join(columns), level)
+    first = int(records['timestamp'][0]) if len(records) else 0
+    return _CHUNK.pack(_MAGIC, len(records), len(payload), zlib.crc32(payload), first) + payload
+
+
+def decode_chunk(payload, dtype, count):
+    raw = zlib.decompress(payload)
+    records = np.empty(count, dtype)
+    offset = 0
+    for name in dtype.names:
+        field = dtype[name]
+        size = field.itemsize * count
+        shuffled = np.frombuffer(raw, np.uint8, size, offset).reshape(field.itemsize, count)
+        column = np.ascontiguousarray(shuffled.T).view(field).ravel()
+        records[name] = np.cumsum(column) if name in _DELTA else column
+        offset += size
+    return records
+
+
+def _scan_chunks(data):
+    """Yield (offset, header fields) of every complete, intact chunk in `data`."""
+    offset = 0
+    while offset + _CHUNK.size <= len(data):
+        magic, count, length, crc, first = _CHUNK.unpack_from(data, offset)
+        end = offset + _CHUNK.size + length
+        if magic != _MAGIC or end > len(data) or zlib.crc32(data[offset + _CHUNK.size:end]) != crc:
+            return
+        yield offset, count, length
+        offset = end
+
+
+def read_chunks(path, stream):
+    """Yield the records of every intact chunk of a tick file as structured arrays."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = 0
+    for offset, count, length in _scan_chunks(data):
+        start = offset + _CHUNK.size
+        end = start + length
+        yield decode_chunk(data[start:end], STREAMS[stream], count)
+    if end < len(data):
+        logger.warning("Ignoring %s torn bytes at the end of %s", len(data) - end, path)
+
+
+def tick_files(root, stream, symbol, start=None, end=None):
+    path = symbol_dir(root, symbol, stream)
+    try:
+        names = sorted(n for n in os.listdir(path) if n.endswith('.tck'))
+    except FileNotFoundError:
+        return []
+    if start is not None:
+        names = [n for n in names if n[:-4] >= _day_name(start // DAY_MS)]
+    if end is not None:
+        names = [n for n in names if n[:-4] <= _day_name((end - 1) // DAY_MS)]
+    return [os.path.join(path, n) for n in names]
+
+
+def iter_ticks(root, stream, symbol, start=None, end=None):
+    """Yield chunk arrays of one symbol's stream within [start, end) ms, in file order."""
+    for path in tick_files(root, stream, symbol, start, end):
+        for records in read_chunks(path, stream):
+            ts = records['timestamp']
+            if (start is not None and ts[-1] < start) or (end is not None and ts[0] >= end):
+                continue
+            lo = np.searchsorted(ts, start) if start is not None else 0
+            hi = np.searchsorted(ts, end) if end is not None else len(ts)
+            yield records[lo:hi]
+
+
+def load_ticks(root, stream, symbol, start=None, end=None):
+    chunks = list(iter_ticks(root, stream, symbol, start, end))
+    return np.concatenate(chunks) if chunks else np.empty(0, STREAMS[stream])
+
+
+class TickWriter:
+    """
+    Buffers one symbol's stream and appends it to the day's file in chunks.
+
+    :param chunk_records: Records per chunk
+    :param flush_interval: Seconds after which a partial chunk is written anyway
+    """
+
+    def __init__(self, root, stream, symbol, chunk_records=4096, flush_interval=5.0, level=6):
+        self.root = root
+        self.stream = stream
+        self.symbol = symbol
+        self.dtype = STREAMS[stream]
+        self.chunk_records = chunk_records
+        self.flush_interval = flush_interval
+        self.level = level
+        self.rows = []
+        self.day = None
+        self.file = None
+        self.records = 0
+        self.bytes = 0
+        self._flushed = time.monotonic()
+
+    def _open(self, day):
+        path = tick_path(self.root, self.stream, self.symbol, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            valid = 0
+            for offset, count, length in _scan_chunks(data):
+                valid = offset + _CHUNK.size + length
+            if valid < len(data):
+                logger.warning("Truncating %s torn bytes at the end of %s", len(data) - valid, path)
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+        self.file = open(path, 'ab')
+        self.day = day
+
+    def append(self, row):
+        """Add one record (a tuple in the stream's column order)."""
+        day = row[0] // DAY_MS
+        if day != self.day:
+            self.flush()
+            if self.file is not None:
+                self.file.close()
+            self._open(day)
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_records or time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed = time.monotonic()
+        if not self.rows:
+            return
+        chunk = encode_chunk(np.array(self.rows, dtype=self.dtype), self.level)
+        self.file.write(chunk)
+        self.file.flush()
+        self.records += len(self.rows)
+        self.bytes += len(chunk)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def stream_name(symbol):
+    """'BTC/USDT' -> 'btcusdt', Binance's websocket stream prefix."""
+    return symbol.replace('/', '').lower()
+
+
+def parse_event(message, received_ms):
+    """(stream, stream symbol, record) of a combined-stream message, or None for other payloads."""
+    data = message.get('data', message)
+    if data.get('e') == 'trade':
+        return 'trade', data['s'].lower(), (int(data['T']), int(data['t']), float(data['p']), float(data['q']),
+                                            int(bool(data['m'])))
+    if 'u' in data and 'b' in data and 'a' in data:
+        return 'bookTicker', data['s'].lower(), (received_ms, int(data['u']), float(data['b']), float(data['B']),
+                                                 float(data['a']), float(data['A']))
+    return None
+
+
+async def _subscribe(ws, subscriptions, symbols, streams, add_writers):
+    """Add the symbols put on `subscriptions` to the open connection (and to `symbols`, for reconnects)."""
+    request_id = 0
+    while True:
+        symbol = await subscriptions.get()
+        name = stream_name(symbol)
+        if name in symbols:
+            continue
+        symbols[name] = symbol
+        add_writers(name, symbol)
+        request_id += 1
+        await ws.send_json({'method': 'SUBSCRIBE', 'params': [f"{name}@{stream}" for stream in streams],
+                            'id': request_id})
+        logger.info("Subscribed to %s streams of %s", len(streams), symbol)
+
+
+async def capture(symbols, root, streams=tuple(STREAMS), url=BINANCE_WS, duration=None, chunk_records=4096,
+                  flush_interval=5.0, reconnect_delay=1.0, max_reconnect_delay=60.0, on_trade=None,
+                  on_book_ticker=None, subscriptions=None):
+    """
+    Record `streams` of `symbols` under `root` until cancelled (or for `duration` seconds).
+    Reconnects with exponential backoff; Binance closes every connection after 24 hours.
+    Live events also go to the on_trade / on_book_ticker callbacks in TickReplay's form;
+    with `root` None nothing is written. Symbols put on the `subscriptions` queue are
+    added to the running connection. Returns {(stream, symbol): records written}.
+    """
+    import aiohttp  # installed with ccxt
+
+    symbols = {stream_name(symbol): symbol for symbol in symbols}
+    writers = {}
+
+    def add_writers(name, symbol):
+        if root is not None:
+            for stream in streams:
+                writers[(stream, name)] = TickWriter(root, stream, symbol, chunk_records, flush_interval)
+
+    for name, symbol in symbols.items():
+        add_writers(name, symbol)
+    callbacks = {'trade': (on_trade, trade_dict), 'bookTicker': (on_book_ticker, ticker_dict)}
+    deadline = time.monotonic() + duration if duration else None
+    delay = reconnect_delay
+    subscriber = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            while deadline is None or time.monotonic() < deadline:
+                # Rebuilt on every connect, so symbols subscribed since are included
+                params = '/'.join(f"{name}@{stream}" for name in symbols for stream in streams)
+                try:
+                    async with session.ws_connect(f"{url}?streams={params}", heartbeat=30) as ws:
+                        logger.info("Capturing %s streams of %s symbols", len(symbols) * len(streams), len(symbols))
+                        delay = reconnect_delay
+                        if subscriptions is not None:
+                            subscriber = asyncio.create_task(_subscribe(ws, subscriptions, symbols, streams,
+                                                                        add_writers))
+                        while deadline is None or time.monotonic() < deadline:
+                            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                            try:
+                                msg = await ws.receive(timeout=timeout)
+                            except asyncio.TimeoutError:
+                                break
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                    break
+                                continue
+                            event = parse_event(json.loads(msg.data), int(time.time() * 1000))
+                            if event is None or event[1] not in symbols:
+                                continue
+                            stream, name, row = event
+                            writer = writers.get((stream, name))
+                            if writer is not None:
+                                writer.append(row)
+                            callback, as_dict = callbacks[stream]
+                            if callback is not None:
+                                result = callback(symbols[name], as_dict(symbols[name], row))
+                                if inspect.isawaitable(result):
+                                    await result
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error("Capture connection failed: %s", e)
+                finally:
+                    if subscriber is not None:
+                        subscriber.cancel()
+                        subscriber = None
+                if deadline is None or time.monotonic() < deadline:
+                    logger.info("Reconnecting in %.0fs", delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, max_reconnect_delay)
+    finally:
+        for writer in writers.values():
+            writer.close()
+        total = sum(w.bytes for w in writers.values())
+        logger.info("Captured %s records in %.1f MB", sum(w.records for w in writers.values()), total / 1e6)
+    return {key: writer.records for key, writer in writers.items()}
+
+
+def trade_dict(symbol, row):
+    timestamp, trade_id, price, amount, buyer_maker = row
+    return {'symbol': symbol, 'timestamp': timestamp, 'id': str(trade_id), 'price': price, 'amount': amount,
+            'cost': price * amount, 'side': 'sell' if buyer_maker else 'buy'}
+
+
+def ticker_dict(symbol, row):
+    timestamp, _, bid, bid_qty, ask, ask_qty = row
+    return {'symbol': symbol, 'timestamp': timestamp, 'bid': bid, 'bidVolume': bid_qty, 'ask': ask,
+            'askVolume': ask_qty}
+
+
+class TickReplay:
+    """
+    :param root: Capture root directory
+    :param symbols: Symbols to replay, merged in timestamp order
+    :param speed: Multiple of real time (200 replays an hour in 18 s); None replays as fast as possible
+    :param start: First timestamp (ms) to replay
+    :param end: Timestamp (ms) to stop before
+    """
+
+    def __init__(self, root, symbols, streams=tuple(STREAMS), speed=100.0, start=None, end=None, min_sleep=0.002):
+        self.root = root
+        self.symbols = list(symbols)
+        self.streams = tuple(streams)
+        self.speed = speed
+        self.start = start
+        self.end = end
+        self.min_sleep = min_sleep
+        self.now = None
+        self.events = 0
+
+    def clock(self):
+        """Timestamp (ms) of the last replayed event; pass as an exchange stand-in's clock."""
+        return self.now
+
+    def _source(self, order, stream, symbol):
+        for records in iter_ticks(self.root, stream, symbol, self.start, self.end):
+            for row in records.tolist():
+                yield row[0], order, stream, symbol, row
+
+    def merged(self):
+        """Yield (timestamp, stream, symbol, row) over every selected stream in timestamp order."""
+        sources = [self._source(i, stream, symbol)
+                   for i, (stream, symbol) in enumerate((s, y) for y in self.symbols for s in self.streams)]
+        for timestamp, _, stream, symbol, row in heapq.merge(*sources):
+            yield timestamp, stream, symbol, row
+
+    async def run(self, on_trade=None, on_book_ticker=None):
+        """
+        Replay into the callbacks, which receive (symbol, trade) and (symbol, ticker) dicts and may be
+        coroutines. Returns the number of events replayed.
+        """
+        loop = asyncio.get_running_loop()
+        wall_start = first = None
+        for timestamp, stream, symbol, row in self.merged():
+            self.now = timestamp
+            if self.speed:
+                if first is None:
+                    wall_start, first = loop.time(), timestamp
+                lag = wall_start + (timestamp - first) / 1000 / self.speed - loop.time()
+                # Sleeping per event would cap the rate at the loop's timer resolution; wait only for real gaps
+                if lag >= self.min_sleep:
+                    await asyncio.sleep(lag)
+            elif self.events % 1000 == 0:
+                await asyncio.sleep(0)
+            if stream == 'trade':
+                result = on_trade(symbol, trade_dict(symbol, row)) if on_trade else None
+            else:
+                result = on_book_ticker(symbol, ticker_dict(symbol, row)) if on_book_ticker else None
+            if inspect.isawaitable(result):
+                await result
+            self.events += 1
+        return self.events
+
+
+class TapeExchange:
+    """
+    Answers the bots' market-data calls from a replayed tape; everything else
+    (candles, balances, orders) goes to `exchange` when one is given.
+
+        tape = TapeExchange(RecordedExchange('data', clock=replay.clock))
+        await replay.run(tape.on_trade, tape.on_book_ticker)
+
+    :param max_trades: Recent trades kept per symbol for fetch_trades()
+    """
+
+    def __init__(self, exchange=None, max_trades=1000):
+        self.exchange = exchange
+        self.max_trades = max_trades
+        self.tickers = {}
+        self.trades = {}
+
+    def __getattr__(self, name):
+        if self.exchange is None:
+            raise AttributeError(name)
+        return getattr(self.exchange, name)
+
+    def on_trade(self, symbol, trade):
+        trades = self.trades.get(symbol)
+        if trades is None:
+            trades = self.trades[symbol] = deque(maxlen=self.max_trades)
+        trades.append(trade)
+        ticker = self.tickers.setdefault(symbol, {'symbol': symbol, 'bid': None, 'ask': None})
+        ticker['last'] = ticker['close'] = trade['price']
+        ticker['timestamp'] = trade['timestamp']
+
+    def on_book_ticker(self, symbol, book_ticker):
+        ticker = self.tickers.setdefault(symbol, {'last': None, 'close': None})
+        ticker.update(book_ticker)
+        if ticker['last'] is None:
+            ticker['last'] = ticker['close'] = (book_ticker['bid'] + book_ticker['ask']) / 2
+
+    async def fetch_ticker(self, symbol, params=None):
+        ticker = self.tickers.get(symbol)
+        if ticker is None:
+            if self.exchange is not None:
+                return await self.exchange.fetch_ticker(symbol)
+            raise ValueError(f"No replayed ticks for {symbol} yet")
+        return dict(ticker)
+
+    async def fetch_tickers(self, symbols=None, params=None):
+        symbols = symbols or list(self.tickers)
+        return {symbol: await self.fetch_ticker(symbol) for symbol in symbols}
+
+    async def fetch_trades(self, symbol, since=None, limit=None, params=None):
+        trades = list(self.trades.get(symbol, ()))
+        if since is not None:
+            trades = [t for t in trades if t['timestamp'] >= since]
+        return trades[-limit:] if limit else trades
+
+    async def fetch_order_book(self, symbol, limit=None, params=None):
+        ticker = self.tickers.get(symbol)
+        if ticker is None or ticker.get('bid') is None:
+            if self.exchange is not None:
+                return await self.exchange.fetch_order_book(symbol, limit)
+            raise ValueError(f"No replayed book ticker for {symbol} yet")
+        return {'symbol': symbol, 'bids': [[ticker['bid'], ticker['bidVolume']]],
+                'asks': [[ticker['ask'], ticker['askVolume']]], 'nonce': ticker['timestamp']}
+
+    async def close(self):
+        if self.exchange is not None:
+            await self.exchange.close()
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    day = datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+    return int(day.timestamp() * 1000)
+
+
+async def _replay_main(args):
+    replay = TickReplay(args.out, args.symbols, speed=args.speed or None, start=_parse_time(args.start),
+                        end=_parse_time(args.end))
+    tape = TapeExchange()
+    start = time.perf_counter()
+    events = await replay.run(tape.on_trade, tape.on_book_ticker)
+    seconds = time.perf_counter() - start
+    logger.info("Replayed %s events in %.2fs (%.0f/s)", events, seconds, events / max(seconds, 1e-9))
+    for symbol in args.symbols:
+        if symbol in tape.tickers:
+            logger.info("%s: %s", symbol, await tape.fetch_ticker(symbol))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Capture or replay raw trades and book tickers")
+    parser.add_argument('mode', choices=('capture', 'replay'))
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--out', default='ticks', help="Capture root directory")
+    parser.add_argument('--streams', nargs='+', default=list(STREAMS), choices=list(STREAMS))
+    parser.add_argument('--duration', type=float, help="Seconds to capture (default: until interrupted)")
+    parser.add_argument('--speed', type=float, default=100.0, help="Replay speed as a multiple of real time (0: unpaced)")
+    parser.add_argument('--start', help="Replay from this UTC time, e.g. 2024-05-01T12:00")
+    parser.add_argument('--end', help="Replay until this UTC time")
+    args = parser.parse_args()
+    if args.mode == 'capture':
+        asyncio.run(capture(args.symbols, args.out, args.streams, duration=args.duration))
+    else:
+        asyncio.run(_replay_main(args))
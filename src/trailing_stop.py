@@ -0,0 +1,195 @@
+import bisect
+import itertools
+import logging
+from dataclasses import dataclass
+
+from src.log_pipeline import TRADE_EVENT
+
+logger = logging.getLogger(__name__)
+
+
+def _insufficient_balance(error):
+    """Whether an order error means the balance to sell is gone (ccxt InsufficientFunds or a simulator's message)."""
+    return any(cls.__name__ == 'InsufficientFunds' for cls in type(error).__mro__) or \
+        'insufficient' in str(error).lower()
+
+
+@dataclass
+class Position:
+    position_id: int
+    symbol: str
+    amount: float
+    entry_price: float
+    trail_percentage: float
+    high_water_mark: float
+
+    @property
+    def stop_price(self):
+        return self.high_water_mark * (1 - self.trail_percentage / 100)
+
+
+class _StopBook:
+    """
+    Positions of one symbol sharing one trail percentage.
+
+    Positions are grouped into levels by high-water mark and the level marks are
+    kept sorted. A new high merges every level below it into a single level
+    (each level is merged at most once), and a stop can only trigger on the
+    highest levels, so both happen at the ends of the sorted list.
+    """
+
+    def __init__(self, trail_percentage):
+        self.factor = 1 - trail_percentage / 100
+        self.marks = []   # sorted high-water marks
+        self.levels = {}  # high-water mark -> {position_id: Position}
+
+    def __len__(self):
+        return len(self.marks)
+
+    def add(self, position):
+        level = self.levels.get(position.high_water_mark)
+        if level is None:
+            bisect.insort(self.marks, position.high_water_mark)
+            level = self.levels[position.high_water_mark] = {}
+        level[position.position_id] = position
+
+    def remove(self, position):
+        level = self.levels.get(position.high_water_mark)
+        if level is None or level.pop(position.position_id, None) is None:
+            return False
+        if not level:
+            del self.levels[position.high_water_mark]
+            del self.marks[bisect.bisect_left(self.marks, position.high_water_mark)]
+        return True
+
+    def update(self, price):
+        # Raise every high-water mark below the new price to the price.
+        cut = bisect.bisect_left(self.marks, price)
+        if cut:
+            merged = self.levels.get(price)
+            if merged is None:
+                merged = self.levels[price] = {}
+                self.marks.insert(cut, price)
+            for mark in self.marks[:cut]:
+                for position in self.levels.pop(mark).values():
+                    position.high_water_mark = price
+                    merged[position.position_id] = position
+            del self.marks[:cut]
+
+        # A level triggers once price falls to its stop; only the top levels can.
+        triggered = []
+        cut = bisect.bisect_left(self.marks, price / self.factor) if self.factor > 0 else 0
+        for mark in self.marks[cut:]:
+            triggered.extend(self.levels.pop(mark).values())
+        del self.marks[cut:]
+        return triggered
+
+
+class TrailingStopEngine:
+    """
+    Tracks trailing stop-losses for many open long positions.
+
+    Each price tick costs O(log n) in the number of open positions of that symbol
+    (amortized, plus the positions it triggers). Triggered positions are sold
+    through place_order(symbol, 'sell', amount), which returns the order or
+    None, or raises to report why the sell failed.
+
+    :param trail_percentage: Default trailing distance in percent below the high-water mark
+    :param place_order: Coroutine function used to close triggered positions
+    """
+
+    def __init__(self, trail_percentage, place_order=None):
+        self.trail_percentage = trail_percentage
+        self.place_order = place_order
+        self._books = {}      # symbol -> {trail_percentage: _StopBook}
+        self._positions = {}  # position_id -> Position
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def open_position(self, symbol, amount, entry_price, trail_percentage=None, high_water_mark=None):
+        if trail_percentage is None:
+            trail_percentage = self.trail_percentage
+        if not 0 < trail_percentage < 100:
+            raise ValueError("trail_percentage must be between 0 and 100")
+        high_water_mark = entry_price if high_water_mark is None else max(high_water_mark, entry_price)
+        position = Position(next(self._ids), symbol, amount, entry_price, trail_percentage, high_water_mark)
+        self._track(position)
+        return position
+
+    def close_position(self, position_id):
+        position = self._positions.pop(position_id, None)
+        if position is None:
+            return None
+        books = self._books[position.symbol]
+        book = books[position.trail_percentage]
+        book.remove(position)
+        if not book:
+            del books[position.trail_percentage]
+            if not books:
+                del self._books[position.symbol]
+        return position
+
+    def positions(self, symbol=None):
+        if symbol is None:
+            return list(self._positions.values())
+        return [p for p in self._positions.values() if p.symbol == symbol]
+
+    def update(self, symbol, price):
+        """Apply a price tick and return the positions whose stops were hit (and drop them)."""
+        books = self._books.get(symbol)
+        if not books or price is None:
+            return []
+        triggered = []
+        for trail_percentage, book in list(books.items()):
+            hit = book.update(price)
+            if hit:
+                triggered.extend(hit)
+            if not book:
+                del books[trail_percentage]
+        if not books:
+            del self._books[symbol]
+        for position in triggered:
+            del self._positions[position.position_id]
+        return triggered
+
+    async def on_price(self, symbol, price):
+        """
+        Apply a price tick, sell every triggered position at market and return
+        (position, order) pairs. A position whose sell the exchange rejects for
+        insufficient balance is dropped and returned with order None; other
+        failures keep it tracked for the next tick.
+        """
+        triggered = self.update(symbol, price)
+        closed = []
+        for position in triggered:
+            logger.info("Trailing stop hit for %s at %s (high %s, stop %.8g, amount %s)",
+                        symbol, price, position.high_water_mark, position.stop_price, position.amount,
+                        extra=TRADE_EVENT)
+            if self.place_order is None:
+                continue
+            try:
+                order = await self.place_order(symbol, 'sell', position.amount)
+            except Exception as e:
+                if _insufficient_balance(e):
+                    # The balance is gone (sold elsewhere); re-arming would retry on every tick
+                    logger.warning("Dropping %s position %s: %s", symbol, position.position_id, e)
+                    closed.append((position, None))
+                    continue
+                logger.error("Error selling stopped %s position %s: %s", symbol, position.position_id, e)
+                order = None
+            if order is None:
+                # Keep tracking the position if the exit order failed.
+                self._track(position)
+            else:
+                closed.append((position, order))
+        return closed
+
+    def _track(self, position):
+        books = self._books.setdefault(position.symbol, {})
+        book = books.get(position.trail_percentage)
+        if book is None:
+            book = books[position.trail_percentage] = _StopBook(position.trail_percentage)
+        book.add(position)
+        self._positions[position.position_id] = position
@@ -0,0 +1,298 @@
+"""
+Trigger prices for the buy/sell rules of evaluate_trading_signals.
+
+Every rule is a monotone function of the forming bar's close p (its high and
+low stretch to include p): close vs EMA/WMA/Bollinger bands, TRIX sign, RSI
+30/70, MACD vs signal, CCI +-100 and STOCH 20/80. So once per bar each rule
+reduces to a threshold price, and "all buy rules hold" to a price interval.
+EMA, WMA, TRIX, MACD, RSI and the bands are solved in closed form from the
+previous bar's indicator state; CCI and STOCH are bisected on their last
+window only.
+
+SignalGate keeps the intervals per symbol, so a tick only needs two float
+comparisons to know whether a full indicator evaluation could find a signal.
+"""
+import math
+
+import numpy as np
+
+from src.indicator_backend import _macd_lines, _wilder_averages, np_ema
+from src.rolling import rolling_max, rolling_min
+
+_EMPTY = (math.inf, -math.inf)
+_ALL = (0.0, math.inf)
+
+
+def _above(threshold):
+    """Prices p > threshold (empty when the indicator is not defined yet)."""
+    return _EMPTY if math.isnan(threshold) else (threshold, math.inf)
+
+
+def _below(threshold):
+    return _EMPTY if math.isnan(threshold) else (0.0, threshold)
+
+
+def _solve(f, level, guess, iterations=100):
+    """
+    Crossing price T of a non-decreasing f: f(p) < level below T and f(p) >= level above.
+    Returns inf when f stays below level and 0.0 when it is at or above level for all p > 0.
+    """
+    if not guess > 0:
+        guess = 1.0
+    hi = guess
+    for _ in range(64):
+        if f(hi) >= level:
+            break
+        hi *= 2.0
+    else:
+        return math.inf
+    lo = min(guess, hi)
+    for _ in range(64):
+        if f(lo) < level:
+            break
+        lo *= 0.5
+    else:
+        return 0.0
+    for _ in range(iterations):
+        mid = 0.5 * (lo + hi)
+        if f(mid) < level:
+            lo = mid
+        else:
+            hi = mid
+        if hi - lo <= 1e-13 * hi:
+            break
+    return 0.5 * (lo + hi)
+
+
+class SignalTriggers:
+    """
+    Per-bar trigger prices of the evaluate_trading_signals rules (main.py parameters by default).
+
+    :param high, low, close: Bars oldest first; the last one is the forming bar,
+        whose close is replaced by the tick price and whose high/low are its range so far
+    :param tolerance: Relative widening of the intervals, so rounding never hides a signal
+    """
+
+    def __init__(self, high, low, close, ema_period=14, wma_period=14, bb_period=20, bb_dev=2.0,
+                 trix_period=15, rsi_period=14, rsi_levels=(30.0, 70.0), macd_periods=(12, 26, 9),
+                 cci_period=14, cci_level=100.0, stoch_periods=(14, 3, 3), stoch_levels=(20.0, 80.0),
+                 tolerance=1e-9):
+        high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+        self.bar_high = float(high[-1])
+        self.bar_low = float(low[-1])
+        self.reference = float(close[-1])
+        self.tolerance = tolerance
+        self.cci_period = cci_period
+        self.cci_level = cci_level
+        self.stoch_periods = stoch_periods
+        self.stoch_levels = stoch_levels
+        self._high, self._low, self._close = high[:-1], low[:-1], close[:-1]
+
+        # (buy interval, sell interval) per rule; the range-dependent ones are added by _range_rules()
+        self._fixed = {
+            'ema': self._ema_rule(ema_period),
+            'wma': self._wma_rule(wma_period),
+            'trix': self._trix_rule(trix_period),
+            'bands': self._bands_rule(bb_period, bb_dev),
+            'rsi': self._rsi_rule(rsi_period, *rsi_levels),
+            'macd': self._macd_rule(*macd_periods),
+        }
+        self._typical = (self._high + self._low + self._close) / 3.0
+        self._fastk = self._fastk_history()
+        self.rules = {}
+        self.buy = self.sell = _EMPTY
+        self._range_rules()
+
+    # Closed-form rules -----------------------------------------------------
+
+    def _ema_rule(self, p):
+        # EMA_t = a * p + (1 - a) * EMA_t-1, so close > EMA_t  <=>  p > EMA_t-1
+        prev = np_ema(self._close, p)[-1] if len(self._close) >= p else math.nan
+        return _above(prev), _below(prev)
+
+    def _wma_rule(self, p):
+        if len(self._close) < p - 1 or p < 2:
+            return _EMPTY, _EMPTY
+        # WMA_t = (p * close + S) / D; close > WMA_t  <=>  close * (D - p) > S
+        weights = np.arange(1, p, dtype=np.float64)
+        others = self._close[len(self._close) - (p - 1):] @ weights
+        threshold = others / (p * (p + 1) / 2 - p)
+        return _above(threshold), _below(threshold)
+
+    def _trix_rule(self, p):
+        if len(self._close) < 3 * (p - 1) + 1:
+            return _EMPTY, _EMPTY
+        e1 = np_ema(self._close, p)[p - 1:]
+        e2 = np_ema(e1, p)[p - 1:]
+        e3 = np_ema(e2, p)[p - 1:]
+        a = 2.0 / (p + 1)
+        # TRIX > 0  <=>  e3_t > e3_t-1, unrolled through the three EMA steps
+        threshold = ((e3[-1] - (1 - a) * e2[-1]) / a - (1 - a) * e1[-1]) / a
+        return _above(threshold), _below(threshold)
+
+    def _bands_rule(self, p, k):
+        if len(self._close) < p - 1:
+            return _EMPTY, _EMPTY
+        others = self._close[len(self._close) - (p - 1):]
+        mean = others.mean()
+        m2 = ((others - mean) ** 2).sum()
+        if p - 1 <= k * k:
+            return _EMPTY, _EMPTY  # the newest close can never be k population deviations out
+        # |p - SMA| = k * STDDEV solved for the newest close
+        d = k * math.sqrt(p * m2 / ((p - 1) * (p - 1 - k * k)))
+        return _below(mean - d), _above(mean + d)
+
+    def _rsi_rule(self, p, lower, upper):
+        if len(self._close) <= p:
+            return _EMPTY, _EMPTY
+        avg_gain, avg_loss = _wilder_averages(self._close, p)
+        gain, loss = avg_gain[-1] * (p - 1), avg_loss[-1] * (p - 1)
+        prev = self._close[-1]
+
+        def crossing(level):
+            r = level / 100.0
+            up = r * loss / (1 - r) - gain
+            return prev + (up if up >= 0 else gain + loss - gain / r)
+
+        return _below(crossing(lower)), _above(crossing(upper))
+
+    def _macd_rule(self, fastperiod, slowperiod, signalperiod):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+        if len(self._close) < slowperiod + signalperiod - 1 or fastperiod == slowperiod:
+            return _EMPTY, _EMPTY
+        fast, slow, _, signal = _macd_lines(self._close, fastperiod, slowperiod, signalperiod)
+        af, aslow = 2.0 / (fastperiod + 1), 2.0 / (slowperiod + 1)
+        # MACD_t > signal_t  <=>  MACD_t > signal_t-1
+        threshold = (signal[-1] - (1 - af) * fast[-1] + (1 - aslow) * slow[-1]) / (af - aslow)
+        return _above(threshold), _below(threshold)
+
+    # Rules that depend on the forming bar's range ---------------------------
+
+    def _fastk_history(self):
+        k, slowk, slowd = self.stoch_periods
+        if len(self._close) < k + slowk + slowd - 3:
+            return None
+        lowest = rolling_min(self._low, k)
+        span = rolling_max(self._high, k) - lowest
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fastk = np.where(span > 0, 100.0 * (self._close[k - 1:] - lowest) / span, 0.0)
+        return fastk[len(fastk) - (slowk + slowd - 2):]
+
+    def cci(self, price):
+        """CCI of the forming bar if it closed at `price`."""
+        high, low = max(self.bar_high, price), min(self.bar_low, price)
+        window = np.r_[self._typical[len(self._typical) - (self.cci_period - 1):], (high + low + price) / 3.0]
+        mean = window.mean()
+        deviation = np.abs(window - mean).mean()
+        return (window[-1] - mean) / (0.015 * deviation) if deviation > 0 else 0.0
+
+    def stoch(self, price):
+        """(slowk, slowd) of the forming bar if it closed at `price`."""
+        k, slowk, slowd = self.stoch_periods
+        highest = max(self._high[len(self._high) - (k - 1):].max(initial=-math.inf), self.bar_high, price)
+        lowest = min(self._low[len(self._low) - (k - 1):].min(initial=math.inf), self.bar_low, price)
+        span = highest - lowest
+        fastk = np.r_[self._fastk, 100.0 * (price - lowest) / span if span > 0 else 0.0]
+        ks = np.convolve(fastk, np.full(slowk, 1.0 / slowk), 'valid')
+        return ks[-1], ks[len(ks) - slowd:].mean()
+
+    def _range_rules(self):
+        rules = dict(self._fixed)
+        guess = self.reference
+        if len(self._typical) >= self.cci_period - 1:
+            level = self.cci_level
+            rules['cci'] = (_below(_solve(self.cci, -level, guess)), _above(_solve(self.cci, level, guess)))
+        else:
+            rules['cci'] = (_EMPTY, _EMPTY)
+        if self._fastk is not None:
+            low, high = self.stoch_levels
+            # Both lines rise with the close: buy needs the larger below `low`, sell the smaller above `high`
+            rules['stoch'] = (_below(_solve(lambda p: max(self.stoch(p)), low, guess)),
+                              _above(_solve(lambda p: min(self.stoch(p)), high, guess)))
+        else:
+            rules['stoch'] = (_EMPTY, _EMPTY)
+        self.rules = rules
+        self.buy = self._intersect(buy for buy, _ in rules.values())
+        self.sell = self._intersect(sell for _, sell in rules.values())
+
+    def _intersect(self, intervals):
+        lo, hi = _ALL
+        for a, b in intervals:
+            lo, hi = max(lo, a), min(hi, b)
+        if lo >= hi:
+            return _EMPTY
+        return lo * (1 - self.tolerance), hi * (1 + self.tolerance)
+
+    def extend_range(self, price):
+        """Stretch the forming bar's high/low to `price`; returns True if the intervals were recomputed."""
+        if self.bar_low <= price <= self.bar_high:
+            return False
+        self.bar_high = max(self.bar_high, price)
+        self.bar_low = min(self.bar_low, price)
+        self._range_rules()
+        return True
+
+    def signal_possible(self, price):
+        """'buy' or 'sell' if the rules could hold at `price`, else None."""
+        if self.buy[0] < price < self.buy[1]:
+            return 'buy'
+        if self.sell[0] < price < self.sell[1]:
+            return 'sell'
+        return None
+
+
+class SignalGate:
+    """
+    Per-symbol tick gate in front of the full signal evaluation.
+
+    on_bars() arms a symbol with the bars of a full evaluation; needs_evaluation()
+    then answers per tick whether the rules could flip at that price. Symbols
+    without triggers for the current bar always need an evaluation.
+
+    :param timeframe_ms: Bar length, to tell when the triggers of a symbol are stale
+    :param params: SignalTriggers parameters
+    """
+
+    def __init__(self, timeframe_ms=60_000, **params):
+        self.timeframe_ms = timeframe_ms
+        self.params = params
+        self.triggers = {}
+        self.bar_start = {}
+        self.ticks = 0
+        self.evaluations = 0
+
+    def on_bars(self, symbol, timestamps, high, low, close):
+        """Arm `symbol` from bars whose last row is the forming bar (timestamps in ms or datetime64)."""
+        last = timestamps[-1]
+        if isinstance(last, np.datetime64):
+            last = last.astype('datetime64[ms]').astype(np.int64)
+        self.bar_start[symbol] = int(last)
+        self.triggers[symbol] = SignalTriggers(high, low, close, **self.params)
+        return self.triggers[symbol]
+
+    def on_frame(self, symbol, df):
+        """Arm `symbol` from a fetch_historical_prices DataFrame (timestamp index)."""
+        return self.on_bars(symbol, df.index.values, df['high'].values, df['low'].values, df['close'].values)
+
+    def needs_evaluation(self, symbol, price, timestamp):
+        """True unless the armed triggers prove no rule set can hold at `price` (timestamp in ms)."""
+        self.ticks += 1
+        triggers = self.triggers.get(symbol)
+        start = self.bar_start.get(symbol)
+        if triggers is None or timestamp is None or timestamp >= start + self.timeframe_ms:
+            self.evaluations += 1
+            return True
+        triggers.extend_range(price)
+        if triggers.signal_possible(price) is not None:
+            self.evaluations += 1
+            return True
+        return False
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'evaluations': self.evaluations,
+            'skipped': self.ticks - self.evaluations,
+            'symbols': len(self.triggers),
+        }
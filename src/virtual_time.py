@@ -0,0 +1,322 @@
+"""
+Virtual-clock replay of the bots' trade loops over recorded candles.
+
+VirtualEventLoop is an asyncio event loop whose time() is a VirtualClock:
+whenever every task is waiting on a timer (asyncio.sleep, wait_for deadlines,
+hedge delays), the loop jumps the clock to the next timer instead of blocking,
+so a `await asyncio.sleep(60)` costs no wall time. Real I/O is still polled,
+and the loop only blocks when nothing is scheduled at all or while executor
+work (asyncio.to_thread, run_in_executor) is outstanding, which it waits for
+before moving the clock. Computation takes no virtual time, so a run depends only on the data and the bot's logic: the
+same dataset, start and duration give the same orders (set PYTHONHASHSEED too
+if a bot iterates over sets of symbols).
+
+ReplayExchange serves candles recorded by src.backfill at the virtual time,
+without lookahead: the candle containing the current time only shows its open,
+and tickers and fills are priced at that open. run_bot() imports a bot module
+unmodified, points its exchange (and its `time` module, if it uses one) at the
+replay, and drives its entry point for the requested span of market time:
+
+    python -m src.virtual_time automain --data data --start 2024-03-01 --hours 24
+
+smoke_check() (--smoke) records simulated candles to a temporary dataset,
+replays a bot over them and fails unless the bot reached the exchange.
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import importlib
+import json
+import logging
+import os
+import selectors
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+from src.backfill import timeframe_ms
+from src.sim_exchange import RecordedExchange
+
+logger = logging.getLogger(__name__)
+
+# bot module -> (entry coroutine, seconds between calls for one-shot entries, None for entries that loop)
+ENTRIES = {
+    'main': ('trade', 60),
+    'new': ('trade', None),
+    'autobest': ('trade', None),
+    'automain': ('trade', None),
+    'combo': ('main', None),
+}
+
+
+class VirtualClock:
+    """Market time starting at `start_ms`; only moves when advanced."""
+
+    def __init__(self, start_ms):
+        self.start_ms = start_ms
+        self.elapsed = 0.0
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return self.start_ms / 1000 + self.elapsed
+
+    def ms(self):
+        return self.start_ms + self.elapsed * 1000
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Polls real I/O without blocking and advances the clock by the loop's timeout instead."""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.executor_jobs = 0  # run_in_executor futures not yet done
+
+    def select(self, timeout=None):
+        if timeout is None or (self.executor_jobs and timeout > 0):
+            # Nothing scheduled, or executor work running that must finish before any timer: only real
+            # I/O (e.g. the executor reporting back) can wake the loop
+            return super().select(None)
+        events = super().select(0)
+        if not events and timeout > 0:
+            self.clock.advance(timeout)
+        return events
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        self._virtual_selector = _VirtualSelector(clock)
+        super().__init__(self._virtual_selector)
+        self.clock = clock
+
+    def time(self):
+        return self.clock.monotonic()
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self._virtual_selector.executor_jobs += 1
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _executor_job_done(self, future):
+        self._virtual_selector.executor_jobs -= 1
+
+
+def virtual_time_module(clock):
+    """A stand-in for a bot module's `time` whose time() and monotonic() follow `clock`."""
+    proxy = types.ModuleType('time')
+    proxy.__dict__.update(time.__dict__)
+    proxy.time = clock.time
+    proxy.time_ns = lambda: int(clock.time() * 1e9)
+    proxy.monotonic = clock.monotonic
+    proxy.monotonic_ns = lambda: int(clock.monotonic() * 1e9)
+    return proxy
+
+
+class ReplayExchange(RecordedExchange):
+    """
+    RecordedExchange at a moving clock, without lookahead. Fills are kept in
+    `orders` in execution order.
+    """
+
+    def __init__(self, root, timeframe='1m', symbols=None, clock=None, **kwargs):
+        super().__init__(root, timeframe, symbols, clock=clock, **kwargs)
+        self.orders = []
+
+    def _current(self, symbol, now):
+        """(open time, open) of the recorded bar containing `now`, or None past the data."""
+        columns = self.data[symbol]
+        i = int(np.searchsorted(columns['timestamp'], now, 'right')) - 1
+        if i < 0:
+            return None
+        return int(columns['timestamp'][i]), float(columns['open'][i] if columns['timestamp'][i] + self.step > now
+                                                   else columns['close'][i])
+
+    def _last(self, symbol, now):
+        current = self._current(symbol, now)
+        return current[1] if current else float(self.data[symbol]['open'][0])
+
+    def _bars(self, symbol, step, start, stop):
+        now = int(self.clock())
+        forming = now - now % self.step
+        rows = super()._bars(symbol, step, start, min(stop, forming))
+        current = self._current(symbol, now)
+        if current is None or current[0] != forming or not start <= forming < stop:
+            return rows
+        bar = forming - forming % step
+        price = current[1]
+        if rows and rows[-1][0] == bar:
+            rows[-1] = [bar, rows[-1][1], max(rows[-1][2], price), min(rows[-1][3], price), price, rows[-1][5]]
+        else:
+            rows.append([bar, price, price, price, price, 0.0])
+        return rows
+
+    async def _fill(self, symbol, side, amount):
+        order = await super()._fill(symbol, side, amount)
+        self.orders.append(order)
+        return order
+
+
+async def _drive(entry, interval, duration):
+    async def repeat():
+        while True:
+            await entry()
+            await asyncio.sleep(interval)
+
+    try:
+        await asyncio.wait_for(repeat() if interval else entry(), duration)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _no_stream(*args, **kwargs):
+    logger.info("Live streams are not replayed; the bot runs on recorded candles only")
+
+
+def run_bot(bot, exchange, clock, duration):
+    """
+    Run a bot's entry point for `duration` seconds of market time on a
+    VirtualEventLoop; returns a summary of the run.
+    """
+    from src.exchange_client import SingleFlightExchange
+    from src.profiling import _ensure_config
+
+    _ensure_config()
+    module = importlib.import_module(bot)
+    entry, interval = ENTRIES[bot]
+    module.exchange = SingleFlightExchange(exchange, session=None)
+    if isinstance(getattr(module, 'time', None), types.ModuleType):
+        module.time = virtual_time_module(clock)
+    for stream in ('capture', 'stream_depth'):
+        if stream in vars(module):
+            setattr(module, stream, _no_stream)
+
+    loop = VirtualEventLoop(clock)
+    asyncio.set_event_loop(loop)
+    started = time.perf_counter()
+    try:
+        loop.run_until_complete(_drive(getattr(module, entry), interval, duration))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    wall = time.perf_counter() - started
+
+    orders = [{key: order[key] for key in ('symbol', 'side', 'amount', 'price', 'timestamp')}
+              for order in exchange.orders]
+    digest = hashlib.sha256(json.dumps(orders, sort_keys=True).encode()).hexdigest()[:16]
+    return {
+        'bot': bot,
+        'start': datetime.datetime.fromtimestamp(clock.start_ms / 1000, tz=datetime.timezone.utc).isoformat(),
+        'market_seconds': clock.elapsed,
+        'wall_seconds': wall,
+        'speedup': clock.elapsed / wall if wall else float('inf'),
+        'orders': len(orders),
+        'orders_digest': digest,
+        'balances': {k: v for k, v in exchange.balances.items() if v},
+        'calls': dict(exchange.calls),
+    }
+
+
+def _check_executor_jobs():
+    """Executor work must finish at the virtual time it started, ahead of any timer."""
+    clock = VirtualClock(0)
+    loop = VirtualEventLoop(clock)
+    try:
+        loop.run_until_complete(asyncio.wait_for(asyncio.to_thread(time.sleep, 0.01), 60))
+    except asyncio.TimeoutError:
+        raise AssertionError("the virtual clock ran past an executor job") from None
+    finally:
+        loop.close()
+    if clock.elapsed:
+        raise AssertionError(f"an executor job took {clock.elapsed} virtual seconds")
+
+
+def smoke_check(bot, hours=3.0, n_symbols=5, seed=0):
+    """
+    Replay `bot` for `hours` over candles recorded from the simulated exchange;
+    raises AssertionError if it never called the exchange. Returns the summary.
+    """
+    from src.backfill import backfill
+    from src.profiling import SYMBOLS
+    from src.sim_exchange import SimulatedExchange
+
+    _check_executor_jobs()
+    end = int(datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    symbols = [f"SIM{i}/USDT" for i in range(n_symbols)] + SYMBOLS.get(bot, [])
+    sim = SimulatedExchange(symbols, seed=seed, clock=lambda: end)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        data = os.path.join(root, 'data')
+        asyncio.run(backfill(sim, data, symbols, ['1m'], end - 86_400_000, end=end, weight_per_minute=10 ** 9))
+        exchange = ReplayExchange(data, '1m')
+        clock = VirtualClock(end - int(hours * 3_600_000))
+        exchange.clock = clock.ms
+        sys.path.insert(0, cwd)
+        os.chdir(root)
+        try:
+            summary = run_bot(bot, exchange, clock, hours * 3600)
+        finally:
+            os.chdir(cwd)
+            sys.path.remove(cwd)
+    if not summary['calls']:
+        raise AssertionError(f"{bot} made no exchange calls in {hours} replayed hours")
+    return summary
+
+
+def _main(args):
+    if args.smoke:
+        summary = smoke_check(args.bot, args.hours or 3.0)
+        print(json.dumps(summary, indent=2))
+        return summary
+    if not args.data:
+        raise SystemExit("--data is required unless --smoke is given")
+    data = os.path.abspath(args.data)
+    step = timeframe_ms(args.timeframe)
+    exchange = ReplayExchange(data, args.timeframe, args.symbols or None, latency=args.latency,
+                              balances={'USDT': args.balance})
+    if not exchange.data:
+        raise SystemExit(f"No {args.timeframe} candles recorded under {data}")
+    first = min(int(c['timestamp'][0]) for c in exchange.data.values())
+    last = max(int(c['timestamp'][-1]) for c in exchange.data.values()) + step
+    if args.start:
+        start = int(datetime.datetime.fromisoformat(args.start).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    else:
+        start = first + args.warmup * step
+    duration = args.hours * 3600 if args.hours else (last - start) / 1000
+    clock = VirtualClock(start)
+    exchange.clock = clock.ms
+
+    # Bots keep their state journals under relative paths; keep the replay's away from the real ones
+    sys.path.insert(0, os.getcwd())
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    summary = run_bot(args.bot, exchange, clock, duration)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Replay a bot's trade loop over recorded candles on a virtual clock")
+    parser.add_argument('bot', choices=sorted(ENTRIES))
+    parser.add_argument('--data', help="Backfill dataset root")
+    parser.add_argument('--smoke', action='store_true',
+                        help="Replay over freshly recorded simulated candles and fail if the bot makes no calls")
+    parser.add_argument('--timeframe', default='1m', help="Recorded timeframe in --data")
+    parser.add_argument('--symbols', nargs='*', help="Symbols to replay (default: every recorded symbol)")
+    parser.add_argument('--start', help="UTC start (ISO date/time); default: first candle plus --warmup bars")
+    parser.add_argument('--warmup', type=int, default=300, help="Recorded bars before the default start")
+    parser.add_argument('--hours', type=float, help="Market hours to replay (default: to the end of the data)")
+    parser.add_argument('--balance', type=float, default=1000.0, help="Starting USDT balance")
+    parser.add_argument('--latency', type=float, default=0.0, help="Virtual seconds per exchange call")
+    parser.add_argument('--workdir', default='replay', help="Working directory for the bot's state files")
+    _main(parser.parse_args())
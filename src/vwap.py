@@ -1,7 +1,158 @@
+from collections import deque
+
+import numpy as np
 import pandas as pd
 
+DAY_MS = 86_400_000
+
+
 def vwap(prices, volumes):
     if volumes.sum() == 0:
         return pd.Series([None]*len(prices))
     cumulative_vwap = (prices * volumes).cumsum() / volumes.cumsum()
     return cumulative_vwap
+
+
+def _as_float_arrays(prices, volumes):
+    prices = np.asarray(prices, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    if prices.shape != volumes.shape:
+        raise ValueError("prices and volumes must have the same shape")
+    return prices, volumes
+
+
+def _padded_cumsum(values):
+    # Leading zero row so that window sums are csum[end] - csum[start]
+    out = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=out[1:])
+    return out
+
+
+def _ratio(pv, v):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(v > 0, pv / np.where(v > 0, v, 1.0), np.nan)
+
+
+def rolling_vwap(prices, volumes, window, min_periods=None):
+    """
+    VWAP over the last `window` bars, computed from differences of cumulative sums.
+
+    :param prices: Array of shape (n_bars,) or (n_bars, n_symbols)
+    :param volumes: Array of the same shape as prices
+    :param window: Number of bars in the window
+    :param min_periods: Bars required before a value is produced (defaults to window)
+    :return: NumPy array of the input shape, NaN where undefined
+    """
+    prices, volumes = _as_float_arrays(prices, volumes)
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    min_periods = window if min_periods is None else min_periods
+    n = prices.shape[0]
+    pv = _padded_cumsum(prices * volumes)
+    v = _padded_cumsum(volumes)
+    end = np.arange(1, n + 1)
+    start = np.maximum(end - window, 0)
+    result = _ratio(pv[end] - pv[start], v[end] - v[start])
+    result[:min(max(min_periods - 1, 0), n)] = np.nan
+    return result
+
+
+def session_ids(timestamps, session_ms=DAY_MS, offset_ms=0):
+    """Session number of each timestamp (ms ints or datetime64); UTC days by default."""
+    ms = np.asarray(timestamps)
+    if not np.issubdtype(ms.dtype, np.integer):
+        ms = ms.astype('datetime64[ms]').astype(np.int64)
+    return (ms - offset_ms) // session_ms
+
+
+def session_vwap(prices, volumes, timestamps, session_ms=DAY_MS, offset_ms=0):
+    """
+    VWAP anchored to the start of each session, resetting at every session boundary
+    (UTC midnight by default).
+
+    :param prices: Array of shape (n_bars,) or (n_bars, n_symbols)
+    :param volumes: Array of the same shape as prices
+    :param timestamps: Bar timestamps (ms or datetime64), shared by all symbols
+    :return: NumPy array of the input shape, NaN where no volume has traded yet
+    """
+    prices, volumes = _as_float_arrays(prices, volumes)
+    sessions = session_ids(timestamps, session_ms, offset_ms)
+    if sessions.shape[0] != prices.shape[0]:
+        raise ValueError("timestamps must have one entry per bar")
+    n = prices.shape[0]
+    pv = _padded_cumsum(prices * volumes)
+    v = _padded_cumsum(volumes)
+    # Index of the first bar of the session each bar belongs to
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = sessions[1:] != sessions[:-1]
+    start = np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+    end = np.arange(1, n + 1)
+    return _ratio(pv[end] - pv[start], v[end] - v[start])
+
+
+def vwap_panel(df, window=None, price='close', volume='volume', symbol='symbol', timestamp=None,
+               session_ms=DAY_MS):
+    """
+    Batch VWAP for many symbols stored in one long DataFrame.
+
+    Rows are grouped by `symbol` (keeping their order inside each group); with a
+    window the VWAP is rolling, otherwise it is session-anchored on `timestamp`
+    (or the index when timestamp is None).
+
+    :return: pd.Series aligned with df
+    """
+    out = np.empty(len(df))
+    times = df.index.values if timestamp is None else df[timestamp].values
+    prices = df[price].to_numpy(dtype=np.float64)
+    volumes = df[volume].to_numpy(dtype=np.float64)
+    for rows in df.groupby(symbol, sort=False).indices.values():
+        if window is None:
+            out[rows] = session_vwap(prices[rows], volumes[rows], times[rows], session_ms)
+        else:
+            out[rows] = rolling_vwap(prices[rows], volumes[rows], window)
+    return pd.Series(out, index=df.index, name='vwap')
+
+
+class VwapState:
+    """
+    Incremental VWAP: O(1) per bar, for live updates after a batch warm-up.
+
+    :param window: Rolling window in bars, or None for no rolling window
+    :param session_ms: Session length for session-anchored resets, or None
+    :param offset_ms: Session start offset from UTC midnight
+    """
+
+    def __init__(self, window=None, session_ms=None, offset_ms=0):
+        self.window = window
+        self.session_ms = session_ms
+        self.offset_ms = offset_ms
+        self.session = None
+        self.bars = deque()
+        self.pv = 0.0
+        self.v = 0.0
+
+    @property
+    def value(self):
+        return self.pv / self.v if self.v > 0 else np.nan
+
+    def reset(self):
+        self.bars.clear()
+        self.pv = 0.0
+        self.v = 0.0
+
+    def update(self, price, volume, timestamp=None):
+        if self.session_ms is not None and timestamp is not None:
+            session = (int(timestamp) - self.offset_ms) // self.session_ms
+            if session != self.session:
+                self.session = session
+                self.reset()
+        pv = price * volume
+        self.pv += pv
+        self.v += volume
+        if self.window is not None:
+            self.bars.append((pv, volume))
+            if len(self.bars) > self.window:
+                old_pv, old_v = self.bars.popleft()
+                self.pv -= old_pv
+                self.v -= old_v
+        return self.value